@@ -4,32 +4,80 @@ Database integration for the Analyzer service.
 This module contains the necessary functions to update the state of documents
 in the database as they progress through the processing pipeline.
 """
+import functools
+import itertools
 import logging
 import os
+import threading
 import uuid
-from typing import Optional, Union, Any
+from collections import deque
+from typing import Dict, FrozenSet, Optional, Union, Any
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, update
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import bindparam, create_engine, update
+from sqlalchemy.sql.dml import Update
+
+from analyzer.db.models.document import Document, ProcessingStatus
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# UPDATE statements keyed by the set of columns they assign. Only a handful
+# of combinations occur in practice, and reusing the same bindparam-based
+# construct lets SQLAlchemy's compiled cache hit on every call.
+_UPDATE_STATEMENTS: Dict[FrozenSet[str], Update] = {}
+
+
+def _get_update_statement(fields: FrozenSet[str]) -> Update:
+    """
+    Return the cached UPDATE statement for the given set of columns.
+
+    Args:
+        fields: Names of the Document columns to set
+
+    Returns:
+        UPDATE statement with a ``doc_id`` bind parameter for the row and one
+        bind parameter per column
+    """
+    stmt = _UPDATE_STATEMENTS.get(fields)
+    if stmt is None:
+        stmt = (
+            update(Document)
+            .where(Document.id == bindparam("doc_id"))
+            .values({field: bindparam(field) for field in sorted(fields)})
+        )
+        _UPDATE_STATEMENTS[fields] = stmt
+    return stmt
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_uuid(value: str) -> uuid.UUID:
+    """Parse a document ID; memoized since each document is updated at every stage."""
+    return uuid.UUID(value)
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_status(value: str) -> ProcessingStatus:
+    """Look up a ProcessingStatus member by name."""
+    return ProcessingStatus[value]
+
 
 class DatabaseUpdater:
     """Class to handle database updates."""
 
+    # Attempts to write a batch of status updates before it is dropped
+    MAX_FLUSH_ATTEMPTS = 3
+
     def __init__(
             self,
             host=None,
             port=None,
             user=None,
             password=None,
-            db_name=None
+            db_name=None,
+            batch_size=None,
+            flush_interval=None
     ):
         """
         Initialize the database updater.
@@ -40,21 +88,44 @@ class DatabaseUpdater:
             user: Database user
             password: Database password
             db_name: Database name
+            batch_size: Number of queued status updates that triggers a flush
+            flush_interval: Seconds after which queued updates are flushed even
+                if the batch isn't full
         """
         self.host = host or os.environ.get("POSTGRES_HOST", "postgres")
         self.port = port or os.environ.get("POSTGRES_PORT", "5432")
         self.user = user or os.environ.get("POSTGRES_USER", "postgres")
         self.password = password or os.environ.get("POSTGRES_PASSWORD", "postgres")
         self.db_name = db_name or os.environ.get("POSTGRES_DB", "hcc_extractor")
+        self.batch_size = batch_size or int(os.environ.get("DB_UPDATE_BATCH_SIZE", "1"))
+        self.flush_interval = flush_interval or float(os.environ.get("DB_UPDATE_FLUSH_INTERVAL", "1.0"))
 
         self.engine = self._create_engine()
-        self.Session = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self._pending: deque = deque()
+        # Timer flushing a partial batch, so queued updates don't wait for
+        # the batch to fill up
+        self._flush_timer: Optional[threading.Timer] = None
+        self._timer_lock = threading.Lock()
+        # Held from draining the queue until the commit, so flushes from the
+        # timer and from a full batch cannot commit out of order
+        self._flush_lock = threading.Lock()
+        # Consecutive failed flushes of the batch at the head of the queue
+        self._failed_flushes = 0
 
     def _create_engine(self):
-        """Create and return a database connection."""
-        connection_string = f"postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.db_name}"
-        logger.info(f"Connecting to database at {self.host}:{self.port}")
-        return create_engine(connection_string)
+        """Create and return a pooled database engine."""
+        connection_string = f"postgresql+psycopg://{self.user}:{self.password}@{self.host}:{self.port}/{self.db_name}"
+        logger.info("Connecting to database at %s:%s", self.host, self.port)
+        return create_engine(
+            connection_string,
+            pool_pre_ping=True,
+            pool_size=5,
+            max_overflow=10,
+            # The status updater only runs a handful of distinct UPDATEs, so
+            # prepare them server-side on first use; psycopg also pipelines
+            # executemany, keeping batched updates to one round trip
+            connect_args={"prepare_threshold": 0},
+        )
 
     def update_document_analysis_status(
             self,
@@ -76,26 +147,20 @@ class DatabaseUpdater:
             status: Current processing status
             extraction_result_path: Path to the extraction results file
         """
-        session = None
         try:
-            session = self.Session()
-
-            # Import here to avoid circular import issues
-            from analyzer.db.models.document import Document, ProcessingStatus
-
             # Convert status to enum if it's a string
             if isinstance(status, str):
                 try:
-                    status = ProcessingStatus[status]
+                    status = _parse_status(status)
                 except (KeyError, TypeError):
-                    logger.warning(f"Invalid status: {status}, using original value")
+                    logger.warning("Invalid status: %s, using original value", status)
 
             # Convert UUID string to UUID object safely
             try:
                 # Create UUID object but don't cast to ::UUID in SQL yet
-                document_uuid = uuid.UUID(document_id)
+                document_uuid = _parse_uuid(document_id)
             except (ValueError, TypeError, AttributeError):
-                logger.error(f"Error updating document status: badly formed hexadecimal UUID string")
+                logger.error("Error updating document status: badly formed hexadecimal UUID string")
                 return
 
             # Prepare values to update
@@ -121,24 +186,81 @@ class DatabaseUpdater:
                 logger.warning("No values provided for update")
                 return
 
-            # Create and execute the update - using the UUID object directly, not as string
-            stmt = (
-                update(Document)
-                .where(Document.id == document_uuid)
-                .values(**values)
-            )
-
-            session.execute(stmt)
-            session.commit()
-            logger.info(f"Updated document {document_id} status to {status}")
+            # Queue the update - using the UUID object directly, not as string
+            self._pending.append((document_uuid, values))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+            else:
+                self._schedule_flush()
 
         except Exception as e:
-            logger.error(f"Error updating document status: {str(e)}")
-            if session:
-                session.rollback()
-        finally:
-            if session:
-                session.close()
+            logger.error("Error updating document status: %s", e)
+
+    def _schedule_flush(self) -> None:
+        """Start the flush timer for a partial batch, unless it is already running."""
+        with self._timer_lock:
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self) -> None:
+        """
+        Write all queued status updates in a single transaction.
+
+        Consecutive updates that set the same columns are sent as one
+        executemany call. Updates are applied in the order they were queued,
+        and flushes run one at a time, so successive status changes for a
+        document are never reordered. Updates may be queued from other
+        threads while a flush runs. If the transaction fails, the updates are
+        put back at the head of the queue and retried, up to
+        ``MAX_FLUSH_ATTEMPTS`` times.
+        """
+        # Whatever is queued now goes out with this flush
+        with self._timer_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+        with self._flush_lock:
+            if not self._pending:
+                return
+
+            # Drain with popleft, which is atomic, so updates queued by other
+            # threads while flushing are kept for the next flush
+            pending = []
+            while True:
+                try:
+                    pending.append(self._pending.popleft())
+                except IndexError:
+                    break
+
+            try:
+                # Plain UPDATEs don't need the ORM unit of work; engine.begin()
+                # commits on success and rolls back if execute raises
+                with self.engine.begin() as conn:
+                    for fields, group in itertools.groupby(pending, key=lambda item: frozenset(item[1])):
+                        params = [{"doc_id": document_uuid, **values} for document_uuid, values in group]
+                        conn.execute(_get_update_statement(fields), params)
+                self._failed_flushes = 0
+                logger.info("Updated status for %d document(s)", len(pending))
+
+            except Exception as e:
+                self._failed_flushes += 1
+                if self._failed_flushes >= self.MAX_FLUSH_ATTEMPTS:
+                    self._failed_flushes = 0
+                    logger.error(
+                        "Error updating document status, dropping %d update(s): %s", len(pending), e
+                    )
+                    return
+
+                logger.error("Error updating document status, will retry: %s", e)
+                # Retry ahead of anything queued meanwhile, keeping the order
+                self._pending.extendleft(reversed(pending))
+
+        # Cover only updates put back or queued while flushing
+        if self._pending:
+            self._schedule_flush()
 
 
 # Global instance for easy access
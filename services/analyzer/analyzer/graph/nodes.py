@@ -4,14 +4,127 @@ Nodes for the LangGraph analysis workflow.
 This module defines the individual processing nodes used in the analysis
 workflow graph, including HCC relevance determination and verification.
 """
+import asyncio
+import itertools
 import logging
 import math
-from typing import Dict, List, TypedDict, Optional, Any, Union
+import weakref
+from typing import Dict, FrozenSet, List, TypedDict, Optional, Any, Tuple, Union
 
-from analyzer.llm.client import GeminiClient
+from langgraph.constants import Send
+
+from analyzer.llm.batcher import request_batcher
+from analyzer.llm.client import GeminiClient, fix_nan_values
 from analyzer.models.condition import Condition
 from analyzer.graph.state import GraphState
 
+# HCC code indexes built by determine_hcc_relevance for states that carry no
+# prebuilt index, keyed by id() of the source list. The list itself is kept
+# alongside so its id cannot be reused while cached.
+_HCC_INDEX_CACHE_SIZE = 4
+_hcc_index_cache: Dict[int, Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]] = {}
+
+# Uncertain conditions are sent to the LLM in shards of this size, one
+# concurrent request per shard
+LLM_SHARD_SIZE = 20
+
+# Number of HCC reference codes included in the LLM prompt
+HCC_PROMPT_SAMPLE_SIZE = 50
+
+# Gemini clients shared by the enrichment nodes. Async model calls go through a
+# gRPC channel bound to the event loop that first used it, so each loop gets
+# its own client; synchronous calls share one.
+_llm_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, GeminiClient]" = (
+    weakref.WeakKeyDictionary()
+)
+_sync_llm_client: Optional[GeminiClient] = None
+
+
+def build_hcc_index(hcc_codes: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Build a map from HCC-relevant ICD code to its reference row.
+
+    Codes are upper-cased and indexed in both dotted and dot-less form.
+
+    Args:
+        hcc_codes: Reference list of HCC-relevant codes
+
+    Returns:
+        Dictionary of reference rows keyed by normalized ICD code
+    """
+    hcc_index = {}
+    for code in hcc_codes:
+        raw_code = code["ICD-10-CM Codes"].strip().upper()
+        hcc_index[raw_code] = code
+        hcc_index[raw_code.replace(".", "")] = code
+    return hcc_index
+
+
+def _get_hcc_index(hcc_codes: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the HCC code index for a reference list, building it once per list.
+
+    Used when the state carries no prebuilt index. Callers must not mutate the
+    list after it has been indexed.
+
+    Args:
+        hcc_codes: Reference list of HCC-relevant codes
+
+    Returns:
+        Dictionary of reference rows keyed by normalized ICD code
+    """
+    cached = _hcc_index_cache.get(id(hcc_codes))
+    if cached is not None and cached[0] is hcc_codes:
+        return cached[1]
+
+    hcc_index = build_hcc_index(hcc_codes)
+
+    # Evict the oldest entry once the cache is full
+    if len(_hcc_index_cache) >= _HCC_INDEX_CACHE_SIZE:
+        _hcc_index_cache.pop(next(iter(_hcc_index_cache)))
+
+    _hcc_index_cache[id(hcc_codes)] = (hcc_codes, hcc_index)
+    return hcc_index
+
+
+def _get_llm_client(hcc_codes: Optional[List[Dict[str, Any]]] = None) -> GeminiClient:
+    """
+    Get the Gemini client shared by the enrichment nodes.
+
+    The client holds no per-request state, so one instance per event loop
+    (and one for synchronous callers) serves every run, and its model is
+    created once rather than once per call.
+
+    Args:
+        hcc_codes: HCC codes sample for the prompt; a new client builds its
+            prompt preamble from them once, and requests with other codes
+            build theirs per request
+
+    Returns:
+        Shared Gemini client for the calling context
+    """
+    global _sync_llm_client
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        if _sync_llm_client is None:
+            _sync_llm_client = GeminiClient(hcc_codes=hcc_codes)
+        return _sync_llm_client
+
+    client = _llm_clients.get(loop)
+    if client is None:
+        client = _llm_clients[loop] = GeminiClient(hcc_codes=hcc_codes)
+    return client
+
+
+def _reset_llm_clients() -> None:
+    """Drop the shared Gemini clients, so the next call creates new ones."""
+    global _sync_llm_client
+
+    _llm_clients.clear()
+    _sync_llm_client = None
+
 
 def load_hcc_codes(state: GraphState) -> GraphState:
     """
@@ -45,7 +158,7 @@ def prepare_conditions(state: GraphState) -> GraphState:
         state["analyzed_conditions"] = []
 
     # Get conditions from state
-    conditions = state.get("conditions", [])
+    conditions = state["conditions"]
 
     # Check if there are conditions to analyze
     if not conditions:
@@ -64,35 +177,40 @@ def determine_hcc_relevance(state: GraphState) -> GraphState:
     Returns:
         Updated state with HCC relevance determinations
     """
-    conditions = state.get("conditions", [])
-    hcc_codes = state.get("hcc_codes", [])
+    conditions = state["conditions"]
 
-    # Create a dictionary for quick lookup of HCC-relevant codes
-    hcc_code_dict = {code["ICD-10-CM Codes"]: code for code in hcc_codes}
-
-    # Also create a version without dots for matching
-    hcc_code_dict_no_dot = {
-        code["ICD-10-CM Codes"].replace(".", ""): code
-        for code in hcc_codes
-    }
+    # HCC codes in both their dotted and dot-less forms, prebuilt by the pipeline
+    hcc_index = state.get("hcc_code_index")
+    if hcc_index is None:
+        hcc_index = _get_hcc_index(state["hcc_codes"])
 
+    # Conditions are updated in place, so no copies are made; the lookups are
+    # C-level dict probes, bound once for the loop
+    lookup = hcc_index.get
     for condition in conditions:
-        # Get the ICD code
-        icd_code = condition.icd_code
-        icd_code_no_dot = condition.metadata.get("icd_code_no_dot")
-        if not icd_code_no_dot and icd_code:
-            icd_code_no_dot = icd_code.replace(".", "")
-            condition.metadata["icd_code_no_dot"] = icd_code_no_dot
-
-        # Check if the ICD code is HCC-relevant
-        is_hcc_relevant = False
-        if icd_code in hcc_code_dict:
-            is_hcc_relevant = True
-        elif icd_code_no_dot and icd_code_no_dot in hcc_code_dict_no_dot:
-            is_hcc_relevant = True
+        icd_code = condition.icd_code.strip().upper() if condition.icd_code else None
+        icd_code_no_dot = condition.metadata.get("icd_code_no_dot") or (
+            icd_code.replace(".", "") if icd_code else None
+        )
+        hcc_row = lookup(icd_code)
+        if hcc_row is None and icd_code_no_dot != icd_code:
+            hcc_row = lookup(icd_code_no_dot)
 
         # Update condition metadata
-        condition.metadata["is_hcc_relevant"] = is_hcc_relevant
+        if icd_code_no_dot:
+            condition.metadata["icd_code_no_dot"] = icd_code_no_dot
+        condition.metadata["is_hcc_relevant"] = hcc_row is not None
+
+        # An exact hit in the reference set resolves a condition that would
+        # otherwise go to the LLM, so only the remaining ones are sent. The
+        # reference has no HCC category column (Tags holds the HCC code and
+        # Description describes the ICD code), so hcc_category stays unset
+        if hcc_row is not None and condition.confidence < 0.9:
+            condition.hcc_relevant = True
+            condition.hcc_code = hcc_row.get("Tags") or condition.hcc_code
+            condition.confidence = 1.0
+            condition.reasoning = "exact ICD match"
+            condition.metadata["analysis_source"] = "rule_based"
 
     return state
 
@@ -107,82 +225,273 @@ def enrichment_with_llm(state: GraphState) -> GraphState:
     Returns:
         Updated state with LLM-enriched HCC determinations
     """
-    conditions = state.get("conditions", [])
-    hcc_codes = state.get("hcc_codes", [])
+    conditions = state["conditions"]
 
-    # Skip if no conditions or all are already confidently determined
-    confident_conditions = [c for c in conditions if c.confidence >= 0.9]
-    if len(confident_conditions) == len(conditions):
+    # Only conditions below the confidence threshold are sent to the LLM
+    uncertain_conditions = [c for c in conditions if c.confidence < 0.9]
+    if not uncertain_conditions:
         # All conditions already have high confidence
         return state
 
-    # Initialize Gemini client
-    client = GeminiClient()
+    # Created only once some condition actually needs the LLM
+    hcc_sample = _hcc_sample(state)
+    client = _get_llm_client(hcc_sample)
+
+    # Get LLM analysis
+    try:
+        llm_results = client.analyze_hcc_relevance(_conditions_for_llm(uncertain_conditions), hcc_sample)
+        _apply_llm_results(uncertain_conditions, llm_results)
+    except Exception as e:
+        _record_llm_failure(state, conditions, e)
+
+    return state
 
-    # Prepare conditions for LLM analysis
-    conditions_for_llm = [c.model_dump() for c in conditions]
 
-    # Sample HCC codes for the prompt (to avoid token limits)
-    hcc_sample = hcc_codes[:50] if len(hcc_codes) > 50 else hcc_codes
+async def aenrichment_with_llm(state: GraphState) -> GraphState:
+    """
+    Enrich HCC analysis with LLM-based determinations, awaiting the LLM call.
+
+    Args:
+        state: Current state of the workflow
+
+    Returns:
+        Updated state with LLM-enriched HCC determinations
+    """
+    conditions = state["conditions"]
+
+    # Only conditions below the confidence threshold are sent to the LLM
+    uncertain_conditions = [c for c in conditions if c.confidence < 0.9]
+    if not uncertain_conditions:
+        # All conditions already have high confidence
+        return state
+
+    # Created only once some condition actually needs the LLM
+    hcc_sample = _hcc_sample(state)
+    client = _get_llm_client(hcc_sample)
 
     # Get LLM analysis
     try:
-        llm_results = client.analyze_hcc_relevance(conditions_for_llm, hcc_sample)
-
-        # Create a map of conditions by ID for easy lookup
-        condition_map = {c.id: c for c in conditions}
-
-        # Update conditions with LLM results
-        for llm_result in llm_results:
-            condition_id = llm_result.get("id")
-            if condition_id in condition_map:
-                condition = condition_map[condition_id]
-
-                # Only update if LLM has higher confidence or rule-based was uncertain
-                llm_confidence = llm_result.get("confidence", 0.0)
-                if llm_confidence > condition.confidence:
-                    condition.hcc_relevant = llm_result.get("hcc_relevant", condition.hcc_relevant)
-                    condition.hcc_code = llm_result.get("hcc_code", condition.hcc_code)
-                    condition.hcc_category = llm_result.get("hcc_category", condition.hcc_category)
-                    condition.confidence = llm_confidence
-                    condition.reasoning = llm_result.get("reasoning", condition.reasoning)
-                    # Add metadata about source
-                    condition.metadata["analysis_source"] = "llm"
-                else:
-                    # Keep the original values but add LLM perspective
-                    condition.metadata["llm_hcc_relevant"] = llm_result.get("hcc_relevant")
-                    condition.metadata["llm_confidence"] = llm_confidence
-                    condition.metadata["llm_reasoning"] = llm_result.get("reasoning")
-                    condition.metadata["analysis_source"] = "rule_based"
-
+        if state.get("shard_count", 1) > 1:
+            # A document's shards were split to run as concurrent calls, so
+            # they must not be coalesced back into one
+            llm_results = await client.aanalyze_hcc_relevance(
+                _conditions_for_llm(uncertain_conditions), hcc_sample
+            )
+        else:
+            # Concurrent documents share batched model calls
+            llm_results = await request_batcher.analyze(
+                client, _conditions_for_llm(uncertain_conditions), hcc_sample
+            )
+        _apply_llm_results(uncertain_conditions, llm_results)
     except Exception as e:
-        # Log error but continue with rule-based results
-        state["errors"].append(f"LLM enrichment failed: {str(e)}")
-        # Mark all conditions as rule-based since LLM failed
-        for condition in conditions:
-            condition.metadata["analysis_source"] = "rule_based"
+        _record_llm_failure(state, conditions, e)
 
     return state
 
 
-def fix_nan_values(data):
+def shard_conditions(state: GraphState) -> Union[str, List[Send]]:
+    """
+    Route uncertain conditions to LLM enrichment in parallel shards.
+
+    Each shard becomes its own enrichment branch, so all shards are sent to
+    the LLM concurrently within a single graph step.
+
+    Args:
+        state: Current state of the workflow
+
+    Returns:
+        One Send per shard of uncertain conditions, or the name of the
+        finalize node if no condition needs the LLM
     """
-    Recursively replaces NaN values with None in a nested dictionary or list.
+    uncertain_conditions = [c for c in state["conditions"] if c.confidence < 0.9]
+    if not uncertain_conditions:
+        return "finalize_analysis"
+
+    shards = [
+        uncertain_conditions[i:i + LLM_SHARD_SIZE]
+        for i in range(0, len(uncertain_conditions), LLM_SHARD_SIZE)
+    ]
+    hcc_prompt_sample = _hcc_sample(state)
+    return [
+        Send(
+            "enrichment_with_llm",
+            {
+                "conditions": shard,
+                "hcc_codes": state["hcc_codes"],
+                "hcc_prompt_sample": hcc_prompt_sample,
+                "shard_count": len(shards),
+            },
+        )
+        for shard in shards
+    ]
+
+
+def enrich_condition_shard(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Enrich one shard of conditions routed by shard_conditions.
+
+    Conditions are updated in place, so only the shard's errors are returned;
+    finalize_analysis merges them into the workflow errors.
 
     Args:
-        data: The data structure to fix (dict, list, or scalar value)
+        state: Shard state with conditions, hcc_codes and hcc_prompt_sample
 
     Returns:
-        The data structure with NaN values replaced by None
+        State update with the errors raised by this shard
     """
-    if isinstance(data, dict):
-        return {k: fix_nan_values(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [fix_nan_values(item) for item in data]
-    elif isinstance(data, float) and math.isnan(data):
-        return None
-    else:
-        return data
+    shard_state = {**state, "errors": []}
+    enrichment_with_llm(shard_state)
+    return {"enrichment_errors": shard_state["errors"]}
+
+
+async def aenrich_condition_shard(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Enrich one shard of conditions routed by shard_conditions, asynchronously.
+
+    Args:
+        state: Shard state with conditions, hcc_codes, hcc_prompt_sample and
+            the number of shards of the document
+
+    Returns:
+        State update with the errors raised by this shard
+    """
+    shard_state = {**state, "errors": []}
+    await aenrichment_with_llm(shard_state)
+    return {"enrichment_errors": shard_state["errors"]}
+
+
+def _conditions_for_llm(conditions: List[Condition]) -> List[Dict[str, Any]]:
+    """Project conditions onto the fields the LLM prompt uses."""
+    return [
+        {
+            "id": c.id,
+            "name": c.name,
+            "icd_code": c.icd_code,
+            "icd_description": c.icd_description,
+            "details": c.details,
+            "confidence": c.confidence,
+        }
+        for c in conditions
+    ]
+
+
+def build_hcc_prompt_sample(
+        hcc_codes: List[Dict[str, Any]], size: int = HCC_PROMPT_SAMPLE_SIZE
+) -> List[Dict[str, Any]]:
+    """
+    Pick a sample of HCC codes for the LLM prompt, spread across HCC categories.
+
+    Codes are grouped by their Tags column and taken round-robin, one per
+    category per round in file order. The sample is deterministic, so prompts
+    stay identical across requests, and it covers many categories rather than
+    just the codes at the top of the file.
+
+    Args:
+        hcc_codes: Reference list of HCC-relevant codes
+        size: Maximum number of codes in the sample
+
+    Returns:
+        Sampled HCC codes
+    """
+    if len(hcc_codes) <= size:
+        return hcc_codes
+
+    by_category: Dict[str, List[Dict[str, Any]]] = {}
+    for code in hcc_codes:
+        by_category.setdefault(code.get("Tags") or "", []).append(code)
+
+    sample = []
+    for round_codes in itertools.zip_longest(*by_category.values()):
+        for code in round_codes:
+            if code is not None:
+                sample.append(code)
+                if len(sample) == size:
+                    return sample
+    return sample
+
+
+def _hcc_sample(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Get the HCC codes sample for the prompt, prebuilt by the pipeline if available."""
+    sample = state.get("hcc_prompt_sample")
+    return sample if sample is not None else build_hcc_prompt_sample(state["hcc_codes"])
+
+
+def _apply_llm_results(conditions: List[Condition], llm_results: List[Dict[str, Any]]) -> None:
+    """
+    Update the conditions sent to the LLM with its determinations.
+
+    Args:
+        conditions: Conditions that were sent to the LLM
+        llm_results: Conditions returned by the LLM
+    """
+    # Create a map of the conditions sent to the LLM for easy lookup
+    condition_map = {c.id: c for c in conditions}
+
+    # Update conditions with LLM results
+    for llm_result in llm_results:
+        condition = condition_map.get(llm_result.get("id"))
+        if condition is not None:
+            # Only update if LLM has higher confidence or rule-based was uncertain
+            llm_confidence = llm_result.get("confidence", 0.0)
+            if llm_confidence > condition.confidence:
+                condition.hcc_relevant = llm_result.get("hcc_relevant", condition.hcc_relevant)
+                condition.hcc_code = llm_result.get("hcc_code", condition.hcc_code)
+                condition.hcc_category = llm_result.get("hcc_category", condition.hcc_category)
+                condition.confidence = llm_confidence
+                condition.reasoning = llm_result.get("reasoning", condition.reasoning)
+                # Add metadata about source
+                condition.metadata["analysis_source"] = "llm"
+            else:
+                # Keep the original values but add LLM perspective
+                condition.metadata.update({
+                    "llm_hcc_relevant": llm_result.get("hcc_relevant"),
+                    "llm_confidence": llm_confidence,
+                    "llm_reasoning": llm_result.get("reasoning"),
+                    "analysis_source": "rule_based",
+                })
+
+
+def _record_llm_failure(state: GraphState, conditions: List[Condition], error: Exception) -> None:
+    """
+    Record a failed LLM call and fall back to rule-based results.
+
+    Args:
+        state: Current state of the workflow
+        conditions: Conditions in the current state
+        error: Exception raised by the LLM call
+    """
+    # Log error but continue with rule-based results
+    state["errors"].append(f"LLM enrichment failed: {str(error)}")
+    # Mark all conditions as rule-based since LLM failed
+    for condition in conditions:
+        condition.metadata["analysis_source"] = "rule_based"
+
+
+def _has_nan(condition: Condition) -> bool:
+    """
+    Check whether a condition may contain NaN values.
+
+    Only ``confidence`` and ``metadata`` can hold floats. Nested containers in
+    metadata are not scanned and are reported as possibly containing NaN.
+
+    Args:
+        condition: Condition to check
+
+    Returns:
+        False if the condition is known to be free of NaN values
+    """
+    confidence = condition.confidence
+    if isinstance(confidence, float) and math.isnan(confidence):
+        return True
+
+    for value in condition.metadata.values():
+        if isinstance(value, float):
+            if math.isnan(value):
+                return True
+        elif isinstance(value, (dict, list)):
+            return True
+
+    return False
 
 
 def finalize_analysis(state: GraphState) -> GraphState:
@@ -195,18 +504,32 @@ def finalize_analysis(state: GraphState) -> GraphState:
     Returns:
         Updated state with finalized analysis
     """
-    document_id = state.get("document_id", "unknown")
-    conditions = state.get("conditions", [])
+    document_id = state["document_id"]
+    conditions = state["conditions"]
+
+    # Merge in errors from the parallel LLM enrichment shards. The key is
+    # removed from the returned state so its reducer does not add them twice
+    enrichment_errors = state.pop("enrichment_errors", None)
+    if enrichment_errors:
+        state["errors"].extend(enrichment_errors)
 
     # Preserve the original conditions by setting analyzed_conditions
     # Only do this if analyzed_conditions is still empty
     if not state["analyzed_conditions"]:
         state["analyzed_conditions"] = conditions
 
-    # Calculate statistics for metadata
+    # Calculate statistics for metadata in a single pass
     total_conditions = len(conditions)
-    hcc_relevant_count = sum(1 for c in conditions if c.hcc_relevant)
-    high_confidence_count = sum(1 for c in conditions if c.confidence >= 0.9)
+    hcc_relevant_count = 0
+    high_confidence_count = 0
+    confidence_total = 0.0
+    for c in conditions:
+        confidence = c.confidence
+        confidence_total += confidence
+        if c.hcc_relevant:
+            hcc_relevant_count += 1
+        if confidence >= 0.9:
+            high_confidence_count += 1
 
     # Update metadata
     state["metadata"] = {
@@ -214,32 +537,27 @@ def finalize_analysis(state: GraphState) -> GraphState:
         "total_conditions": total_conditions,
         "hcc_relevant_count": hcc_relevant_count,
         "high_confidence_count": high_confidence_count,
-        "confidence_avg": sum(c.confidence for c in conditions) / total_conditions if total_conditions > 0 else 0,
-        "error_count": len(state.get("errors", [])),
+        "confidence_avg": confidence_total / total_conditions if total_conditions > 0 else 0,
+        "error_count": len(state["errors"]),
     }
 
     # Fix NaN values in metadata
     state["metadata"] = fix_nan_values(state["metadata"])
 
     # Fix any NaN values in all conditions
-    for i, condition in enumerate(state["analyzed_conditions"]):
-        # Get dict representation
-        condition_dict = condition.model_dump()
-
-        # Fix NaN values
-        fixed_dict = fix_nan_values(condition_dict)
-
-        # Fix any NaN values in metadata
-        if "metadata" in fixed_dict:
-            fixed_dict["metadata"] = fix_nan_values(fixed_dict["metadata"])
-
-        # Create a new condition object with fixed values
-        from analyzer.models.condition import Condition
+    analyzed_conditions = state["analyzed_conditions"]
+    for i, condition in enumerate(analyzed_conditions):
+        # Most conditions are clean; skip them without dumping every field
+        if not _has_nan(condition):
+            continue
+
+        # Rebuild the condition with validation, so no field is left with a
+        # value its type does not allow
+        fixed_dict = fix_nan_values(condition.model_dump())
         try:
-            new_condition = Condition(**fixed_dict)
-            state["analyzed_conditions"][i] = new_condition
+            analyzed_conditions[i] = Condition(**fixed_dict)
         except Exception as e:
             # If there's an error creating the new condition, log it and keep the original
             state["errors"].append(f"Error fixing NaN values in condition {condition.id}: {str(e)}")
 
-    return state
\ No newline at end of file
+    return state
@@ -5,23 +5,83 @@ This module implements a workflow for analyzing medical conditions
 and determining their HCC relevance using a multi-stage approach
 combining rule-based and LLM-based methods.
 """
+import asyncio
+import functools
 import os
 from pathlib import Path
-from typing import Dict, List, Any, Union
+from typing import Dict, List, Any, Tuple, Union
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
+from langgraph.graph.state import CompiledStateGraph
 
 from analyzer.graph.nodes import (
+    build_hcc_index,
+    build_hcc_prompt_sample,
     load_hcc_codes,
     prepare_conditions,
     determine_hcc_relevance,
-    enrichment_with_llm,
+    shard_conditions,
+    enrich_condition_shard,
+    aenrich_condition_shard,
     finalize_analysis,
 )
 from analyzer.graph.state import GraphState
 from analyzer.models.condition import Condition, AnalysisResult
 
+# Columns of the HCC codes CSV used by the workflow and the LLM prompt
+HCC_CODE_COLUMNS = ["ICD-10-CM Codes", "Description", "Tags"]
+# Bytes of CSV parsed per record batch when loading HCC codes
+HCC_CODES_BLOCK_SIZE = 1 << 20
+
+
+@functools.lru_cache(maxsize=1)
+def _compiled_graph() -> CompiledStateGraph:
+    """
+    Build and compile the LangGraph workflow.
+
+    The topology is static and HCC codes travel in the state rather than in
+    the nodes, so the graph is compiled once and shared by all pipelines.
+
+    Returns:
+        Compiled workflow graph
+    """
+    # Create a new graph
+    builder = StateGraph(GraphState)
+
+    # Add nodes
+    builder.add_node("load_hcc_codes", load_hcc_codes)
+    builder.add_node("prepare_conditions", prepare_conditions)
+    builder.add_node("determine_hcc_relevance", determine_hcc_relevance)
+    # Enrichment runs once per condition shard; invoke and ainvoke pick the
+    # sync or async implementation respectively
+    builder.add_node(
+        "enrichment_with_llm",
+        RunnableLambda(enrich_condition_shard, afunc=aenrich_condition_shard),
+    )
+    builder.add_node("finalize_analysis", finalize_analysis)
+
+    # Define edges
+    builder.add_edge("load_hcc_codes", "prepare_conditions")
+    builder.add_edge("prepare_conditions", "determine_hcc_relevance")
+    # Fan uncertain conditions out to parallel enrichment branches
+    builder.add_conditional_edges(
+        "determine_hcc_relevance",
+        shard_conditions,
+        ["enrichment_with_llm", "finalize_analysis"],
+    )
+    builder.add_edge("enrichment_with_llm", "finalize_analysis")
+    builder.add_edge("finalize_analysis", END)
+
+    # Set the entry point
+    builder.set_entry_point("load_hcc_codes")
+
+    # Compile the graph
+    return builder.compile()
+
 
 class AnalysisPipeline:
     """LangGraph-based pipeline for HCC relevance analysis."""
@@ -34,8 +94,32 @@ class AnalysisPipeline:
             hcc_codes_path: Path to the CSV file containing HCC codes
         """
         self.hcc_codes_path = Path(hcc_codes_path)
-        self.hcc_codes = self._load_hcc_codes()
-        self.graph = self._build_graph()
+
+    @functools.cached_property
+    def hcc_codes(self) -> List[Dict[str, Any]]:
+        """HCC codes from the CSV file, loaded on first use."""
+        return self._load_hcc_codes()
+
+    @functools.cached_property
+    def hcc_code_index(self) -> Dict[str, Dict[str, Any]]:
+        """HCC codes keyed by normalized ICD code, built once per pipeline."""
+        return build_hcc_index(self.hcc_codes)
+
+    @functools.cached_property
+    def hcc_prompt_sample(self) -> List[Dict[str, Any]]:
+        """HCC codes for the LLM prompt, sampled across categories once per pipeline."""
+        return build_hcc_prompt_sample(self.hcc_codes)
+
+    @functools.cached_property
+    def graph(self) -> CompiledStateGraph:
+        """Compiled workflow graph, shared by all pipelines."""
+        return _compiled_graph()
+
+    def warm_up(self) -> None:
+        """Load the HCC reference data and the graph now instead of on first use."""
+        self.hcc_code_index
+        self.hcc_prompt_sample
+        self.graph
 
     def _load_hcc_codes(self) -> List[Dict[str, Any]]:
         """
@@ -45,99 +129,203 @@ class AnalysisPipeline:
             List of HCC codes as dictionaries
         """
         try:
-            # Load HCC codes from CSV
-            df = pd.read_csv(self.hcc_codes_path)
+            # Stream the CSV in record batches with Arrow's multithreaded
+            # parser, reading only the columns in use, so the whole file is
+            # never held as a table next to the rows built from it. Reading
+            # them as strings keeps codes verbatim and empty cells as ""
+            # rather than NaN
+            reader = pa_csv.open_csv(
+                self.hcc_codes_path,
+                read_options=pa_csv.ReadOptions(use_threads=True, block_size=HCC_CODES_BLOCK_SIZE),
+                convert_options=pa_csv.ConvertOptions(
+                    include_columns=HCC_CODE_COLUMNS,
+                    # Columns missing from the file are read as nulls
+                    include_missing_columns=True,
+                    column_types={column: pa.string() for column in HCC_CODE_COLUMNS},
+                ),
+            )
 
-            # Convert to list of dictionaries
-            hcc_codes = df.to_dict(orient="records")
+            hcc_codes: List[Dict[str, Any]] = []
+            nan_strings = pa.array(["NaN", "nan"])
+            for batch in reader:
+                # Blank out missing and literal "NaN" cells once, column at a
+                # time, so the codes are clean for every prompt built from them
+                batch = pa.RecordBatch.from_arrays(
+                    [
+                        pc.if_else(pc.is_in(column, value_set=nan_strings), "", pc.fill_null(column, ""))
+                        for column in batch.columns
+                    ],
+                    names=batch.schema.names,
+                )
+                hcc_codes.extend(batch.to_pylist())
 
             return hcc_codes
         except Exception as e:
             # Handle loading error
             raise RuntimeError(f"Failed to load HCC codes from {self.hcc_codes_path}: {str(e)}")
 
-    def _build_graph(self) -> StateGraph:
+    def process(self, document_id: str, conditions: List[Condition]) -> AnalysisResult:
         """
-        Build the LangGraph workflow.
+        Process conditions using the workflow to determine HCC relevance.
+
+        Args:
+            document_id: ID of the document containing the conditions
+            conditions: List of conditions to analyze
 
         Returns:
-            Compiled workflow graph
+            Analysis result with HCC relevance determinations
         """
-        # Create a new graph
-        builder = StateGraph(GraphState)
+        try:
+            # Execute the workflow
+            result = self.graph.invoke(self._initial_state(document_id, conditions))
+            return self._build_result(document_id, result)
+        except Exception as e:
+            return self._error_result(document_id, e)
 
-        # Add nodes
-        builder.add_node("load_hcc_codes", load_hcc_codes)
-        builder.add_node("prepare_conditions", prepare_conditions)
-        builder.add_node("determine_hcc_relevance", determine_hcc_relevance)
-        builder.add_node("enrichment_with_llm", enrichment_with_llm)
-        builder.add_node("finalize_analysis", finalize_analysis)
+    async def aprocess(self, document_id: str, conditions: List[Condition]) -> AnalysisResult:
+        """
+        Process conditions asynchronously, running LLM enrichment shards concurrently.
 
-        # Define edges
-        builder.add_edge("load_hcc_codes", "prepare_conditions")
-        builder.add_edge("prepare_conditions", "determine_hcc_relevance")
-        builder.add_edge("determine_hcc_relevance", "enrichment_with_llm")
-        builder.add_edge("enrichment_with_llm", "finalize_analysis")
-        builder.add_edge("finalize_analysis", END)
+        Args:
+            document_id: ID of the document containing the conditions
+            conditions: List of conditions to analyze
 
-        # Set the entry point
-        builder.set_entry_point("load_hcc_codes")
+        Returns:
+            Analysis result with HCC relevance determinations
+        """
+        try:
+            # Execute the workflow
+            result = await self.graph.ainvoke(self._initial_state(document_id, conditions))
+            return self._build_result(document_id, result)
+        except Exception as e:
+            return self._error_result(document_id, e)
 
-        # Compile the graph
-        return builder.compile()
+    async def aprocess_batch(self, documents: List[Tuple[str, List[Condition]]]) -> List[AnalysisResult]:
+        """
+        Process several documents concurrently, sharing batched LLM calls.
 
-    def process(self, document_id: str, conditions: List[Condition]) -> AnalysisResult:
+        The documents' enrichment requests reach the request batcher within
+        the same window, so their conditions go out in batched model calls
+        instead of one call per document.
+
+        Args:
+            documents: (document_id, conditions) pairs; document IDs must be unique
+
+        Returns:
+            Analysis results in the order of the documents
         """
-        Process conditions using the workflow to determine HCC relevance.
+        return list(await asyncio.gather(*(
+            self.aprocess(document_id, conditions) for document_id, conditions in documents
+        )))
+
+    def process_batch(self, documents: List[Tuple[str, List[Condition]]]) -> List[AnalysisResult]:
+        """
+        Process several documents with batched LLM calls, from synchronous code.
+
+        Args:
+            documents: (document_id, conditions) pairs; document IDs must be unique
+
+        Returns:
+            Analysis results in the order of the documents
+        """
+        return asyncio.run(self.aprocess_batch(documents))
+
+    def _initial_state(self, document_id: str, conditions: List[Condition]) -> GraphState:
+        """
+        Create the initial workflow state for a document.
 
         Args:
             document_id: ID of the document containing the conditions
             conditions: List of conditions to analyze
 
         Returns:
-            Analysis result with HCC relevance determinations
+            Initial workflow state
         """
-        # Initialize the state
-        initial_state: GraphState = {
+        return {
             "document_id": document_id,
             "conditions": conditions,
             "hcc_codes": self.hcc_codes,
+            "hcc_code_index": self.hcc_code_index,
+            "hcc_prompt_sample": self.hcc_prompt_sample,
             "analyzed_conditions": [],
             "errors": [],
             "metadata": {},
         }
 
-        try:
-            # Execute the workflow
-            result = self.graph.invoke(initial_state)
-
-            # Create analysis result
-            analysis_result = AnalysisResult(
-                document_id=document_id,
-                conditions=result["analyzed_conditions"],
-                metadata=result["metadata"],
-                errors=result["errors"],
-            )
-        except Exception as e:
-            # Handle error case
-            error_message = f"Pipeline execution failed: {str(e)}"
-            # Create analysis result with error information
-            analysis_result = AnalysisResult(
-                document_id=document_id,
-                conditions=[],  # Empty conditions list since processing failed
-                metadata={"error": error_message},
-                errors=[error_message],
-            )
+    @staticmethod
+    def _build_result(document_id: str, result: Dict[str, Any]) -> AnalysisResult:
+        """
+        Create the analysis result from the final workflow state.
+
+        Args:
+            document_id: ID of the document containing the conditions
+            result: Final workflow state
+
+        Returns:
+            Analysis result with HCC relevance determinations
+        """
+        # Every field comes from graph state, where conditions are
+        # already-validated Condition instances, so skip re-running validation
+        return AnalysisResult.model_construct(
+            document_id=document_id,
+            conditions=result["analyzed_conditions"],
+            metadata=result["metadata"],
+            errors=result["errors"],
+        )
+
+    @staticmethod
+    def _error_result(document_id: str, error: Exception) -> AnalysisResult:
+        """
+        Create the analysis result for a failed workflow run.
+
+        Args:
+            document_id: ID of the document containing the conditions
+            error: Exception raised by the workflow
+
+        Returns:
+            Analysis result with error information
+        """
+        error_message = f"Pipeline execution failed: {str(error)}"
+        # Create analysis result with error information
+        return AnalysisResult(
+            document_id=document_id,
+            conditions=[],  # Empty conditions list since processing failed
+            metadata={"error": error_message},
+            errors=[error_message],
+        )
+
+
+# Graph factory for LangGraph CLI discovery
+def get_analysis_graph() -> CompiledStateGraph:
+    """
+    Get the compiled analysis workflow graph.
+
+    Returns:
+        Compiled workflow graph
+    """
+    return _compiled_graph()
+
+
+def __getattr__(name: str) -> Any:
+    """Build ``analysis_graph`` for CLI discovery on first access rather than at import."""
+    if name == "analysis_graph":
+        globals()["analysis_graph"] = get_analysis_graph()
+        return globals()["analysis_graph"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-        return analysis_result
 
+@functools.lru_cache(maxsize=None)
+def get_pipeline(hcc_codes_path: str) -> AnalysisPipeline:
+    """
+    Get the process-wide pipeline for an HCC codes file.
 
-# Add this to the end of the file for easier development access
-def get_analysis_graph():
-    hcc_codes_path = os.environ.get("HCC_CODES_PATH", "../../data/HCC_relevant_codes.csv")
-    pipeline = AnalysisPipeline(hcc_codes_path=hcc_codes_path)
-    return pipeline.graph
+    Batch mode and the message consumer share it, so the HCC codes are
+    loaded once per process even when both run.
 
+    Args:
+        hcc_codes_path: Path to the CSV file containing HCC codes
 
-# Expose directly for CLI discovery
-analysis_graph = get_analysis_graph()
+    Returns:
+        Analysis pipeline for the HCC codes file
+    """
+    return AnalysisPipeline(hcc_codes_path=hcc_codes_path)
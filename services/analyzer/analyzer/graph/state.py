@@ -5,17 +5,30 @@ This module defines the state schema and validation functions
 for the HCC analysis workflow graph.
 """
 
-from typing import Dict, List, Any, TypedDict
+import operator
+from typing import Annotated, Dict, List, Any, NotRequired, TypedDict
 
 from analyzer.models.condition import Condition
 
 
 class GraphState(TypedDict):
-    """Type definition for the state passed between nodes in the graph."""
+    """
+    Type definition for the state passed between nodes in the graph.
+
+    AnalysisPipeline initializes every required key before a run, so nodes
+    index them directly instead of falling back to defaults.
+    """
 
     document_id: str
     conditions: List[Condition]
     hcc_codes: List[Dict[str, Any]]
+    # HCC reference rows keyed by normalized ICD code, built once per pipeline
+    hcc_code_index: NotRequired[Dict[str, Dict[str, Any]]]
+    # HCC codes for the LLM prompt, sampled once per pipeline
+    hcc_prompt_sample: NotRequired[List[Dict[str, Any]]]
     analyzed_conditions: List[Condition]
     errors: List[str]
     metadata: Dict[str, Any]
+    # Errors from parallel LLM enrichment shards, concatenated across branches.
+    # Not wrapped in NotRequired, which would hide the reducer from LangGraph
+    enrichment_errors: Annotated[List[str], operator.add]
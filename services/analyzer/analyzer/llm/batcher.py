@@ -0,0 +1,195 @@
+"""
+Micro-batching of concurrent HCC analysis requests.
+
+Requests made by concurrently processed documents within a short window are
+coalesced into a single batched Gemini call, so the static prompt preamble is
+paid once per batch instead of once per request.
+"""
+
+import asyncio
+import os
+import weakref
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import orjson
+
+from analyzer.llm.client import MAX_CONDITIONS_PER_REQUEST, GeminiClient
+
+# A pending request: client, conditions, HCC codes, serialized size, and the
+# future its results are delivered to
+_PendingRequest = Tuple[GeminiClient, List[Dict[str, Any]], List[Dict[str, Any]], int, asyncio.Future]
+
+
+class _LoopQueue:
+    """Requests queued by one event loop, waiting to be sent together."""
+
+    __slots__ = ("pending", "pending_chars", "pending_conditions", "flush_handle", "tasks")
+
+    def __init__(self) -> None:
+        """Initialize an empty queue."""
+        self.pending: List[_PendingRequest] = []
+        self.pending_chars = 0
+        self.pending_conditions = 0
+        self.flush_handle: Optional[asyncio.Handle] = None
+        # Running batch calls, referenced so they are not garbage collected
+        self.tasks: Set[asyncio.Task] = set()
+
+
+class RequestBatcher:
+    """Coalesce concurrent HCC analysis requests into batched model calls."""
+
+    def __init__(
+            self,
+            max_batch_size: int = 8,
+            max_wait_seconds: float = 0.05,
+            max_batch_chars: int = 24_000,
+            max_batch_conditions: int = MAX_CONDITIONS_PER_REQUEST,
+    ) -> None:
+        """
+        Initialize the batcher.
+
+        Args:
+            max_batch_size: Maximum number of requests per model call
+            max_wait_seconds: How long the first request of a batch waits for
+                others while an earlier batch is still in flight
+            max_batch_chars: Budget for the serialized conditions of a batch
+                (about 6K input tokens)
+            max_batch_conditions: Budget for the number of conditions of a
+                batch, so the response fits the model's output limit
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.max_batch_chars = max_batch_chars
+        self.max_batch_conditions = max_batch_conditions
+
+        # One queue per event loop: futures and timer handles belong to the
+        # loop that created them, and a loop may end mid-window
+        self._queues: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopQueue]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    async def analyze(
+            self,
+            client: GeminiClient,
+            conditions: List[Dict[str, Any]],
+            hcc_codes: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyze conditions, sharing a model call with concurrent requests.
+
+        A request arriving while nothing is queued or in flight is sent on the
+        next turn of the event loop, together with any requests made in the
+        same turn; otherwise it waits up to ``max_wait_seconds`` for others.
+
+        Args:
+            client: Client to make the model call with
+            conditions: List of conditions with their ICD codes
+            hcc_codes: Reference list of HCC-relevant codes
+
+        Returns:
+            List of conditions with HCC relevance determination
+        """
+        if self.max_batch_size <= 1:
+            return await client.aanalyze_hcc_relevance(conditions, hcc_codes)
+
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(loop)
+        if queue is None:
+            queue = self._queues[loop] = _LoopQueue()
+        size = len(orjson.dumps(conditions))
+
+        # Send what is queued first if this request would exceed a budget
+        if queue.pending and (
+                queue.pending_chars + size > self.max_batch_chars
+                or queue.pending_conditions + len(conditions) > self.max_batch_conditions
+        ):
+            self._flush(queue)
+
+        future = loop.create_future()
+        queue.pending.append((client, conditions, hcc_codes, size, future))
+        queue.pending_chars += size
+        queue.pending_conditions += len(conditions)
+
+        if len(queue.pending) >= self.max_batch_size:
+            self._flush(queue)
+        elif queue.flush_handle is None:
+            if queue.tasks:
+                queue.flush_handle = loop.call_later(self.max_wait_seconds, self._flush, queue)
+            else:
+                # Nothing else is in flight, so don't make a lone request wait
+                queue.flush_handle = loop.call_soon(self._flush, queue)
+
+        return await future
+
+    def _flush(self, queue: _LoopQueue) -> None:
+        """
+        Start a model call for the queued requests.
+
+        Args:
+            queue: Queue of the running event loop
+        """
+        if queue.flush_handle is not None:
+            queue.flush_handle.cancel()
+            queue.flush_handle = None
+
+        batch, queue.pending = queue.pending, []
+        queue.pending_chars = queue.pending_conditions = 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            queue.tasks.add(task)
+            task.add_done_callback(queue.tasks.discard)
+
+    @classmethod
+    async def _run(cls, batch: List[_PendingRequest]) -> None:
+        """
+        Make the batched model calls for the queued requests.
+
+        Requests with different HCC codes cannot share a preamble, so each
+        group of requests with equal codes gets its own concurrent call.
+
+        Args:
+            batch: Requests to send
+        """
+        groups: List[Tuple[List[Dict[str, Any]], List[_PendingRequest]]] = []
+        for request in batch:
+            for hcc_codes, requests in groups:
+                if request[2] is hcc_codes or request[2] == hcc_codes:
+                    requests.append(request)
+                    break
+            else:
+                groups.append((request[2], [request]))
+
+        await asyncio.gather(*(cls._send(hcc_codes, requests) for hcc_codes, requests in groups))
+
+    @staticmethod
+    async def _send(hcc_codes: List[Dict[str, Any]], requests: List[_PendingRequest]) -> None:
+        """
+        Make one model call for requests sharing HCC codes and deliver the results.
+
+        Args:
+            hcc_codes: Reference list of HCC-relevant codes
+            requests: Requests to send together
+        """
+        client = requests[0][0]
+        try:
+            if len(requests) == 1:
+                results = {"0": await client.aanalyze_hcc_relevance(requests[0][1], hcc_codes)}
+            else:
+                documents = [(str(i), request[1]) for i, request in enumerate(requests)]
+                results = await client.aanalyze_hcc_relevance_batch(documents, hcc_codes)
+        except Exception as e:
+            for request in requests:
+                if not request[4].done():
+                    request[4].set_exception(e)
+            return
+
+        for i, request in enumerate(requests):
+            if not request[4].done():
+                request[4].set_result(results.get(str(i), []))
+
+
+# Shared by the enrichment nodes of all concurrently processed documents
+request_batcher = RequestBatcher(
+    max_batch_size=int(os.environ.get("LLM_BATCH_MAX_DOCUMENTS", "8")),
+    max_wait_seconds=int(os.environ.get("LLM_BATCH_MAX_WAIT_MS", "50")) / 1000,
+)
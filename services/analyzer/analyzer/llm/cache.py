@@ -0,0 +1,240 @@
+"""
+Caches for the Gemini client.
+
+This module keeps the static preamble of the HCC analysis prompt (instructions
+and HCC reference sample) in a Vertex AI cached content resource, so that only
+the per-request conditions are sent with each call. It also provides
+in-process caches of parsed responses, so identical requests and repeated
+conditions skip the model.
+"""
+
+import atexit
+import datetime
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from google.api_core import exceptions as google_exceptions
+from vertexai.generative_models import GenerativeModel
+from vertexai.preview import caching
+
+logger = logging.getLogger(__name__)
+
+
+class VertexCacheManager:
+    """Create, reuse, and clean up Vertex AI cached contents for prompt preambles."""
+
+    def __init__(
+            self,
+            ttl_seconds: int = 3600,
+            refresh_margin_seconds: int = 60,
+            backoff_seconds: float = 30.0,
+            max_backoff_seconds: float = 600.0,
+    ) -> None:
+        """
+        Initialize the cache manager.
+
+        Args:
+            ttl_seconds: Lifetime of each cached content resource in seconds
+            refresh_margin_seconds: Recreate a cache this long before it expires
+            backoff_seconds: Wait this long before retrying a failed cache
+                creation, doubling with each consecutive failure
+            max_backoff_seconds: Longest wait between cache creation attempts
+        """
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        # Cached models keyed by a hash of model name and preamble, with the
+        # monotonic time after which they must be recreated
+        self._entries: Dict[str, Tuple[caching.CachedContent, GenerativeModel, float]] = {}
+        # Preambles Vertex refused to cache (e.g. below the minimum token count)
+        self._uncacheable: Set[str] = set()
+        # Consecutive failed creations per key, with the monotonic time before
+        # which no new attempt is made
+        self._failures: Dict[str, Tuple[int, float]] = {}
+        # Caches being created, so concurrent callers wait for one creation
+        self._creating: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._cleanup_registered = False
+
+    def get_model(self, model_name: str, preamble: str) -> Optional[GenerativeModel]:
+        """
+        Get a model bound to a cached copy of the given preamble.
+
+        Args:
+            model_name: Name of the Gemini model
+            preamble: Static prompt content to cache
+
+        Returns:
+            Model that serves the preamble from the cache, or None if the
+            preamble cannot be cached and the full prompt must be sent
+        """
+        key = hashlib.sha256(f"{model_name}\0{preamble}".encode()).hexdigest()
+
+        while True:
+            with self._lock:
+                if key in self._uncacheable:
+                    return None
+
+                now = time.monotonic()
+                entry = self._entries.get(key)
+                if entry is not None and entry[2] > now:
+                    return entry[1]
+
+                failure = self._failures.get(key)
+                if failure is not None and failure[1] > now:
+                    return None
+
+                creating = self._creating.get(key)
+                if creating is None:
+                    creating = self._creating[key] = threading.Event()
+                    break
+
+            # Another thread is creating this cache; use its outcome
+            creating.wait()
+
+        # Create the cache outside the lock, so other preambles aren't held up
+        try:
+            return self._create(key, model_name, preamble)
+        finally:
+            with self._lock:
+                del self._creating[key]
+            creating.set()
+
+    def _create(self, key: str, model_name: str, preamble: str) -> Optional[GenerativeModel]:
+        """
+        Create the cached content for a preamble and record the outcome.
+
+        Args:
+            key: Hash of the model name and preamble
+            model_name: Name of the Gemini model
+            preamble: Static prompt content to cache
+
+        Returns:
+            Model bound to the new cache, or None if it could not be created
+        """
+        try:
+            cached_content = caching.CachedContent.create(
+                model_name=model_name,
+                system_instruction=preamble,
+                ttl=datetime.timedelta(seconds=self.ttl_seconds),
+            )
+        except (google_exceptions.InvalidArgument, google_exceptions.NotFound) as e:
+            # The preamble is too small to cache or the model doesn't support
+            # caching; retrying can't help
+            logger.warning("Vertex AI cannot cache this preamble, sending full prompts: %s", e)
+            with self._lock:
+                self._uncacheable.add(key)
+                self._failures.pop(key, None)
+            return None
+        except Exception as e:
+            with self._lock:
+                attempts = self._failures.get(key, (0, 0.0))[0] + 1
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+                self._failures[key] = (attempts, time.monotonic() + delay)
+            logger.warning(
+                "Could not create Vertex AI context cache, sending full prompts for %.0fs: %s", delay, e
+            )
+            return None
+
+        model = GenerativeModel.from_cached_content(cached_content=cached_content)
+        refresh_at = time.monotonic() + self.ttl_seconds - self.refresh_margin_seconds
+        with self._lock:
+            self._entries[key] = (cached_content, model, refresh_at)
+            self._failures.pop(key, None)
+
+            if not self._cleanup_registered:
+                atexit.register(self.delete_all)
+                self._cleanup_registered = True
+
+        logger.info("Created Vertex AI context cache %s", cached_content.resource_name)
+        return model
+
+    def delete_all(self) -> None:
+        """Delete all cached contents created by this manager."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+
+        for cached_content, _, _ in entries:
+            try:
+                cached_content.delete()
+            except Exception as e:
+                logger.warning("Failed to delete Vertex AI context cache: %s", e)
+
+
+# Shared by all GeminiClient instances so each preamble is cached once per process
+context_cache = VertexCacheManager()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a time-to-live for parsed LLM responses."""
+
+    def __init__(self, maxsize: int = 10_000, ttl_seconds: int = 3600) -> None:
+        """
+        Initialize the response cache.
+
+        Args:
+            maxsize: Maximum number of responses to keep
+            ttl_seconds: Lifetime of each cached response in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+
+        # Responses keyed by request hash, with the monotonic time they expire,
+        # ordered from least to most recently used
+        self._entries: "OrderedDict[str, Tuple[List[Dict[str, Any]], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get a cached response.
+
+        Args:
+            key: Request hash
+
+        Returns:
+            Copy of the cached conditions, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return [dict(result) for result in entry[0]]
+
+    def set(self, key: str, results: List[Dict[str, Any]]) -> None:
+        """
+        Cache a response, evicting the least recently used one if full.
+
+        Args:
+            key: Request hash
+            results: Parsed conditions returned by the model
+        """
+        with self._lock:
+            self._entries[key] = ([dict(result) for result in results], time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all cached responses."""
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by all GeminiClient instances, so responses outlive any one client
+response_cache = ResponseCache()
+# Determinations of single conditions keyed by content rather than ID, so a
+# condition repeated across documents is sent to the model only once
+condition_cache = ResponseCache(maxsize=100_000)
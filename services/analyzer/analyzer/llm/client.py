@@ -2,24 +2,236 @@
 Gemini 1.5 client for interacting with the Vertex AI API.
 """
 
-import json
+import asyncio
+import csv
+import hashlib
+import io
+import math
 import os
-from typing import Dict, List, Any, Optional
+import weakref
+from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Tuple
 
 import logging
 
+import orjson
+from google.api_core import exceptions as google_exceptions
 from google.cloud import aiplatform
 from vertexai.generative_models import GenerativeModel, GenerationConfig
 
+from analyzer.llm.cache import condition_cache, context_cache, response_cache
+from analyzer.llm.decorators import TokenBucket, aretry, retry, timeout
+from analyzer.llm.streaming import ResultStreamParser
+
+# Response schemas for constrained decoding, so responses are always plain,
+# parseable JSON: no code fences, no surrounding text, no NaN literals
+CONDITION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "string"},
+        "name": {"type": "string"},
+        "icd_code": {"type": "string"},
+        "hcc_relevant": {"type": "boolean"},
+        "hcc_code": {"type": "string", "nullable": True},
+        "hcc_category": {"type": "string", "nullable": True},
+        "confidence": {"type": "number"},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["id", "hcc_relevant", "confidence", "reasoning"],
+}
+CONDITIONS_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {"conditions": {"type": "array", "items": CONDITION_SCHEMA}},
+    "required": ["conditions"],
+}
+DOCUMENTS_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "documents": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "doc_id": {"type": "string"},
+                    "conditions": {"type": "array", "items": CONDITION_SCHEMA},
+                },
+                "required": ["doc_id", "conditions"],
+            },
+        },
+    },
+    "required": ["documents"],
+}
+
+# Largest response the model will generate, in tokens
+MAX_OUTPUT_TOKENS = 8192
+# Expected response size per analyzed condition: one JSON object with a short
+# reasoning, in tokens
+OUTPUT_TOKENS_PER_CONDITION = 150
+# Most conditions one request can carry without its response being truncated;
+# the request batcher splits batches to stay under it
+MAX_CONDITIONS_PER_REQUEST = MAX_OUTPUT_TOKENS // OUTPUT_TOKENS_PER_CONDITION
+
+# Maximum duration of a single model call in seconds (0 disables the limit).
+# Async calls are cancelled when it runs out. Sync calls can't be: the caller
+# stops waiting, but the Vertex AI request keeps its thread, and uses quota,
+# until Vertex AI answers (see decorators.timeout)
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "120"))
+# Attempts per model call; timed-out and transiently failed calls are retried
+# with exponential backoff
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+# Errors a later attempt of the same model call may not hit
+TRANSIENT_LLM_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+)
+
+# Prompt preambles by HCC codes fingerprint. Clients created without HCC codes
+# get them per request, so this keeps the reference table from being
+# serialized again for every request and is shared across clients
+_preamble_cache: Dict[bytes, str] = {}
+_PREAMBLE_CACHE_SIZE = 8
+
+# Maximum number of concurrent async Vertex AI calls per process
+VERTEX_CONCURRENCY = int(os.environ.get("VERTEX_CONCURRENCY", "8"))
+# One semaphore per event loop; asyncio primitives can't be shared across loops
+_vertex_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+# Sustained Vertex AI requests per second per process (0 disables the limit);
+# bursts of up to VERTEX_CONCURRENCY requests go through immediately
+VERTEX_REQUESTS_PER_SECOND = float(os.environ.get("VERTEX_REQUESTS_PER_SECOND", "0"))
+_vertex_rate_limiter: Optional[TokenBucket] = (
+    TokenBucket(VERTEX_CONCURRENCY, VERTEX_REQUESTS_PER_SECOND)
+    if VERTEX_REQUESTS_PER_SECOND > 0 else None
+)
+
+
+def _vertex_semaphore() -> asyncio.Semaphore:
+    """Get the semaphore capping concurrent Vertex AI calls on the running loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _vertex_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _vertex_semaphores[loop] = asyncio.Semaphore(VERTEX_CONCURRENCY)
+    return semaphore
+
+
+def _throttle() -> None:
+    """Block until the Vertex AI rate limit allows another request."""
+    if _vertex_rate_limiter is not None:
+        _vertex_rate_limiter.acquire()
+
+
+async def _athrottle() -> None:
+    """Wait, without blocking the event loop, until the rate limit allows another request."""
+    if _vertex_rate_limiter is not None:
+        await _vertex_rate_limiter.aacquire()
+
+
+def _output_token_budget(condition_count: int, minimum: int = 2048) -> int:
+    """
+    Get the response token limit for a request analyzing some conditions.
+
+    Args:
+        condition_count: Number of conditions sent to the model
+        minimum: Smallest limit to use
+
+    Returns:
+        Maximum number of tokens in the response
+    """
+    return min(MAX_OUTPUT_TOKENS, max(minimum, condition_count * OUTPUT_TOKENS_PER_CONDITION))
+
+
+def fix_nan_values(data):
+    """
+    Replaces NaN values with None in a nested dictionary or list.
+
+    orjson encodes NaN (and infinities) as null, so a single round trip through
+    it sanitizes the whole structure in C. Structures orjson can't serialize fall
+    back to a recursive walk.
+
+    Args:
+        data: The data structure to fix (dict, list, or scalar value)
+
+    Returns:
+        The data structure with NaN values replaced by None
+    """
+    try:
+        return orjson.loads(orjson.dumps(data))
+    except TypeError:
+        return _fix_nan_values_recursive(data)
+
+
+def _fix_nan_values_recursive(data):
+    """Recursively replace NaN values with None, for data orjson can't serialize."""
+    if isinstance(data, dict):
+        return {k: _fix_nan_values_recursive(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [_fix_nan_values_recursive(item) for item in data]
+    elif isinstance(data, float) and math.isnan(data):
+        return None
+    else:
+        return data
+
+
+def _fingerprint(data: Any) -> bytes:
+    """Hash JSON-serializable data, independent of dict key order."""
+    return hashlib.blake2b(orjson.dumps(data, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+
+
+def _format_csv_table(rows: List[Dict[str, Any]]) -> str:
+    """
+    Format rows as a compact CSV table with a header row.
+
+    Args:
+        rows: Rows to format; columns are the union of their keys
+
+    Returns:
+        CSV text, or an empty string if there are no rows
+    """
+    if not rows:
+        return ""
+
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    writer.writerows([row.get(column, "") for column in columns] for row in rows)
+    return buffer.getvalue()
+
 
 class GeminiClient:
     """Client for interacting with Vertex AI Gemini 1.5 Flash model."""
 
+    # Clients are small and stateless apart from their model, so skip the
+    # per-instance __dict__
+    __slots__ = (
+        "project_id",
+        "location",
+        "model_name",
+        "use_context_cache",
+        "use_response_cache",
+        "stream_responses",
+        "hcc_codes",
+        "_prompt_preamble",
+        "_hcc_codes_fingerprint",
+        "_vertex_initialized",
+        "_model",
+    )
+
     def __init__(
             self,
             project_id: Optional[str] = None,
             location: str = "us-central1",
             model_name: str = "gemini-2.0-flash",
+            use_context_cache: Optional[bool] = None,
+            hcc_codes: Optional[List[Dict[str, Any]]] = None,
+            use_response_cache: Optional[bool] = None,
+            stream_responses: Optional[bool] = None,
     ) -> None:
         """
         Initialize the Gemini client.
@@ -28,148 +240,736 @@ class GeminiClient:
             project_id: Google Cloud project ID
             location: Google Cloud region
             model_name: Name of the Gemini model to use
+            use_context_cache: Whether to keep the static prompt preamble in a
+                Vertex AI context cache (defaults to VERTEX_AI_CONTEXT_CACHE)
+            hcc_codes: Reference list of HCC-relevant codes; when given, the
+                prompt preamble is built once here instead of on every request
+            use_response_cache: Whether to reuse parsed responses for identical
+                requests within this process (defaults to LLM_RESPONSE_CACHE)
+            stream_responses: Whether to stream responses and parse conditions
+                as they arrive (defaults to LLM_STREAM_RESPONSES)
         """
         self.project_id = project_id or os.environ.get("VERTEX_AI_PROJECT_ID")
         self.location = location or os.environ.get("VERTEX_AI_LOCATION", "us-central1")
         self.model_name = model_name
+        if use_context_cache is None:
+            use_context_cache = os.environ.get("VERTEX_AI_CONTEXT_CACHE", "false").lower() == "true"
+        self.use_context_cache = use_context_cache
+        if use_response_cache is None:
+            use_response_cache = os.environ.get("LLM_RESPONSE_CACHE", "true").lower() == "true"
+        self.use_response_cache = use_response_cache
+        if stream_responses is None:
+            stream_responses = os.environ.get("LLM_STREAM_RESPONSES", "false").lower() == "true"
+        self.stream_responses = stream_responses
+
+        # The preamble only depends on the HCC codes, so build it once
+        self.hcc_codes = hcc_codes
+        self._prompt_preamble = (
+            self._create_hcc_analysis_preamble(hcc_codes) if hcc_codes is not None else None
+        )
+        self._hcc_codes_fingerprint = _fingerprint(hcc_codes) if hcc_codes is not None else b""
+
+        # Vertex AI and the model are initialized on first use, so requests
+        # answered from the response cache never touch them
+        self._vertex_initialized = False
+        self._model: Optional[GenerativeModel] = None
 
-        # Initialize Vertex AI
-        aiplatform.init(project=self.project_id, location=self.location)
+    @property
+    def model(self) -> GenerativeModel:
+        """Gemini model, created on first use."""
+        if self._model is None:
+            self._init_vertex()
+            # Initialize the model
+            self._model = GenerativeModel(self.model_name)
+        return self._model
 
-        # Initialize the model
-        self.model = GenerativeModel(self.model_name)
+    def _init_vertex(self) -> None:
+        """Initialize Vertex AI for this client's project and location, once."""
+        if not self._vertex_initialized:
+            aiplatform.init(project=self.project_id, location=self.location)
+            self._vertex_initialized = True
 
     def analyze_hcc_relevance(
-            self, conditions: List[Dict[str, Any]], hcc_codes: List[Dict[str, Any]]
+            self, conditions: List[Dict[str, Any]], hcc_codes: Optional[List[Dict[str, Any]]] = None
     ) -> List[Dict[str, Any]]:
         """
         Analyze conditions to determine HCC relevance.
 
         Args:
             conditions: List of conditions with their ICD codes
-            hcc_codes: Reference list of HCC-relevant codes
+            hcc_codes: Reference list of HCC-relevant codes (defaults to the
+                codes the client was created with)
+
+        Returns:
+            List of conditions with HCC relevance determination
+        """
+        # Identical requests are answered from the response cache
+        cache_key = self._response_cache_key(conditions, hcc_codes) if self.use_response_cache else None
+        if cache_key is not None:
+            cached_results = response_cache.get(cache_key)
+            if cached_results is not None:
+                return cached_results
+
+        # Conditions seen before, in this or other documents, aren't sent again
+        known_results, conditions, condition_keys = self._split_known_conditions(conditions, hcc_codes)
+        if not conditions:
+            return known_results
+
+        model, prompt = self._prepare_request(self._create_conditions_section(conditions), hcc_codes)
+
+        # Generate response
+        _throttle()
+        results = self._generate(model, prompt, _output_token_budget(len(conditions)))
+
+        return self._cache_results(results, known_results, cache_key, condition_keys)
+
+    async def aanalyze_hcc_relevance(
+            self, conditions: List[Dict[str, Any]], hcc_codes: Optional[List[Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyze conditions to determine HCC relevance without blocking the event loop.
+
+        Args:
+            conditions: List of conditions with their ICD codes
+            hcc_codes: Reference list of HCC-relevant codes (defaults to the
+                codes the client was created with)
 
         Returns:
             List of conditions with HCC relevance determination
         """
-        # Create generation config
-        generation_config = GenerationConfig(
+        # Identical requests are answered from the response cache
+        cache_key = self._response_cache_key(conditions, hcc_codes) if self.use_response_cache else None
+        if cache_key is not None:
+            cached_results = response_cache.get(cache_key)
+            if cached_results is not None:
+                return cached_results
+
+        # Conditions seen before, in this or other documents, aren't sent again
+        known_results, conditions, condition_keys = self._split_known_conditions(conditions, hcc_codes)
+        if not conditions:
+            return known_results
+
+        model, prompt = self._prepare_request(self._create_conditions_section(conditions), hcc_codes)
+
+        # Generate response; shards and documents fan out concurrently, so cap
+        # the calls in flight to stay within Vertex AI quota
+        await _athrottle()
+        async with _vertex_semaphore():
+            results = await self._agenerate(model, prompt, _output_token_budget(len(conditions)))
+
+        return self._cache_results(results, known_results, cache_key, condition_keys)
+
+    def analyze_hcc_relevance_batch(
+            self,
+            documents: List[Tuple[str, List[Dict[str, Any]]]],
+            hcc_codes: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Analyze the conditions of several documents in a single model call.
+
+        The static preamble is sent once for the whole batch instead of once
+        per document.
+
+        Args:
+            documents: (doc_id, conditions) pairs; doc_ids must be unique
+            hcc_codes: Reference list of HCC-relevant codes (defaults to the
+                codes the client was created with)
+
+        Returns:
+            Conditions with HCC relevance determination, keyed by doc_id
+        """
+        results, pending, cache_keys, condition_keys = self._get_cached_batch_results(documents, hcc_codes)
+        if not pending:
+            return results
+
+        model, prompt = self._prepare_request(self._create_documents_section(pending), hcc_codes)
+
+        # Generate response
+        _throttle()
+        response_text = self._generate_batch(model, prompt, self._batch_token_budget(pending))
+
+        # Documents missing from a truncated or incomplete response are retried singly
+        missing = self._merge_batch_response(response_text, pending, cache_keys, condition_keys, results)
+        for doc_id, conditions in missing:
+            results[doc_id] = self._cache_results(
+                self.analyze_hcc_relevance(conditions, hcc_codes),
+                results.get(doc_id, []),
+                cache_keys.get(doc_id),
+                {},
+            )
+        return results
+
+    async def aanalyze_hcc_relevance_batch(
+            self,
+            documents: List[Tuple[str, List[Dict[str, Any]]]],
+            hcc_codes: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Analyze the conditions of several documents in a single awaited model call.
+
+        Args:
+            documents: (doc_id, conditions) pairs; doc_ids must be unique
+            hcc_codes: Reference list of HCC-relevant codes (defaults to the
+                codes the client was created with)
+
+        Returns:
+            Conditions with HCC relevance determination, keyed by doc_id
+        """
+        results, pending, cache_keys, condition_keys = self._get_cached_batch_results(documents, hcc_codes)
+        if not pending:
+            return results
+
+        model, prompt = self._prepare_request(self._create_documents_section(pending), hcc_codes)
+
+        # Generate response, within the rate limit and the cap on concurrent calls
+        await _athrottle()
+        async with _vertex_semaphore():
+            response_text = await self._agenerate_batch(model, prompt, self._batch_token_budget(pending))
+
+        # Documents missing from a truncated or incomplete response are retried singly
+        missing = self._merge_batch_response(response_text, pending, cache_keys, condition_keys, results)
+        if missing:
+            retried = await asyncio.gather(*(
+                self.aanalyze_hcc_relevance(conditions, hcc_codes) for _, conditions in missing
+            ))
+            for (doc_id, _), doc_results in zip(missing, retried):
+                results[doc_id] = self._cache_results(
+                    doc_results, results.get(doc_id, []), cache_keys.get(doc_id), {}
+                )
+        return results
+
+    @retry(max_attempts=LLM_MAX_ATTEMPTS, exceptions=TRANSIENT_LLM_ERRORS)
+    @timeout(LLM_TIMEOUT_SECONDS)
+    def _generate(
+            self, model: GenerativeModel, prompt: str, max_output_tokens: int = 2048
+    ) -> List[Dict[str, Any]]:
+        """
+        Call the model for a single request and parse the conditions it returns.
+
+        Args:
+            model: Model to call
+            prompt: Prompt to send
+            max_output_tokens: Maximum number of tokens in the response
+
+        Returns:
+            List of conditions with HCC relevance determination
+        """
+        if self.stream_responses:
+            return self._parse_stream(model.generate_content(
+                prompt,
+                generation_config=self._generation_config(max_output_tokens),
+                stream=True,
+            ))
+
+        response = model.generate_content(
+            prompt,
+            generation_config=self._generation_config(max_output_tokens),
+        )
+        return self._parse_response(response.text)
+
+    @aretry(max_attempts=LLM_MAX_ATTEMPTS, exceptions=TRANSIENT_LLM_ERRORS)
+    @timeout(LLM_TIMEOUT_SECONDS)
+    async def _agenerate(
+            self, model: GenerativeModel, prompt: str, max_output_tokens: int = 2048
+    ) -> List[Dict[str, Any]]:
+        """
+        Call the model for a single request without blocking and parse its conditions.
+
+        Args:
+            model: Model to call
+            prompt: Prompt to send
+            max_output_tokens: Maximum number of tokens in the response
+
+        Returns:
+            List of conditions with HCC relevance determination
+        """
+        if self.stream_responses:
+            return await self._aparse_stream(await model.generate_content_async(
+                prompt,
+                generation_config=self._generation_config(max_output_tokens),
+                stream=True,
+            ))
+
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=self._generation_config(max_output_tokens),
+        )
+        return self._parse_response(response.text)
+
+    @retry(max_attempts=LLM_MAX_ATTEMPTS, exceptions=TRANSIENT_LLM_ERRORS)
+    @timeout(LLM_TIMEOUT_SECONDS)
+    def _generate_batch(self, model: GenerativeModel, prompt: str, max_output_tokens: int) -> str:
+        """
+        Call the model for a batch of documents.
+
+        Args:
+            model: Model to call
+            prompt: Prompt to send
+            max_output_tokens: Maximum number of tokens in the response
+
+        Returns:
+            Raw response text
+        """
+        response = model.generate_content(
+            prompt,
+            generation_config=self._generation_config(max_output_tokens, DOCUMENTS_RESPONSE_SCHEMA),
+        )
+        return response.text
+
+    @aretry(max_attempts=LLM_MAX_ATTEMPTS, exceptions=TRANSIENT_LLM_ERRORS)
+    @timeout(LLM_TIMEOUT_SECONDS)
+    async def _agenerate_batch(self, model: GenerativeModel, prompt: str, max_output_tokens: int) -> str:
+        """
+        Call the model for a batch of documents without blocking.
+
+        Args:
+            model: Model to call
+            prompt: Prompt to send
+            max_output_tokens: Maximum number of tokens in the response
+
+        Returns:
+            Raw response text
+        """
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=self._generation_config(max_output_tokens, DOCUMENTS_RESPONSE_SCHEMA),
+        )
+        return response.text
+
+    def _get_cached_batch_results(
+            self,
+            documents: List[Tuple[str, List[Dict[str, Any]]]],
+            hcc_codes: Optional[List[Dict[str, Any]]],
+    ) -> Tuple[
+        Dict[str, List[Dict[str, Any]]],
+        List[Tuple[str, List[Dict[str, Any]]]],
+        Dict[str, str],
+        Dict[str, Dict[str, str]],
+    ]:
+        """
+        Split a batch into results answered by the response caches and the rest.
+
+        Args:
+            documents: (doc_id, conditions) pairs
+            hcc_codes: Reference list of HCC-relevant codes
+
+        Returns:
+            Tuple of cached results keyed by doc_id, the documents with the
+            conditions still to send, the response cache keys of those
+            documents, and the condition cache keys of the conditions to send
+        """
+        results: Dict[str, List[Dict[str, Any]]] = {}
+        pending: List[Tuple[str, List[Dict[str, Any]]]] = []
+        cache_keys: Dict[str, str] = {}
+        condition_keys: Dict[str, Dict[str, str]] = {}
+
+        for doc_id, conditions in documents:
+            if self.use_response_cache:
+                cache_key = self._response_cache_key(conditions, hcc_codes)
+                cached_results = response_cache.get(cache_key)
+                if cached_results is not None:
+                    results[doc_id] = cached_results
+                    continue
+                cache_keys[doc_id] = cache_key
+
+            results[doc_id], conditions, condition_keys[doc_id] = self._split_known_conditions(
+                conditions, hcc_codes
+            )
+            if conditions:
+                pending.append((doc_id, conditions))
+
+        return results, pending, cache_keys, condition_keys
+
+    def _merge_batch_response(
+            self,
+            response_str: str,
+            pending: List[Tuple[str, List[Dict[str, Any]]]],
+            cache_keys: Dict[str, str],
+            condition_keys: Dict[str, Dict[str, str]],
+            results: Dict[str, List[Dict[str, Any]]],
+    ) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Demultiplex a batch response into per-document results.
+
+        Args:
+            response_str: Raw response text
+            pending: (doc_id, conditions) pairs that were sent
+            cache_keys: Response cache keys of the sent documents
+            condition_keys: Condition cache keys of the sent conditions, by doc_id
+            results: Results keyed by doc_id, holding the cached results of the
+                sent documents; updated in place
+
+        Returns:
+            The sent (doc_id, conditions) pairs the response has no results
+            for, e.g. because it was truncated
+        """
+        by_doc_id = {
+            str(document.get("doc_id")): document.get("conditions") or []
+            for document in self._parse_response(response_str, "documents")
+            if isinstance(document, dict)
+        }
+
+        missing = []
+        for doc_id, conditions in pending:
+            doc_results = by_doc_id.get(doc_id)
+            if not doc_results:
+                missing.append((doc_id, conditions))
+                continue
+            results[doc_id] = self._cache_results(
+                doc_results,
+                results.get(doc_id, []),
+                cache_keys.get(doc_id),
+                condition_keys.get(doc_id, {}),
+            )
+
+        if missing:
+            logging.warning(
+                "Batch response has no results for %d of %d document(s), retrying them singly",
+                len(missing), len(pending),
+            )
+        return missing
+
+    @staticmethod
+    def _batch_token_budget(pending: List[Tuple[str, List[Dict[str, Any]]]]) -> int:
+        """Get the response token limit for a batch of documents."""
+        return _output_token_budget(sum(len(conditions) for _, conditions in pending))
+
+    def _split_known_conditions(
+            self, conditions: List[Dict[str, Any]], hcc_codes: Optional[List[Dict[str, Any]]]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, str]]:
+        """
+        Split conditions into those with a cached determination and the rest.
+
+        Conditions are cached by content, not ID, so a condition repeated
+        across documents is only sent to the model once.
+
+        Args:
+            conditions: List of conditions with their ICD codes
+            hcc_codes: Reference list of HCC-relevant codes
+
+        Returns:
+            Tuple of the cached results, relabeled with the IDs of the given
+            conditions, the conditions still to send, and the condition cache
+            keys of those conditions by ID
+        """
+        if not self.use_response_cache:
+            return [], conditions, {}
+
+        request_digest = hashlib.blake2b(digest_size=16)
+        request_digest.update(self.model_name.encode())
+        request_digest.update(self._hcc_codes_fingerprint_for(hcc_codes))
+
+        known_results: List[Dict[str, Any]] = []
+        pending: List[Dict[str, Any]] = []
+        condition_keys: Dict[str, str] = {}
+        for condition in conditions:
+            digest = request_digest.copy()
+            digest.update(_fingerprint({k: v for k, v in condition.items() if k != "id"}))
+            condition_key = digest.hexdigest()
+
+            cached_results = condition_cache.get(condition_key)
+            if cached_results is not None:
+                known_results.append({**cached_results[0], "id": condition.get("id")})
+            else:
+                pending.append(condition)
+                condition_keys[str(condition.get("id"))] = condition_key
+
+        return known_results, pending, condition_keys
+
+    @staticmethod
+    def _cache_results(
+            results: List[Dict[str, Any]],
+            known_results: List[Dict[str, Any]],
+            cache_key: Optional[str],
+            condition_keys: Dict[str, str],
+    ) -> List[Dict[str, Any]]:
+        """
+        Cache the model's results and combine them with the cached ones.
+
+        Args:
+            results: Conditions returned by the model
+            known_results: Cached results of the conditions not sent
+            cache_key: Response cache key of the request, or None
+            condition_keys: Condition cache keys of the sent conditions by ID
+
+        Returns:
+            Results for all conditions of the request
+        """
+        # Empty results may be a parse failure, so they are not cached
+        if not results:
+            return known_results
+
+        for result in results:
+            condition_key = condition_keys.get(str(result.get("id")))
+            if condition_key is not None:
+                condition_cache.set(condition_key, [result])
+
+        all_results = known_results + results
+        if cache_key is not None:
+            response_cache.set(cache_key, all_results)
+        return all_results
+
+    @staticmethod
+    def _generation_config(
+            max_output_tokens: int = 2048,
+            response_schema: Dict[str, Any] = CONDITIONS_RESPONSE_SCHEMA,
+    ) -> GenerationConfig:
+        """
+        Create the generation config for HCC analysis requests.
+
+        Args:
+            max_output_tokens: Maximum number of tokens in the response
+            response_schema: JSON schema the response is constrained to
+
+        Returns:
+            Generation config for the Gemini model
+        """
+        return GenerationConfig(
             temperature=0.1,
             top_p=0.95,
             top_k=40,
-            max_output_tokens=2048,
+            max_output_tokens=max_output_tokens,
+            response_mime_type="application/json",
+            response_schema=response_schema,
         )
 
-        # Create prompt for HCC relevance analysis
-        prompt = self._create_hcc_analysis_prompt(conditions, hcc_codes)
+    def _prepare_request(
+            self, request_section: str, hcc_codes: Optional[List[Dict[str, Any]]]
+    ) -> Tuple[GenerativeModel, str]:
+        """
+        Choose the model and build the prompt for an HCC analysis request.
 
-        # Generate response
-        response = self.model.generate_content(
-            prompt,
-            generation_config=generation_config,
-        )
+        Args:
+            request_section: Per-request part of the prompt
+            hcc_codes: Reference list of HCC-relevant codes
+
+        Returns:
+            Tuple of the model to call and the prompt to send to it
+        """
+        # The prompt is the static preamble followed by the per-request section
+        preamble = self._get_preamble(hcc_codes)
+
+        # Use a model bound to the cached preamble when context caching is available
+        if self.use_context_cache:
+            self._init_vertex()
+            cached_model = context_cache.get_model(self.model_name, preamble)
+            if cached_model is not None:
+                return cached_model, request_section
+
+        return self.model, preamble + request_section
+
+    def _hcc_codes_fingerprint_for(self, hcc_codes: Optional[List[Dict[str, Any]]]) -> bytes:
+        """Fingerprint the HCC codes of a request, reusing the client's own when they match."""
+        if hcc_codes is None or hcc_codes is self.hcc_codes or hcc_codes == self.hcc_codes:
+            return self._hcc_codes_fingerprint
+        return _fingerprint(hcc_codes)
+
+    def _response_cache_key(
+            self, conditions: List[Dict[str, Any]], hcc_codes: Optional[List[Dict[str, Any]]]
+    ) -> str:
+        """
+        Compute the response cache key for a request.
+
+        The key is a hash of the model name, the HCC codes and the conditions
+        in ID order, so the same conditions in any order share a response.
+
+        Args:
+            conditions: List of conditions with their ICD codes
+            hcc_codes: Reference list of HCC-relevant codes, or None to use the
+                codes the client was created with
+
+        Returns:
+            Hex digest identifying the request
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.model_name.encode())
+        digest.update(self._hcc_codes_fingerprint_for(hcc_codes))
+        digest.update(_fingerprint(sorted(conditions, key=lambda c: str(c.get("id")))))
+        return digest.hexdigest()
+
+    def _parse_stream(self, response_stream: Iterable[Any]) -> List[Dict[str, Any]]:
+        """
+        Parse conditions from a streamed response as its chunks arrive.
+
+        Args:
+            response_stream: Response chunks from generate_content(stream=True)
+
+        Returns:
+            List of conditions with HCC relevance determination
+        """
+        parser = ResultStreamParser()
+        chunks: List[str] = []
+        results: List[Dict[str, Any]] = []
+        for chunk in response_stream:
+            self._feed_chunk(parser, chunk, chunks, results)
 
-        response_str = response.text
-        response_str = response_str.replace("```json", "```json\n")
-        response_str = response_str.replace("```", "```\n")
-        response_str = response_str.replace("NaN", "null")
-        response_str = response_str.replace("nan", "null")
+        return self._finish_stream(parser, chunks, results)
 
-        # logging.info(f"Response text: {response_str}")
+    async def _aparse_stream(self, response_stream: AsyncIterable[Any]) -> List[Dict[str, Any]]:
+        """
+        Parse conditions from an async streamed response as its chunks arrive.
+
+        Args:
+            response_stream: Response chunks from generate_content_async(stream=True)
 
-        # Parse and return the results
+        Returns:
+            List of conditions with HCC relevance determination
+        """
+        parser = ResultStreamParser()
+        chunks: List[str] = []
+        results: List[Dict[str, Any]] = []
+        async for chunk in response_stream:
+            self._feed_chunk(parser, chunk, chunks, results)
+
+        return self._finish_stream(parser, chunks, results)
+
+    @staticmethod
+    def _feed_chunk(
+            parser: ResultStreamParser,
+            chunk: Any,
+            chunks: List[str],
+            results: List[Dict[str, Any]],
+    ) -> None:
+        """
+        Feed one response chunk to the stream parser.
+
+        Args:
+            parser: Parser for the streamed response
+            chunk: Response chunk
+            chunks: Text of the chunks so far, kept for the fallback parse
+            results: Conditions parsed so far, extended in place
+        """
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts, such as a final finish-reason chunk
+            return
+
+        chunks.append(text)
+        try:
+            results.extend(parser.feed(text))
+        except ValueError:
+            # Leave malformed output to the full-text parse
+            parser.failed = True
+
+    def _finish_stream(
+            self,
+            parser: ResultStreamParser,
+            chunks: List[str],
+            results: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """
+        Complete the results of a streamed response.
+
+        Args:
+            parser: Parser for the streamed response
+            chunks: Text of all response chunks
+            results: Conditions parsed while streaming
+
+        Returns:
+            List of conditions with HCC relevance determination
+        """
+        if parser.done and not parser.failed and results:
+            return results
+
+        # The response didn't stream cleanly; parse the full text instead
+        return self._parse_response("".join(chunks))
+
+    def _parse_response(self, response_str: str, key: str = "conditions") -> List[Dict[str, Any]]:
+        """
+        Parse the conditions out of a Gemini response.
+
+        Args:
+            response_str: Raw response text
+            key: Top-level key holding the results ("documents" for batches)
+
+        Returns:
+            List of conditions with HCC relevance determination
+        """
+        # Responses are schema-constrained, so the text is the JSON object itself
         try:
-            # First try direct JSON parsing
-            try:
-                results = json.loads(response_str)
-                return results.get("conditions", [])
-            except json.JSONDecodeError:
-                # If direct parsing fails, try to extract JSON from Markdown code blocks
-                import re
-
-                # Look for JSON code blocks (```json ... ```)
-                json_match = re.search(r'```(?:json)?\s*\n(.*?)\n```', response_str, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(1)
-                    results = json.loads(json_content)
-                    conditions_result = results.get("conditions", [])
-
-                    # Fix NaN values
-                    from analyzer.graph.nodes import fix_nan_values
-                    conditions_result = fix_nan_values(conditions_result)
-
-                    return conditions_result
-
-                # Try looking for just the JSON object pattern
-                json_object_match = re.search(r'(\{\s*"conditions"\s*:.*\})', response_str, re.DOTALL)
-                if json_object_match:
-                    json_content = json_object_match.group(1)
-                    results = json.loads(json_content)
-                    conditions_result = results.get("conditions", [])
-
-                    # Fix NaN values
-                    from analyzer.graph.nodes import fix_nan_values
-                    conditions_result = fix_nan_values(conditions_result)
-
-                    return conditions_result
-
-                # If we get here, we couldn't parse the JSON
-                raise ValueError(f"Could not extract valid JSON from response: {response_str[:200]}...")
-
-        except Exception as e:
+            return orjson.loads(response_str).get(key, [])
+        except (orjson.JSONDecodeError, AttributeError) as e:
             # Log the error and response for debugging
-            logging.error(f"Error parsing response: {str(e)}")
-            # logging.error(f"Response text: {response.text}")
+            logging.error(f"Error parsing response: {str(e)}: {response_str[:200]}")
             return []
 
     def _create_hcc_analysis_prompt(
             self,
             conditions: List[Dict[str, Any]],
-            hcc_codes: List[Dict[str, Any]]
+            hcc_codes: Optional[List[Dict[str, Any]]] = None
     ) -> str:
         """
         Create a prompt for HCC relevance analysis.
 
         Args:
             conditions: List of conditions with their ICD codes
-            hcc_codes: Reference list of HCC-relevant codes
+            hcc_codes: Reference list of HCC-relevant codes (defaults to the
+                codes the client was created with)
 
         Returns:
             Prompt for the Gemini model
         """
-        # Fix NaN values in HCC codes before using them
-        fixed_hcc_codes = []
-        import math
-
-        for code in hcc_codes:
-            fixed_code = {}
-            for key, value in code.items():
-                # Check for NaN values in any field
-                if isinstance(value, float) and math.isnan(value):
-                    fixed_code[key] = ""
-                elif isinstance(value, str):
-                    # Replace string "NaN" or "nan" with empty string
-                    fixed_code[key] = value.replace("NaN", "").replace("nan", "")
-                else:
-                    fixed_code[key] = value
-            fixed_hcc_codes.append(fixed_code)
-
-        logging.info(f"Fixed HCC codes sample: {fixed_hcc_codes[:2]}")
-
-        # Convert conditions to string
-        conditions_str = json.dumps(conditions, indent=2)
-
-        # Create a condensed version of HCC codes
+        return self._get_preamble(hcc_codes) + self._create_conditions_section(conditions)
+
+    def _get_preamble(self, hcc_codes: Optional[List[Dict[str, Any]]]) -> str:
+        """
+        Get the prompt preamble for the given HCC codes.
+
+        Args:
+            hcc_codes: Reference list of HCC-relevant codes, or None to use the
+                codes the client was created with
+
+        Returns:
+            Instructions and HCC reference sample for the Gemini model
+
+        Raises:
+            ValueError: If no HCC codes are given and the client has none
+        """
+        if self._prompt_preamble is not None and (
+                hcc_codes is None or hcc_codes is self.hcc_codes or hcc_codes == self.hcc_codes
+        ):
+            return self._prompt_preamble
+
+        if hcc_codes is None:
+            raise ValueError("hcc_codes is required when the client was created without HCC codes")
+
+        key = _fingerprint(hcc_codes)
+        preamble = _preamble_cache.get(key)
+        if preamble is None:
+            preamble = self._create_hcc_analysis_preamble(hcc_codes)
+            if len(_preamble_cache) >= _PREAMBLE_CACHE_SIZE:
+                _preamble_cache.clear()
+            _preamble_cache[key] = preamble
+        return preamble
+
+    def _create_hcc_analysis_preamble(self, hcc_codes: List[Dict[str, Any]]) -> str:
+        """
+        Create the static part of the HCC analysis prompt.
+
+        The preamble holds the instructions and the HCC reference sample, which
+        are identical across requests. It comes first in the prompt so it can be
+        served from the context cache or Gemini's implicit prefix cache.
+
+        Args:
+            hcc_codes: Reference list of HCC-relevant codes
+
+        Returns:
+            Instructions and HCC reference sample for the Gemini model
+        """
+        # Create a condensed version of HCC codes. Codes loaded by the pipeline
+        # are already free of NaN values.
         # We'll limit to a maximum of 50 codes to avoid token limits
-        hcc_codes_sample = fixed_hcc_codes[:50]
-        hcc_codes_str = json.dumps(hcc_codes_sample, indent=2)
+        hcc_codes_sample = hcc_codes[:50]
+        # A CSV table repeats no field names or JSON punctuation per row
+        hcc_codes_str = _format_csv_table(hcc_codes_sample)
 
-        prompt = f"""
+        return f"""
             You are a medical coding expert specializing in HCC (Hierarchical Condition Categories) analysis.
 
             I will provide you with:
-            1. A list of medical conditions with their ICD-10 codes extracted from a clinical note
-            2. A sample of HCC-relevant ICD-10 codes for reference
+            1. A sample of HCC-relevant ICD-10 codes for reference
+            2. A list of medical conditions with their ICD-10 codes extracted from a clinical note
 
             Your task is to:
             1. Determine which of the extracted conditions are HCC-relevant
@@ -195,15 +995,58 @@ class GeminiClient:
 
             Even if the exact ICD code is not in the sample of HCC-relevant codes I provided, use your knowledge to determine if a condition would be HCC-relevant. Consider disease severity, chronicity, and impact on resource utilization and risk adjustment.
 
+            Here is a sample of HCC-relevant ICD-10 codes, as CSV with a header row:
+{hcc_codes_str}
+            Note that this is only a sample. The full list of HCC-relevant codes is much more extensive. Use your knowledge to make determinations for codes not in this sample. If you're uncertain, state so in the reasoning field.
+            """
+
+    def _create_conditions_section(self, conditions: List[Dict[str, Any]]) -> str:
+        """
+        Create the per-request part of the HCC analysis prompt.
+
+        Args:
+            conditions: List of conditions with their ICD codes
+
+        Returns:
+            Conditions section to follow the preamble
+        """
+        # Convert conditions to string; indentation only costs tokens
+        conditions_str = orjson.dumps(conditions).decode()
+
+        return f"""
             Here are the extracted conditions:
                     {conditions_str}
-            Here is a sample of HCC-relevant ICD-10 codes:
-                    {hcc_codes_str}
-            Note that this is only a sample. The full list of HCC-relevant codes is much more extensive. Use your knowledge to make determinations for codes not in this sample. If you're uncertain, state so in the reasoning field.
+            """
 
-            Ensure the output is valid JSON.
+    def _create_documents_section(self, documents: List[Tuple[str, List[Dict[str, Any]]]]) -> str:
+        """
+        Create the per-request part of a batched HCC analysis prompt.
+
+        Args:
+            documents: (doc_id, conditions) pairs
 
-            Return just the JSON object with the conditions. Do not include any additional text or formatting.
-            Do not include code limiters (triple quotes) in the response like ```json ``` or ```python```.
+        Returns:
+            Documents section to follow the preamble
+        """
+        documents_str = orjson.dumps(
+            [{"doc_id": doc_id, "conditions": conditions} for doc_id, conditions in documents]
+        ).decode()
+
+        return f"""
+            Here are the extracted conditions, grouped by document:
+                    {documents_str}
+
+            Analyze each document's conditions independently. Instead of a single
+            "conditions" array, return one entry per document with this exact format:
+            {{
+                "documents": [
+                {{
+                    "doc_id": "document ID from the input",
+                    "conditions": [
+                        // Conditions of this document, in the format described above
+                    ]
+                }},
+                // Additional documents...
+                ]
+            }}
             """
-        return prompt
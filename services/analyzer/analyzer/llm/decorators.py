@@ -5,51 +5,117 @@ This module provides decorators for common patterns like caching,
 retry logic, and rate limiting when interacting with LLM APIs.
 """
 
+import asyncio
 import functools
+import logging
 import random
+import threading
 import time
-from typing import Any, Callable, Dict, TypeVar, cast
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple, TypeVar, cast
+
+import orjson
+
+logger = logging.getLogger(__name__)
 
 # Define type variables for type hinting
 F = TypeVar('F', bound=Callable[..., Any])
 T = TypeVar('T')
 
-# Simple in-memory cache
-_cache: Dict[str, Dict[str, Any]] = {}
+# Separates positional from keyword arguments in cache keys
+_KWARGS_MARK = object()
+# Starts cache keys built from the JSON encoding of unhashable arguments
+_JSON_MARK = object()
+
+# Errors from bad input or bad code, which fail the same way on every attempt.
+# pydantic's ValidationError is a ValueError
+NON_RETRYABLE_EXCEPTIONS = (ValueError, TypeError, KeyError)
+
+
+def _make_key(args: Tuple[Any, ...], kwargs: Dict[str, Any], typed: bool) -> Optional[Hashable]:
+    """
+    Build a cache key from the arguments of a call.
+
+    Hashable arguments are used as they are. Calls with unhashable arguments,
+    such as lists or dicts, are keyed on the JSON encoding of the arguments,
+    with dict keys sorted so that equal dicts share a key.
+
+    Args:
+        args: Positional arguments of the call
+        kwargs: Keyword arguments of the call
+        typed: Whether to key on the argument types as well as their values
+
+    Returns:
+        Cache key, or None if the arguments can't be encoded
+    """
+    types = tuple(type(value) for value in (*args, *kwargs.values())) if typed else ()
+    key = args + (_KWARGS_MARK, *kwargs.items()) if kwargs else args
+    try:
+        hash(key)
+        return key + types
+    except TypeError:
+        pass
 
+    try:
+        encoded = orjson.dumps([args, kwargs], option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        return None
+    return (_JSON_MARK, encoded) + types
 
-def cache(ttl_seconds: int = 3600) -> Callable[[F], F]:
+
+def cache(ttl_seconds: int = 3600, maxsize: int = 1024, typed: bool = False) -> Callable[[F], F]:
     """
     Cache the result of a function call.
 
+    Each decorated function gets its own cache holding at most ``maxsize``
+    results; the least recently used entry is evicted when it is full. As
+    with ``functools.lru_cache``, arguments that compare equal share a result
+    unless ``typed`` is set, so ``1``, ``1.0`` and ``True`` hit the same entry.
+    Lists and dicts are cached by their JSON encoding; calls with arguments
+    that are neither hashable nor JSON-serializable are not cached.
+
     Args:
         ttl_seconds: Time-to-live for cached results in seconds
+        maxsize: Maximum number of cached results
+        typed: Whether to cache arguments of different types separately
 
     Returns:
         Decorated function with caching
     """
 
     def decorator(func: F) -> F:
+        _cache: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        _lock = threading.RLock()
+
         @functools.wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
-            # Create a cache key from the function name and arguments
-            key_parts = [func.__name__]
-            key_parts.extend(str(arg) for arg in args)
-            key_parts.extend(f"{k}={v}" for k, v in sorted(kwargs.items()))
-            cache_key = ":".join(key_parts)
-
-            # Check if result is in cache and not expired
-            if cache_key in _cache:
-                result_dict = _cache[cache_key]
-                if result_dict["timestamp"] + ttl_seconds > time.time():
-                    return result_dict["result"]
+            # Create a cache key from the arguments
+            cache_key = _make_key(args, kwargs, typed)
+            if cache_key is None:
+                return func(*args, **kwargs)
+
+            # Check if result is in cache and not expired; the monotonic clock
+            # isn't affected by wall-clock adjustments
+            now = time.monotonic()
+            with _lock:
+                result_dict = _cache.get(cache_key)
+                if result_dict is not None:
+                    if result_dict["timestamp"] + ttl_seconds > now:
+                        _cache.move_to_end(cache_key)
+                        return result_dict["result"]
+                    del _cache[cache_key]
 
             # Call the function and cache the result
             result = func(*args, **kwargs)
-            _cache[cache_key] = {
-                "result": result,
-                "timestamp": time.time()
-            }
+            with _lock:
+                _cache[cache_key] = {
+                    "result": result,
+                    "timestamp": now
+                }
+                _cache.move_to_end(cache_key)
+                if len(_cache) > maxsize:
+                    _cache.popitem(last=False)
 
             return result
 
@@ -58,12 +124,212 @@ def cache(ttl_seconds: int = 3600) -> Callable[[F], F]:
     return decorator
 
 
+def _backoff_delays(
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        backoff_factor: float,
+) -> List[float]:
+    """
+    Compute the delay before each retry, without jitter.
+
+    Args:
+        max_attempts: Maximum number of attempts
+        base_delay: Initial delay between retries in seconds
+        max_delay: Maximum delay between retries in seconds
+        backoff_factor: Factor by which to increase delay after each attempt
+
+    Returns:
+        Delay in seconds after each failed attempt but the last
+    """
+    return [
+        min(base_delay * (backoff_factor ** attempt), max_delay)
+        for attempt in range(max_attempts - 1)
+    ]
+
+
+def _retried_anyway(exceptions: tuple, non_retryable: tuple) -> tuple:
+    """
+    Find the exceptions a caller asked to retry that are otherwise non-retryable.
+
+    Args:
+        exceptions: Tuple of exceptions to catch and retry
+        non_retryable: Tuple of exceptions raised at once by default
+
+    Returns:
+        Entries of ``exceptions`` that are subclasses of ``non_retryable``
+    """
+    return tuple(exc for exc in exceptions if issubclass(exc, non_retryable))
+
+
+def timeout(seconds: Optional[float], max_abandoned: int = 8) -> Callable[[F], F]:
+    """
+    Bound the time a function call may take.
+
+    Coroutine functions are cancelled when the time is up. Plain functions
+    run on a thread of their own, started with the call, so the limit counts
+    from when the call starts running. Such a call can't be interrupted: the
+    caller stops waiting for it, but it keeps its thread until it returns.
+    To keep hung calls from piling up, each is logged, and once
+    ``max_abandoned`` of them are still running, further calls fail at once
+    until some finish.
+
+    Args:
+        seconds: Maximum duration of a call in seconds; None or 0 disables
+            the limit
+        max_abandoned: Maximum number of timed-out plain function calls
+            left running before new calls are refused
+
+    Returns:
+        Decorated function raising TimeoutError when a call takes too long
+    """
+
+    def decorator(func: F) -> F:
+        if not seconds:
+            return func
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                return await asyncio.wait_for(func(*args, **kwargs), seconds)
+
+            return cast(F, async_wrapper)
+
+        lock = threading.Lock()
+        # Timed-out calls still running in the background
+        abandoned: Set[Future] = set()
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with lock:
+                if len(abandoned) >= max_abandoned:
+                    raise TimeoutError(
+                        f"{func.__qualname__}: {len(abandoned)} timed-out calls are still running"
+                    )
+
+            future: Future = Future()
+
+            def run() -> None:
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+                finally:
+                    with lock:
+                        abandoned.discard(future)
+
+            threading.Thread(target=run, name=func.__qualname__, daemon=True).start()
+            try:
+                return future.result(timeout=seconds)
+            except FuturesTimeoutError:
+                with lock:
+                    if future.done():
+                        # Finished just as the time ran out
+                        return future.result()
+                    abandoned.add(future)
+                    running = len(abandoned)
+                logger.warning(
+                    "%s timed out after %ss; %d timed-out call(s) still running",
+                    func.__qualname__, seconds, running,
+                )
+                raise TimeoutError(f"{func.__qualname__} timed out after {seconds}s")
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+class TokenBucket:
+    """Token bucket that spaces out calls to stay under a request rate."""
+
+    def __init__(self, capacity: int, refill_per_sec: float) -> None:
+        """
+        Initialize the bucket, full.
+
+        Args:
+            capacity: Number of calls allowed in a burst
+            refill_per_sec: Sustained number of calls allowed per second
+        """
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """
+        Take a token, borrowing against future refills if the bucket is empty.
+
+        Returns:
+            Seconds to wait before the reserved token is available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last_refill) * self.refill_per_sec
+            )
+            self._last_refill = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_per_sec
+
+    def acquire(self) -> None:
+        """Block until a call may proceed."""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self) -> None:
+        """Wait, without blocking the event loop, until a call may proceed."""
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+def rate_limit(capacity: int, refill_per_sec: float) -> Callable[[F], F]:
+    """
+    Limit the rate of calls to a function with a token bucket.
+
+    Bursts of up to ``capacity`` calls go through immediately; beyond that,
+    calls wait locally instead of being rejected by the provider. Works on
+    both functions and coroutine functions.
+
+    Args:
+        capacity: Number of calls allowed in a burst
+        refill_per_sec: Sustained number of calls allowed per second
+
+    Returns:
+        Decorated function with rate limiting
+    """
+    bucket = TokenBucket(capacity, refill_per_sec)
+
+    def decorator(func: F) -> F:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                await bucket.aacquire()
+                return await func(*args, **kwargs)
+
+            return cast(F, async_wrapper)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            bucket.acquire()
+            return func(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
 def retry(
         max_attempts: int = 3,
         base_delay: float = 1.0,
         max_delay: float = 10.0,
         backoff_factor: float = 2.0,
         exceptions: tuple = (Exception,),
+        non_retryable: tuple = NON_RETRYABLE_EXCEPTIONS,
 ) -> Callable[[F], F]:
     """
     Retry a function call on failure with exponential backoff.
@@ -74,40 +340,82 @@ def retry(
         max_delay: Maximum delay between retries in seconds
         backoff_factor: Factor by which to increase delay after each attempt
         exceptions: Tuple of exceptions to catch and retry
+        non_retryable: Tuple of exceptions raised at once, since retrying
+            can't fix them, even if they are caught by a broad entry of
+            ``exceptions`` such as ``Exception``; exceptions named explicitly
+            in ``exceptions`` (or their subclasses) are still retried
 
     Returns:
         Decorated function with retry logic
     """
+    delays = _backoff_delays(max_attempts, base_delay, max_delay, backoff_factor)
+    retried_anyway = _retried_anyway(exceptions, non_retryable)
 
     def decorator(func: F) -> F:
         @functools.wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
-            last_exception = None
-
-            for attempt in range(max_attempts):
+            for delay in delays:
                 try:
                     return func(*args, **kwargs)
                 except exceptions as e:
-                    last_exception = e
-
-                    # Don't sleep after the last attempt
-                    if attempt < max_attempts - 1:
-                        # Calculate delay with jitter
-                        delay = min(
-                            base_delay * (backoff_factor ** attempt),
-                            max_delay
-                        )
-                        jitter = random.uniform(0.8, 1.2)
-                        sleep_time = delay * jitter
-
-                        time.sleep(sleep_time)
-
-            # If we get here, all attempts failed
-            if last_exception:
-                raise last_exception
-
-            # This should never happen, but just in case
-            raise RuntimeError("All retry attempts failed without an exception")
+                    if isinstance(e, non_retryable) and not isinstance(e, retried_anyway):
+                        raise
+                    # Sleep with jitter of +/-20%
+                    time.sleep(delay * (0.8 + 0.4 * random.random()))
+
+            # Last attempt; its exception propagates
+            return func(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def aretry(
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 10.0,
+        backoff_factor: float = 2.0,
+        exceptions: tuple = (Exception,),
+        non_retryable: tuple = NON_RETRYABLE_EXCEPTIONS,
+) -> Callable[[F], F]:
+    """
+    Retry a coroutine function on failure with exponential backoff.
+
+    Like retry(), but waits with asyncio.sleep so the event loop keeps
+    running other tasks between attempts.
+
+    Args:
+        max_attempts: Maximum number of attempts
+        base_delay: Initial delay between retries in seconds
+        max_delay: Maximum delay between retries in seconds
+        backoff_factor: Factor by which to increase delay after each attempt
+        exceptions: Tuple of exceptions to catch and retry
+        non_retryable: Tuple of exceptions raised at once, since retrying
+            can't fix them, even if they are caught by a broad entry of
+            ``exceptions`` such as ``Exception``; exceptions named explicitly
+            in ``exceptions`` (or their subclasses) are still retried
+
+    Returns:
+        Decorated coroutine function with retry logic
+    """
+    delays = _backoff_delays(max_attempts, base_delay, max_delay, backoff_factor)
+    retried_anyway = _retried_anyway(exceptions, non_retryable)
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            for delay in delays:
+                try:
+                    return await func(*args, **kwargs)
+                except exceptions as e:
+                    if isinstance(e, non_retryable) and not isinstance(e, retried_anyway):
+                        raise
+                    # Sleep with jitter of +/-20%
+                    await asyncio.sleep(delay * (0.8 + 0.4 * random.random()))
+
+            # Last attempt; its exception propagates
+            return await func(*args, **kwargs)
 
         return cast(F, wrapper)
 
@@ -0,0 +1,110 @@
+"""
+Incremental parsing of streamed Gemini responses.
+
+This module extracts the objects of the top-level results array from a JSON
+response as it streams in, so each condition is parsed while the rest of the
+response is still being generated.
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+# Characters that change the scanner state outside and inside JSON strings
+_STRUCTURE_RE = re.compile(r'["{}\]]')
+_STRING_RE = re.compile(r'["\\]')
+
+
+class ResultStreamParser:
+    """Extract the objects of a JSON response's results array as text arrives."""
+
+    def __init__(self, key: str = "conditions") -> None:
+        """
+        Initialize the parser.
+
+        Args:
+            key: Top-level key holding the results array
+        """
+        self._marker = f'"{key}"'
+        self._buffer = ""
+        self._in_array = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._object_start: Optional[int] = None
+        self.done = False
+        # Set by the caller when fed text turned out to be malformed
+        self.failed = False
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Add response text and return the objects it completed.
+
+        Args:
+            text: Next chunk of the response
+
+        Returns:
+            Objects of the results array completed by this chunk
+
+        Raises:
+            orjson.JSONDecodeError: If a completed object is not valid JSON
+        """
+        if self.done or self.failed:
+            return []
+        self._buffer += text
+
+        if not self._in_array:
+            marker_index = self._buffer.find(self._marker)
+            if marker_index < 0:
+                return []
+            array_index = self._buffer.find("[", marker_index + len(self._marker))
+            if array_index < 0:
+                return []
+            self._buffer = self._buffer[array_index + 1:]
+            self._in_array = True
+            self._pos = 0
+
+        results = []
+        buffer = self._buffer
+        pos = self._pos
+        while not self.done:
+            match = (_STRING_RE if self._in_string else _STRUCTURE_RE).search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+
+            char = match.group()
+            pos = match.end()
+            if self._in_string:
+                if char == "\\":
+                    # Skip the escaped character, unless it hasn't arrived yet
+                    if pos >= len(buffer):
+                        pos -= 1
+                        break
+                    pos += 1
+                else:
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._object_start = match.start()
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    results.append(orjson.loads(buffer[self._object_start:pos]))
+                    self._object_start = None
+            elif self._depth == 0:
+                # Closing bracket of the results array
+                self.done = True
+
+        # Drop text that is fully consumed
+        keep_from = self._object_start if self._object_start is not None else pos
+        self._buffer = buffer[keep_from:]
+        self._pos = pos - keep_from
+        if self._object_start is not None:
+            self._object_start = 0
+
+        return results
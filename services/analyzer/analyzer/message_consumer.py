@@ -9,19 +9,23 @@ import asyncio
 import json
 import logging
 import os
+import signal
 import sys
+import time
 from typing import Dict, Any, Optional, List
 
 import aio_pika
+import orjson
 from aio_pika import Message, DeliveryMode, ExchangeType
 from aio_pika.abc import AbstractIncomingMessage
 from dotenv import load_dotenv
+from pydantic import TypeAdapter
 
 from analyzer.db.database_integration import db_updater
 from analyzer.db.models.document import ProcessingStatus
-from analyzer.graph.pipeline import AnalysisPipeline
+from analyzer.graph.pipeline import get_pipeline
 from analyzer.models.condition import Condition
-from analyzer.storage.local import LocalStorageManager
+from analyzer.storage.local import LocalStorageManager, ensure_directory
 
 # Configure logging
 logging.basicConfig(
@@ -33,6 +37,17 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Validates a whole extraction's conditions in one call
+_CONDITION_LIST_ADAPTER = TypeAdapter(List[Condition])
+
+# HCC fields of incoming conditions start unset; the pipeline fills them in
+_UNANALYZED_HCC_FIELDS = {
+    "hcc_relevant": False,
+    "hcc_code": None,
+    "hcc_category": None,
+    "reasoning": None,
+}
+
 
 class MessageConsumer:
     """Consumer for processing messages from RabbitMQ."""
@@ -49,6 +64,8 @@ class MessageConsumer:
             input_dir: str = "./data",
             output_dir: str = "./output",
             hcc_codes_path: str = "./data/HCC_relevant_codes.csv",
+            prefetch: int = 50,
+            concurrency: int = 8,
     ) -> None:
         """
         Initialize the message consumer.
@@ -64,6 +81,10 @@ class MessageConsumer:
             input_dir: Directory for input documents
             output_dir: Directory for output results
             hcc_codes_path: Path to the CSV file containing HCC codes
+            prefetch: Number of unacknowledged messages the broker may deliver
+                ahead. Too high a value lets messages wait on slow LLM steps
+                until they hit the broker's acknowledgement timeout
+            concurrency: Maximum number of messages processed at once
         """
         self.host = host
         self.port = port
@@ -75,10 +96,16 @@ class MessageConsumer:
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.hcc_codes_path = hcc_codes_path
+        self.prefetch = prefetch
+
+        # Prefetched messages wait here for a free pipeline run
+        self._processing_slots = asyncio.Semaphore(concurrency)
+        # Set to stop consuming
+        self._stop = asyncio.Event()
 
         # Initialize components
         self.storage = LocalStorageManager(self.input_dir, self.output_dir)
-        self.pipeline = AnalysisPipeline(hcc_codes_path=self.hcc_codes_path)
+        self.pipeline = get_pipeline(self.hcc_codes_path)
 
         # RabbitMQ connection and channel
         self.connection: Optional[aio_pika.Connection] = None
@@ -97,59 +124,60 @@ class MessageConsumer:
             # Create connection string
             host = self.virtual_host.replace("/", "%2F")
             connection_string = f"amqp://{self.username}:{self.password}@{self.host}:{self.port}/{host}"
-            logging.info(f"Connecting to RabbitMQ at {connection_string}")
+            logger.info("Connecting to RabbitMQ at %s:%s (vhost %s)", self.host, self.port, self.virtual_host)
 
             # Connect to RabbitMQ
             self.connection = await aio_pika.connect_robust(connection_string)
 
             # Create channel
             self.channel = await self.connection.channel()
-            await self.channel.set_qos(prefetch_count=1, timeout=360, all_channels=True)
-            # Declare exchange
-            self.exchange = await self.channel.declare_exchange(
-                self.exchange_name,
-                ExchangeType.TOPIC,
-                durable=True
-            )
-
-            # Declare queue
-            self.queue = await self.channel.declare_queue(
-                self.queue_name,
-                durable=True
+            await self.channel.set_qos(prefetch_count=self.prefetch, timeout=360, all_channels=True)
+            # Declare exchange and queue; they are independent, so both
+            # declarations share one round trip
+            self.exchange, self.queue = await asyncio.gather(
+                self.channel.declare_exchange(
+                    self.exchange_name,
+                    ExchangeType.TOPIC,
+                    durable=True
+                ),
+                self.channel.declare_queue(
+                    self.queue_name,
+                    durable=True
+                ),
             )
 
             # Bind queue to exchange with routing keys for extraction completed messages
             await self.queue.bind(self.exchange, routing_key="document.extraction.completed")
             # await self.queue.bind(self.exchange, routing_key="#")
 
-            logger.info(f"Connected to RabbitMQ at {self.host}:{self.port}")
+            logger.info("Connected to RabbitMQ at %s:%s", self.host, self.port)
 
         except Exception as e:
-            logger.error(f"Failed to connect to RabbitMQ: {str(e)}")
+            logger.error("Failed to connect to RabbitMQ: %s", e)
             raise ConnectionError(f"Failed to connect to RabbitMQ: {str(e)}")
 
     async def start_consuming(self) -> None:
         """
         Start consuming messages from the queue.
 
-        This method runs indefinitely, processing incoming messages.
+        This method processes incoming messages until stop() is called.
         """
         if not self.connection or not self.channel or not self.queue:
             await self.connect()
 
-        logger.info(f"Starting to consume messages from queue '{self.queue_name}'")
+        logger.info("Starting to consume messages from queue '%s'", self.queue_name)
 
         # Set up message handler
         await self.queue.consume(self._process_message)
 
-        # Keep the consumer running
+        # Keep the consumer running until stopped
         try:
-            while True:
-                await asyncio.sleep(1)
+            await self._stop.wait()
+            logger.info("Consumer was stopped, shutting down")
         except asyncio.CancelledError:
             logger.info("Consumer was cancelled, shutting down")
         except Exception as e:
-            logger.error(f"Error in consumer: {str(e)}")
+            logger.error("Error in consumer: %s", e)
         finally:
             await self.close()
 
@@ -160,26 +188,27 @@ class MessageConsumer:
         Args:
             message: The incoming message from RabbitMQ
         """
-        async with message.process():
+        async with self._processing_slots, message.process():
             try:
-                # Decode message body
-                body = message.body.decode()
-                logger.info(f"Received message: {body[:250]}...")
+                # Only the logged prefix needs decoding; orjson parses bytes
+                body = message.body
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Received message: %s...", body[:250].decode(errors="replace"))
 
                 # Parse message content
-                content = json.loads(body)
+                content = orjson.loads(body)
                 message_type = content.get("message_type")
 
                 # Handle different message types
                 if message_type == "document.extraction.completed":
                     await self._handle_extraction_completed(content)
                 else:
-                    logger.warning(f"Unknown message type: {message_type}")
+                    logger.warning("Unknown message type: %s", message_type)
 
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 logger.error("Failed to decode message as JSON")
             except Exception as e:
-                logger.exception(f"Error processing message: {str(e)}")
+                logger.exception("Error processing message: %s", e)
 
     async def _handle_extraction_completed(
             self,
@@ -200,10 +229,10 @@ class MessageConsumer:
             return
 
         try:
-            logger.info(f"Processing extraction result: {document_id}, path: {extraction_result_path}")
+            logger.info("Processing extraction result: %s, path: %s", document_id, extraction_result_path)
 
             # Update document status in database to ANALYZING
-            db_updater.update_document_analysis_status(
+            await self._update_status(
                 document_id=document_id,
                 total_conditions=total_conditions,
                 status=ProcessingStatus.ANALYZING,
@@ -215,12 +244,12 @@ class MessageConsumer:
 
             # First try to get it from the message if it includes the data
             if "extracted_content" in content:
-                logging.info("Extracted content found in message")
+                logger.info("Extracted content found in message")
                 extracted_content = content.get("extracted_content")
                 if extracted_content:
                     # Create input file for the extraction result
                     input_filename = os.path.join(self.output_dir, extraction_result_path)
-                    os.makedirs(os.path.dirname(input_filename), exist_ok=True)
+                    ensure_directory(os.path.dirname(input_filename))
 
                     # Parse the conditions from the extraction content
                     conditions_data = self._parse_conditions_from_content(extracted_content)
@@ -233,57 +262,49 @@ class MessageConsumer:
 
             # If not available in message, try to read from file
             if not extraction_json:
-                logging.info("Extracted content not found in message, trying to read from file")
+                logger.info("Extracted content not found in message, trying to read from file")
                 # Look for file in input directory
                 input_filepath = os.path.join(self.output_dir, extraction_result_path)
-                if os.path.exists(input_filepath):
-                    with open(input_filepath, 'r') as f:
-                        extraction_json = json.load(f)
-                else:
-                    logger.error(f"Extraction result file not found: {input_filepath}")
+                # File I/O runs in a worker thread so other messages keep flowing.
+                # Opening the file is the existence check, so there is no
+                # separate stat call that could race with the read
+                try:
+                    extraction_json = await asyncio.to_thread(self._read_extraction_file, input_filepath)
+                except FileNotFoundError:
+                    logger.error("Extraction result file not found: %s", input_filepath)
 
                     # Update status to FAILED if file not found
-                    db_updater.update_document_analysis_status(
+                    await self._update_status(
                         document_id=document_id,
                         status=ProcessingStatus.FAILED
                     )
                     return
 
             # Convert JSON to Condition objects
-            conditions = []
-            for cond_data in extraction_json.get("conditions", []):
-                condition = Condition(
-                    id=cond_data.get("id"),
-                    name=cond_data.get("name"),
-                    icd_code=cond_data.get("icd_code"),
-                    icd_description=cond_data.get("icd_description"),
-                    details=cond_data.get("details"),
-                    confidence=cond_data.get("confidence", 0.0),
-                    metadata=cond_data.get("metadata", {}),
-                    # Initialize HCC fields as empty/default
-                    hcc_relevant=False,
-                    hcc_code=None,
-                    hcc_category=None,
-                    reasoning=None,
-                )
-                conditions.append(condition)
+            conditions = _CONDITION_LIST_ADAPTER.validate_python([
+                {**cond_data, **_UNANALYZED_HCC_FIELDS}
+                for cond_data in extraction_json.get("conditions", [])
+            ])
 
             # Process conditions to determine HCC relevance
-            analysis_result = self.pipeline.process(document_id, conditions)
+            # Awaited, so other in-flight messages progress during LLM calls
+            analysis_result = await self.pipeline.aprocess(document_id, conditions)
 
             # Save results
             output_filename = f"{document_id}_analyzed.json"
-            output_path = self.storage.save_result(analysis_result, output_filename)
+            output_path = await asyncio.to_thread(self.storage.save_result, analysis_result, output_filename)
 
             # Count HCC-relevant conditions
-            hcc_relevant_count = sum(1 for c in analysis_result.conditions if c.hcc_relevant)
+            hcc_relevant_count = sum([c.hcc_relevant for c in analysis_result.conditions])
 
             logger.info(
-                f"Analysis completed for document {document_id}. Found {hcc_relevant_count} HCC-relevant conditions."
+                "Analysis completed for document %s. Found %d HCC-relevant conditions.",
+                document_id,
+                hcc_relevant_count,
             )
 
             # Update document status and analysis information in database
-            db_updater.update_document_analysis_status(
+            await self._update_status(
                 document_id=document_id,
                 total_conditions=len(analysis_result.conditions),
                 hcc_relevant_conditions=hcc_relevant_count,
@@ -299,15 +320,45 @@ class MessageConsumer:
             )
 
         except Exception as e:
-            logger.exception(f"Error processing extraction result {document_id}: {str(e)}")
+            logger.exception("Error processing extraction result %s: %s", document_id, e)
 
             # Update status to FAILED in case of error
-            db_updater.update_document_analysis_status(
+            await self._update_status(
                 document_id=document_id,
                 status=ProcessingStatus.FAILED
             )
             # Could publish an error message back to the queue here
 
+    @staticmethod
+    async def _update_status(**kwargs: Any) -> None:
+        """
+        Update a document's status in a worker thread, off the event loop.
+
+        Args:
+            **kwargs: Arguments for db_updater.update_document_analysis_status
+        """
+        await asyncio.to_thread(db_updater.update_document_analysis_status, **kwargs)
+
+    @staticmethod
+    def _read_extraction_file(path: str) -> Dict[str, Any]:
+        """
+        Read an extraction result file in a single read call.
+
+        Args:
+            path: Path to the extraction result file
+
+        Returns:
+            Extraction result as a dictionary
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # The extractor writes with json.dump, which may emit NaN and
+            # Infinity; only the stdlib parser accepts them
+            return json.loads(data)
+
     def _parse_conditions_from_content(self, content: str) -> List[Dict[str, Any]]:
         """
         Parse conditions from document content if extraction result is not available.
@@ -321,7 +372,11 @@ class MessageConsumer:
         """
         try:
             # Try to parse as JSON first
-            data = json.loads(content)
+            try:
+                data = orjson.loads(content)
+            except orjson.JSONDecodeError:
+                # The stdlib parser also accepts NaN, Infinity and big integers
+                data = json.loads(content)
             if isinstance(data, dict) and "conditions" in data:
                 return data["conditions"]
 
@@ -353,13 +408,13 @@ class MessageConsumer:
                 "document_id": document_id,
                 "analysis_result_path": analysis_result_path,
                 "hcc_relevant_conditions": hcc_relevant_conditions,
-                "timestamp": asyncio.get_event_loop().time()
+                # Wall-clock time, meaningful to consumers in other processes
+                "timestamp": time.time()
             }
 
             # Convert to JSON and create message
-            message_json = json.dumps(message_data)
             message = Message(
-                body=message_json.encode(),
+                body=orjson.dumps(message_data),
                 delivery_mode=DeliveryMode.PERSISTENT,
                 content_type="application/json"
             )
@@ -370,10 +425,14 @@ class MessageConsumer:
                 routing_key="document.analysis.completed"
             )
 
-            logger.info(f"Published analysis.completed for document {document_id}")
+            logger.info("Published analysis.completed for document %s", document_id)
 
         except Exception as e:
-            logger.error(f"Error publishing analysis.completed message: {str(e)}")
+            logger.error("Error publishing analysis.completed message: %s", e)
+
+    def stop(self) -> None:
+        """Stop consuming; start_consuming returns and closes the connection."""
+        self._stop.set()
 
     async def close(self) -> None:
         """
@@ -381,12 +440,17 @@ class MessageConsumer:
 
         This should be called when shutting down the service.
         """
+        self.stop()
+
+        # Write out any status updates still queued for batching
+        await asyncio.to_thread(db_updater.flush)
+
         if self.connection:
             try:
                 await self.connection.close()
                 logger.info("Closed RabbitMQ connection")
             except Exception as e:
-                logger.error(f"Error closing RabbitMQ connection: {str(e)}")
+                logger.error("Error closing RabbitMQ connection: %s", e)
 
         self.connection = None
         self.channel = None
@@ -407,6 +471,8 @@ async def run_consumer():
     input_dir = os.environ.get("INPUT_DIR", "./data")
     output_dir = os.environ.get("OUTPUT_DIR", "./output")
     hcc_codes_path = os.environ.get("HCC_CODES_PATH", "./data/HCC_relevant_codes.csv")
+    prefetch = int(os.environ.get("RABBITMQ_PREFETCH", "50"))
+    concurrency = int(os.environ.get("ANALYZER_CONCURRENCY", "8"))
 
     # Create and start consumer
     consumer = MessageConsumer(
@@ -420,8 +486,19 @@ async def run_consumer():
         input_dir=input_dir,
         output_dir=output_dir,
         hcc_codes_path=hcc_codes_path,
+        prefetch=prefetch,
+        concurrency=concurrency,
     )
 
+    # Shut down cleanly on SIGTERM (e.g. from Docker) and SIGINT
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, consumer.stop)
+        except NotImplementedError:
+            # Signal handlers are not supported on this platform's event loop
+            pass
+
     try:
         await consumer.connect()
         await consumer.start_consuming()
@@ -430,7 +507,7 @@ async def run_consumer():
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received, shutting down")
     except Exception as e:
-        logger.exception(f"Error running consumer: {str(e)}")
+        logger.exception("Error running consumer: %s", e)
     finally:
         await consumer.close()
 
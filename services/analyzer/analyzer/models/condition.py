@@ -8,12 +8,16 @@ and analysis results.
 
 from typing import Dict, List, Optional, Any
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class Condition(BaseModel):
     """Representation of a medical condition with HCC relevance information."""
 
+    # Conditions are validated once on the way in; the graph nodes then update
+    # their HCC fields in place, which must not re-run validation
+    model_config = ConfigDict(validate_assignment=False, extra="ignore")
+
     id: str = Field(..., description="Unique identifier for the condition")
     name: str = Field(..., description="Name of the condition")
     icd_code: Optional[str] = Field(None, description="ICD-10 code for the condition")
@@ -2,14 +2,33 @@
 Local storage manager for handling file operations on the local filesystem.
 """
 
+import functools
 import json
 import os
 from pathlib import Path
-from typing import List, Dict, Any, Union
+from typing import Any, Dict, Iterator, List, Union
+
+import orjson
 
 from analyzer.models.condition import AnalysisResult
 
 
+def ensure_directory(path: Union[str, Path]) -> None:
+    """
+    Create a directory if needed, at most once per path and process.
+
+    Args:
+        path: Directory to create
+    """
+    _make_directory(os.fspath(path))
+
+
+@functools.lru_cache(maxsize=1024)
+def _make_directory(path: str) -> None:
+    """Create a directory; memoized by ensure_directory's normalized path."""
+    os.makedirs(path, exist_ok=True)
+
+
 class LocalStorageManager:
     """Storage manager for local filesystem operations."""
 
@@ -27,8 +46,8 @@ class LocalStorageManager:
         self.output_dir = Path(output_dir)
 
         # Ensure directories exist
-        os.makedirs(self.input_dir, exist_ok=True)
-        os.makedirs(self.output_dir, exist_ok=True)
+        ensure_directory(self.input_dir)
+        ensure_directory(self.output_dir)
 
     def list_input_files(self) -> List[Path]:
         """
@@ -37,11 +56,20 @@ class LocalStorageManager:
         Returns:
             List of paths to input files
         """
+        return list(self.iter_input_files())
+
+    def iter_input_files(self) -> Iterator[Path]:
+        """
+        Iterate over the JSON files in the input directory as they are listed.
+
+        Yields:
+            Paths to input files
+        """
         # Find all JSON files in the input directory with *_extracted.json pattern
-        return [
-            f for f in self.output_dir.glob("*_extracted.json")
-            if f.is_file()
-        ]
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith("_extracted.json") and entry.is_file():
+                    yield self.output_dir / entry.name
 
     def read_json_file(self, path: Path) -> Dict[str, Any]:
         """
@@ -53,8 +81,13 @@ class LocalStorageManager:
         Returns:
             Content of the file as a dictionary
         """
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # The stdlib parser also accepts NaN and Infinity literals
+            return json.loads(data)
 
     def save_result(self, result: AnalysisResult, filename: str) -> Path:
         """
@@ -69,10 +102,10 @@ class LocalStorageManager:
         """
         output_path = self.output_dir / filename
 
-        # Convert model to dict
-        result_dict = result.model_dump()
+        # Convert model to JSON-compatible dict
+        result_dict = result.model_dump(mode="json")
 
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(result_dict, f, indent=2)
+        with open(output_path, "wb") as f:
+            f.write(orjson.dumps(result_dict, option=orjson.OPT_INDENT_2))
 
         return output_path
@@ -11,12 +11,17 @@ import asyncio
 import logging
 import os
 import sys
-from typing import List
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from pydantic import TypeAdapter
 
 from analyzer.message_consumer import run_consumer
-from analyzer.models.condition import ProcessingStatus
+from analyzer.models.condition import Condition, ProcessingStatus
 from analyzer.storage.local import LocalStorageManager
-from analyzer.graph.pipeline import AnalysisPipeline
+from analyzer.graph.pipeline import get_pipeline
 
 # Configure logging
 logging.basicConfig(
@@ -26,6 +31,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Validates a file's conditions in one call instead of one model per condition
+_CONDITION_LIST_ADAPTER = TypeAdapter(List[Condition])
+
 
 class AnalysisService:
     """Service for analyzing medical conditions and determining HCC relevance."""
@@ -34,7 +42,8 @@ class AnalysisService:
             self,
             input_dir: str,
             output_dir: str,
-            hcc_codes_path: str
+            hcc_codes_path: str,
+            concurrency: Optional[int] = None,
     ) -> None:
         """
         Initialize the analysis service.
@@ -43,104 +52,117 @@ class AnalysisService:
             input_dir: Directory containing input extraction results
             output_dir: Directory where analysis results will be saved
             hcc_codes_path: Path to the CSV file containing HCC codes
+            concurrency: Maximum number of files analyzed at once (defaults
+                to ANALYZER_CONCURRENCY)
         """
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.hcc_codes_path = hcc_codes_path
+        if concurrency is None:
+            concurrency = int(os.environ.get("ANALYZER_CONCURRENCY", "8"))
+        self.concurrency = concurrency
+        # The storage manager creates the input and output directories
         self.storage = LocalStorageManager(self.input_dir, self.output_dir)
-        self.pipeline = AnalysisPipeline(hcc_codes_path=self.hcc_codes_path)
+        self.pipeline = get_pipeline(self.hcc_codes_path)
 
-        # Ensure output directory exists
-        os.makedirs(self.output_dir, exist_ok=True)
-
-        logger.info(
-            f"Initialized analysis service with HCC codes from {hcc_codes_path}"
-        )
+        logger.info("Initialized analysis service with HCC codes from %s", hcc_codes_path)
 
     def process_extractions(self) -> List[ProcessingStatus]:
         """
         Process all extraction results in the input directory.
 
+        Files are independent, so up to ``concurrency`` of them are analyzed
+        at once; their LLM calls overlap instead of running back to back.
+
         Returns:
             List of processing status objects for each extraction result
         """
-        extraction_files = self.storage.list_input_files()
-        logger.info(f"Found {len(extraction_files)} extraction results to process")
-
-        results = []
-        for file_path in extraction_files:
-            try:
-                # Read extraction result from file
-                extraction_data = self.storage.read_json_file(file_path)
-
-                # Extract document ID and conditions
-                document_id = extraction_data.get("document_id", file_path.stem)
-                conditions_data = extraction_data.get("conditions", [])
-
-                if not conditions_data:
-                    logger.warning(f"No conditions found in {file_path.name}")
-                    results.append(
-                        ProcessingStatus(
-                            document_id=document_id,
-                            status="warning",
-                            message="No conditions found to analyze",
-                            output_file=None,
-                        )
-                    )
-                    continue
-
-                # Convert to condition objects
-                from analyzer.models.condition import Condition
-                conditions = [
-                    Condition(**cond_data) for cond_data in conditions_data
-                ]
-
-                # Process conditions to determine HCC relevance
-                logger.info(f"Analyzing {len(conditions)} conditions from {file_path.name}")
-                analysis_result = self.pipeline.process(document_id, conditions)
-
-                # Log summary of analysis
-                hcc_relevant = sum(1 for c in analysis_result.conditions if c.hcc_relevant)
-                logger.info(
-                    f"Found {hcc_relevant} HCC-relevant conditions out of {len(analysis_result.conditions)} total"
-                )
-
-                # Save results
-                file_path_tmp = file_path.stem
-                file_path_tmp = file_path_tmp.replace("extracted", "analyzed")
-                # output_filename = f"{file_path_tmp}_analyzed.json"
-                output_filename = file_path_tmp + ".json"
-                self.storage.save_result(analysis_result, output_filename)
-
-                results.append(
-                    ProcessingStatus(
-                        document_id=document_id,
-                        status="success",
-                        message=f"Analysis completed. Found {hcc_relevant} HCC-relevant conditions.",
-                        output_file=output_filename,
-                    )
-                )
-                logger.info(f"Successfully analyzed {file_path.name}")
-
-            except Exception as e:
-                logger.exception(f"Error analyzing {file_path.name}: {str(e)}")
-                results.append(
-                    ProcessingStatus(
-                        document_id=file_path.name,
-                        status="error",
-                        message=f"Error: {str(e)}",
-                        output_file=None,
-                    )
-                )
+        # Load the HCC reference data once up front, not in every worker that
+        # reaches it first; if it fails, each file reports the error
+        try:
+            self.pipeline.warm_up()
+        except RuntimeError as e:
+            logger.error("Could not load HCC reference data: %s", e)
+
+        # Files are submitted as the directory is listed, so analysis starts
+        # before the whole listing is read
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(self._process_file, self.storage.iter_input_files()))
 
         # Log summary
-        logger.info(f"Processed {len(results)} extraction results")
-        logger.info(f"Successful: {sum(1 for r in results if r.status == 'success')}")
-        logger.info(f"Warnings: {sum(1 for r in results if r.status == 'warning')}")
-        logger.info(f"Failed: {sum(1 for r in results if r.status == 'error')}")
+        status_counts = Counter(r.status for r in results)
+        logger.info("Processed %d extraction results", len(results))
+        logger.info("Successful: %d", status_counts["success"])
+        logger.info("Warnings: %d", status_counts["warning"])
+        logger.info("Failed: %d", status_counts["error"])
 
         return results
 
+    def _process_file(self, file_path: Path) -> ProcessingStatus:
+        """
+        Analyze one extraction result and save the analysis.
+
+        Args:
+            file_path: Path to the extraction result
+
+        Returns:
+            Processing status for the extraction result
+        """
+        name = file_path.name
+        stem = file_path.stem
+        try:
+            # Read extraction result from file
+            extraction_data = self.storage.read_json_file(file_path)
+
+            # Extract document ID and conditions
+            document_id = extraction_data.get("document_id", stem)
+            conditions_data = extraction_data.get("conditions", [])
+
+            if not conditions_data:
+                logger.warning("No conditions found in %s", name)
+                return ProcessingStatus(
+                    document_id=document_id,
+                    status="warning",
+                    message="No conditions found to analyze",
+                    output_file=None,
+                )
+
+            # Convert to condition objects
+            conditions = _CONDITION_LIST_ADAPTER.validate_python(conditions_data)
+
+            # Process conditions to determine HCC relevance
+            logger.info("Analyzing %d conditions from %s", len(conditions), name)
+            analysis_result = self.pipeline.process(document_id, conditions)
+
+            # Log summary of analysis
+            hcc_relevant = sum([c.hcc_relevant for c in analysis_result.conditions])
+            logger.info(
+                "Found %d HCC-relevant conditions out of %d total",
+                hcc_relevant,
+                len(analysis_result.conditions),
+            )
+
+            # Save results
+            output_filename = f"{stem.replace('extracted', 'analyzed')}.json"
+            self.storage.save_result(analysis_result, output_filename)
+
+            logger.info("Successfully analyzed %s", name)
+            return ProcessingStatus(
+                document_id=document_id,
+                status="success",
+                message=f"Analysis completed. Found {hcc_relevant} HCC-relevant conditions.",
+                output_file=output_filename,
+            )
+
+        except Exception as e:
+            logger.exception("Error analyzing %s: %s", name, e)
+            return ProcessingStatus(
+                document_id=name,
+                status="error",
+                message=f"Error: {str(e)}",
+                output_file=None,
+            )
+
 
 async def run_service(mode: str) -> None:
     """
@@ -157,8 +179,11 @@ async def run_service(mode: str) -> None:
             hcc_codes_path = os.environ.get("HCC_CODES_PATH", "./data/HCC_relevant_codes.csv")
 
             logger.info(
-                f"Starting analysis service in batch mode with input_dir={input_dir}, "
-                f"output_dir={output_dir}, hcc_codes_path={hcc_codes_path}"
+                "Starting analysis service in batch mode with input_dir=%s, "
+                "output_dir=%s, hcc_codes_path=%s",
+                input_dir,
+                output_dir,
+                hcc_codes_path,
             )
 
             service = AnalysisService(input_dir, output_dir, hcc_codes_path)
@@ -175,8 +200,11 @@ async def run_service(mode: str) -> None:
             hcc_codes_path = os.environ.get("HCC_CODES_PATH", "./data/HCC_relevant_codes.csv")
 
             logger.info(
-                f"Starting analysis service in both modes with input_dir={input_dir}, "
-                f"output_dir={output_dir}, hcc_codes_path={hcc_codes_path}"
+                "Starting analysis service in both modes with input_dir=%s, "
+                "output_dir=%s, hcc_codes_path=%s",
+                input_dir,
+                output_dir,
+                hcc_codes_path,
             )
 
             service = AnalysisService(input_dir, output_dir, hcc_codes_path)
@@ -185,9 +213,9 @@ async def run_service(mode: str) -> None:
             # Then start the consumer
             await run_consumer()
         else:
-            logger.error(f"Unknown mode: {mode}")
+            logger.error("Unknown mode: %s", mode)
     except Exception as e:
-        logger.exception(f"Error running service: {str(e)}")
+        logger.exception("Error running service: %s", e)
 
 
 def main() -> None:
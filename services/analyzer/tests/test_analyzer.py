@@ -5,20 +5,39 @@ This module contains tests for the analyzer components, including the GraphState
 LLM client, and analysis pipeline.
 """
 
+import asyncio
+import json
 import os
+import tempfile
+import threading
+import time
 import unittest
 import uuid
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from google.api_core import exceptions as google_exceptions
 
 from analyzer.graph.nodes import (
+    _get_llm_client,
+    _reset_llm_clients,
+    build_hcc_index,
+    build_hcc_prompt_sample,
     determine_hcc_relevance,
     enrichment_with_llm,
-    finalize_analysis
+    finalize_analysis,
+    shard_conditions,
+    LLM_SHARD_SIZE,
 )
-from analyzer.graph.pipeline import AnalysisPipeline
+from analyzer.graph.pipeline import AnalysisPipeline, _compiled_graph, get_pipeline
 from analyzer.graph.state import GraphState
-from analyzer.llm.client import GeminiClient
+from analyzer.llm.batcher import RequestBatcher
+from analyzer.llm.cache import VertexCacheManager, condition_cache, response_cache
+from analyzer.llm.client import GeminiClient, _preamble_cache
+from analyzer.llm.decorators import TokenBucket, aretry, cache, rate_limit, retry, timeout
+from analyzer.message_consumer import MessageConsumer
 from analyzer.models.condition import Condition, AnalysisResult
+from analyzer.storage.local import LocalStorageManager, _make_directory
+from main import AnalysisService
 
 
 class TestGraphState(unittest.TestCase):
@@ -61,7 +80,7 @@ class TestGeminiClient(unittest.TestCase):
         # Mock the Vertex AI initialization and GenerativeModel
         self.mock_generative_model = MagicMock()
         self.mock_response = MagicMock()
-        self.mock_response.text = """```json
+        self.mock_response.text = """
         {
             "conditions": [
                 {
@@ -86,7 +105,7 @@ class TestGeminiClient(unittest.TestCase):
                 }
             ]
         }
-        ```"""
+        """
         self.mock_generative_model.generate_content.return_value = self.mock_response
 
         # Apply patches
@@ -97,6 +116,10 @@ class TestGeminiClient(unittest.TestCase):
         for p in self.patches:
             p.start()
 
+        # Start each test with empty response caches
+        response_cache.clear()
+        condition_cache.clear()
+
         # Create the client
         self.client = GeminiClient(project_id="test-project", location="test-location")
 
@@ -140,6 +163,18 @@ class TestGeminiClient(unittest.TestCase):
         self.assertEqual(self.client.location, "test-location")
         self.assertEqual(self.client.model_name, "gemini-2.0-flash")
         self.assertIsNotNone(self.client.model)
+        self.assertFalse(hasattr(self.client, "__dict__"))
+
+    def test_vertex_initialized_on_first_use(self):
+        """Test that Vertex AI and the model are only set up when first needed."""
+        with patch('analyzer.llm.client.aiplatform.init') as mock_init:
+            client = GeminiClient(project_id="test-project")
+            mock_init.assert_not_called()
+
+            client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes)
+            client.analyze_hcc_relevance(self.test_conditions[:1], self.test_hcc_codes)
+
+        mock_init.assert_called_once_with(project="test-project", location="us-central1")
 
     def test_analyze_hcc_relevance(self):
         """Test the HCC relevance analysis functionality."""
@@ -165,6 +200,24 @@ class TestGeminiClient(unittest.TestCase):
         self.assertTrue(results[1]["hcc_relevant"])
         self.assertEqual(results[1]["hcc_code"], "HCC85")
 
+    @patch('analyzer.llm.client.context_cache')
+    def test_analyze_hcc_relevance_with_context_cache(self, mock_context_cache):
+        """Test that only the conditions are sent when the preamble is cached."""
+        cached_model = MagicMock()
+        cached_model.generate_content.return_value = self.mock_response
+        mock_context_cache.get_model.return_value = cached_model
+        client = GeminiClient(project_id="test-project", use_context_cache=True)
+
+        results = client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes)
+
+        self.assertEqual(len(results), 2)
+        preamble = mock_context_cache.get_model.call_args[0][1]
+        self.assertIn("You are a medical coding expert", preamble)
+        prompt = cached_model.generate_content.call_args[0][0]
+        self.assertIn("Type 2 diabetes mellitus", prompt)
+        self.assertNotIn("You are a medical coding expert", prompt)
+        self.mock_generative_model.generate_content.assert_not_called()
+
     def test_handle_malformed_response(self):
         """Test handling of malformed responses from the LLM."""
         # Set up a malformed response
@@ -177,6 +230,157 @@ class TestGeminiClient(unittest.TestCase):
         # Verify empty results are returned instead of raising an exception
         self.assertEqual(results, [])
 
+    @patch("analyzer.llm.decorators.time.sleep")
+    def test_transient_errors_are_retried(self, mock_sleep):
+        """Test that a model call failing with a transient error is retried after a backoff."""
+        self.mock_generative_model.generate_content.side_effect = [
+            google_exceptions.ServiceUnavailable("unavailable"),
+            TimeoutError("timed out"),
+            self.mock_response,
+        ]
+
+        results = self.client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.mock_generative_model.generate_content.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    def test_analyze_hcc_relevance_uses_response_cache(self):
+        """Test that identical requests are answered from the response cache."""
+        first = self.client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes)
+        second = self.client.analyze_hcc_relevance(
+            list(reversed(self.test_conditions)), self.test_hcc_codes
+        )
+
+        self.mock_generative_model.generate_content.assert_called_once()
+        self.assertEqual(first, second)
+
+        # Different HCC codes are a different request
+        self.client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes[:1])
+        self.assertEqual(self.mock_generative_model.generate_content.call_count, 2)
+
+    def test_repeated_conditions_are_not_sent_again(self):
+        """Test that a condition seen in another document is answered from the condition cache."""
+        self.client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes)
+
+        new_condition = {**self.test_conditions[1], "id": "cond-3", "name": "Hypertension"}
+        self.mock_response.text = '{"conditions": [{"id": "cond-3", "hcc_relevant": false}]}'
+        results = self.client.analyze_hcc_relevance(
+            [{**self.test_conditions[0], "id": "doc2-cond-1"}, new_condition], self.test_hcc_codes
+        )
+
+        # Only the new condition was sent, and the repeated one keeps its own ID
+        self.assertEqual(self.mock_generative_model.generate_content.call_count, 2)
+        prompt = self.mock_generative_model.generate_content.call_args[0][0]
+        self.assertIn('"id":"cond-3"', prompt)
+        self.assertNotIn("doc2-cond-1", prompt)
+        self.assertEqual([r["id"] for r in results], ["doc2-cond-1", "cond-3"])
+        self.assertEqual(results[0]["hcc_code"], "HCC19")
+
+    def test_analyze_hcc_relevance_batch(self):
+        """Test that a batch of documents is analyzed in one call and split by doc_id."""
+        self.mock_response.text = (
+            '{"documents": ['
+            '{"doc_id": "doc-2", "conditions": [{"id": "cond-2", "hcc_relevant": true}]},'
+            '{"doc_id": "doc-1", "conditions": [{"id": "cond-1", "hcc_relevant": true}]}'
+            ']}'
+        )
+
+        results = self.client.analyze_hcc_relevance_batch(
+            [("doc-1", self.test_conditions[:1]), ("doc-2", self.test_conditions[1:])],
+            self.test_hcc_codes,
+        )
+
+        self.mock_generative_model.generate_content.assert_called_once()
+        prompt = self.mock_generative_model.generate_content.call_args[0][0]
+        self.assertIn('"doc_id":"doc-1"', prompt)
+        self.assertEqual(results["doc-1"], [{"id": "cond-1", "hcc_relevant": True}])
+        self.assertEqual(results["doc-2"], [{"id": "cond-2", "hcc_relevant": True}])
+
+    def test_truncated_batch_response_retried_singly(self):
+        """Test that documents missing from a truncated batch response are sent again alone."""
+        self.mock_generative_model.generate_content.side_effect = [
+            MagicMock(text='{"documents": [{"doc_id": "doc-1", "conditions": [{"id": "cond-1"}]}, {"doc_'),
+            MagicMock(text='{"conditions": [{"id": "cond-1", "hcc_relevant": true}]}'),
+            MagicMock(text='{"conditions": [{"id": "cond-2", "hcc_relevant": true}]}'),
+        ]
+
+        with self.assertLogs(level="WARNING"):
+            results = self.client.analyze_hcc_relevance_batch(
+                [("doc-1", self.test_conditions[:1]), ("doc-2", self.test_conditions[1:])],
+                self.test_hcc_codes,
+            )
+
+        self.assertEqual(self.mock_generative_model.generate_content.call_count, 3)
+        self.assertEqual(results["doc-1"], [{"id": "cond-1", "hcc_relevant": True}])
+        self.assertEqual(results["doc-2"], [{"id": "cond-2", "hcc_relevant": True}])
+
+    def test_responses_constrained_to_schema(self):
+        """Test that requests ask for schema-constrained JSON responses."""
+        with patch('analyzer.llm.client.GenerationConfig') as mock_config:
+            self.client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes)
+
+        config_kwargs = mock_config.call_args[1]
+        self.assertEqual(config_kwargs["response_mime_type"], "application/json")
+        self.assertIn("conditions", config_kwargs["response_schema"]["properties"])
+
+    def test_async_calls_capped_by_concurrency_limit(self):
+        """Test that concurrent async calls wait for a free Vertex AI slot."""
+        in_flight = []
+        peak = []
+
+        async def generate_content_async(*args, **kwargs):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return self.mock_response
+
+        self.mock_generative_model.generate_content_async = generate_content_async
+
+        async def run():
+            return await asyncio.gather(*(
+                self.client.aanalyze_hcc_relevance([{"id": f"cond-{i}"}], self.test_hcc_codes)
+                for i in range(5)
+            ))
+
+        with patch('analyzer.llm.client.VERTEX_CONCURRENCY', 2):
+            results = asyncio.run(run())
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(max(peak), 2)
+
+    def test_analyze_hcc_relevance_streamed(self):
+        """Test that streamed responses are parsed across chunk boundaries."""
+        text = (
+            '{"conditions": [{"id": "cond-1", "reasoning": "a {brace} and \\"quote\\""},'
+            ' {"id": "cond-2", "confidence": null}]}'
+        )
+        chunks = [MagicMock(text=text[i:i + 7]) for i in range(0, len(text), 7)]
+        self.mock_generative_model.generate_content.return_value = iter(chunks)
+        client = GeminiClient(project_id="test-project", stream_responses=True)
+
+        results = client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes)
+
+        self.assertTrue(self.mock_generative_model.generate_content.call_args[1]["stream"])
+        self.assertEqual(results, [
+            {"id": "cond-1", "reasoning": 'a {brace} and "quote"'},
+            {"id": "cond-2", "confidence": None},
+        ])
+
+    def test_stream_parse_failure_falls_back_to_full_text(self):
+        """Test that a parser error mid-stream doesn't drop the remaining conditions."""
+        text = '{"conditions": [{"id": "cond-1"}, {"id": "cond-2"}]}'
+        chunks = [MagicMock(text=text[:20]), MagicMock(text=text[20:])]
+        self.mock_generative_model.generate_content.return_value = iter(chunks)
+        client = GeminiClient(project_id="test-project", stream_responses=True)
+
+        with patch('analyzer.llm.client.ResultStreamParser.feed',
+                   side_effect=[[{"id": "cond-1"}], ValueError("malformed")]):
+            results = client.analyze_hcc_relevance(self.test_conditions, self.test_hcc_codes)
+
+        self.assertEqual(results, [{"id": "cond-1"}, {"id": "cond-2"}])
+
     def test_prompt_creation(self):
         """Test the prompt creation logic."""
         prompt = self.client._create_hcc_analysis_prompt(self.test_conditions, self.test_hcc_codes)
@@ -188,12 +392,435 @@ class TestGeminiClient(unittest.TestCase):
         self.assertIn("Essential hypertension", prompt)
         self.assertIn("JSON", prompt)
 
+        # The HCC reference sample is a compact CSV table
+        self.assertIn("ICD-10-CM Codes,Description,Tags\n", prompt)
+        self.assertIn("I10,Essential (primary) hypertension,HCC85\n", prompt)
+
+    def test_preamble_built_once_for_client_hcc_codes(self):
+        """Test that a client created with HCC codes reuses its prompt preamble."""
+        with patch.object(
+                GeminiClient, "_create_hcc_analysis_preamble", return_value="PREAMBLE"
+        ) as mock_preamble:
+            client = GeminiClient(project_id="test-project", hcc_codes=self.test_hcc_codes)
+            client.analyze_hcc_relevance(self.test_conditions)
+            client.analyze_hcc_relevance(self.test_conditions, list(self.test_hcc_codes))
+
+        mock_preamble.assert_called_once_with(self.test_hcc_codes)
+        prompt = self.mock_generative_model.generate_content.call_args[0][0]
+        self.assertTrue(prompt.startswith("PREAMBLE"))
+
+    def test_preamble_shared_across_clients(self):
+        """Test that clients created per call reuse the preamble for equal HCC codes."""
+        _preamble_cache.clear()
+        self.addCleanup(_preamble_cache.clear)
+        with patch.object(
+                GeminiClient, "_create_hcc_analysis_preamble", return_value="PREAMBLE"
+        ) as mock_preamble:
+            for condition in self.test_conditions:
+                GeminiClient(project_id="test-project").analyze_hcc_relevance(
+                    [condition], list(self.test_hcc_codes)
+                )
+
+        self.assertEqual(self.mock_generative_model.generate_content.call_count, 2)
+        mock_preamble.assert_called_once_with(self.test_hcc_codes)
+
+
+class TestVertexCacheManager(unittest.TestCase):
+    """Unit tests for the VertexCacheManager class."""
+
+    def setUp(self):
+        """Patch the Vertex AI caching API."""
+        caching_patcher = patch("analyzer.llm.cache.caching")
+        self.mock_caching = caching_patcher.start()
+        self.addCleanup(caching_patcher.stop)
+
+        model_patcher = patch("analyzer.llm.cache.GenerativeModel")
+        self.mock_model_class = model_patcher.start()
+        self.addCleanup(model_patcher.stop)
+
+        self.manager = VertexCacheManager(backoff_seconds=30)
+        self.manager._cleanup_registered = True
+
+    def test_concurrent_callers_share_one_creation(self):
+        """Test that a cache is created once, outside the lock, for concurrent callers."""
+        release = threading.Event()
+
+        def create(**kwargs):
+            # Other preambles must not wait for this creation
+            self.assertTrue(self.manager._lock.acquire(blocking=False))
+            self.manager._lock.release()
+            release.wait(1)
+            return MagicMock()
+
+        self.mock_caching.CachedContent.create.side_effect = create
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.manager.get_model("gemini", "preamble")))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.mock_caching.CachedContent.create.assert_called_once()
+        self.assertEqual(results, [self.mock_model_class.from_cached_content.return_value] * 4)
+
+    @patch("analyzer.llm.cache.time.monotonic")
+    def test_transient_failure_backs_off_then_retries(self, mock_monotonic):
+        """Test that a failed creation is retried after a backoff instead of disabling caching."""
+        self.mock_caching.CachedContent.create.side_effect = [
+            google_exceptions.ServiceUnavailable("unavailable"),
+            MagicMock(),
+        ]
+
+        mock_monotonic.return_value = 100.0
+        with self.assertLogs("analyzer.llm.cache", level="WARNING"):
+            self.assertIsNone(self.manager.get_model("gemini", "preamble"))
+        mock_monotonic.return_value = 129.0
+        self.assertIsNone(self.manager.get_model("gemini", "preamble"))
+        self.assertEqual(self.mock_caching.CachedContent.create.call_count, 1)
+
+        mock_monotonic.return_value = 130.0
+        model = self.manager.get_model("gemini", "preamble")
+
+        self.assertIs(model, self.mock_model_class.from_cached_content.return_value)
+        self.assertEqual(self.mock_caching.CachedContent.create.call_count, 2)
+        self.assertFalse(self.manager._uncacheable)
+
+    def test_uncacheable_preamble_is_not_retried(self):
+        """Test that a preamble Vertex refuses to cache is sent in full from then on."""
+        self.mock_caching.CachedContent.create.side_effect = google_exceptions.InvalidArgument(
+            "The minimum token count to start caching is 32768."
+        )
+
+        with self.assertLogs("analyzer.llm.cache", level="WARNING"):
+            self.assertIsNone(self.manager.get_model("gemini", "preamble"))
+        self.assertIsNone(self.manager.get_model("gemini", "preamble"))
+
+        self.mock_caching.CachedContent.create.assert_called_once()
+
+
+class TestRequestBatcher(unittest.TestCase):
+    """Unit tests for the RequestBatcher class."""
+
+    def test_concurrent_requests_share_one_call(self):
+        """Test that concurrent requests are coalesced into one batched call."""
+        client = MagicMock()
+        client.aanalyze_hcc_relevance_batch = AsyncMock(side_effect=lambda documents, hcc_codes: {
+            doc_id: [{"id": conditions[0]["id"]}] for doc_id, conditions in documents
+        })
+        hcc_codes = [{"ICD-10-CM Codes": "E11.9"}]
+        batcher = RequestBatcher(max_batch_size=8, max_wait_seconds=0.01)
+
+        async def run():
+            return await asyncio.gather(*(
+                batcher.analyze(client, [{"id": f"cond-{i}"}], list(hcc_codes)) for i in range(3)
+            ))
+
+        results = asyncio.run(run())
+
+        client.aanalyze_hcc_relevance_batch.assert_awaited_once()
+        self.assertEqual(results, [[{"id": "cond-0"}], [{"id": "cond-1"}], [{"id": "cond-2"}]])
+
+    def test_loop_ending_mid_window_does_not_stall_later_loops(self):
+        """Test that a loop closed while requests were queued leaves no state behind."""
+        async def analyze(conditions, hcc_codes):
+            if conditions[0]["id"] == "cond-0":
+                await asyncio.sleep(10)
+            return conditions
+
+        client = MagicMock()
+        client.aanalyze_hcc_relevance = AsyncMock(side_effect=analyze)
+        batcher = RequestBatcher(max_batch_size=8, max_wait_seconds=10)
+
+        async def abandon():
+            # A call in flight makes the next request wait for the window
+            asyncio.ensure_future(batcher.analyze(client, [{"id": "cond-0"}], []))
+            await asyncio.sleep(0.01)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(batcher.analyze(client, [{"id": "cond-1"}], []), 0.01)
+
+        async def run():
+            return await asyncio.wait_for(batcher.analyze(client, [{"id": "cond-2"}], []), 0.5)
+
+        asyncio.run(abandon())
+
+        self.assertEqual(asyncio.run(run()), [{"id": "cond-2"}])
+
+    def test_lone_request_is_sent_without_waiting(self):
+        """Test that a request with nothing else queued or in flight isn't delayed."""
+        client = MagicMock()
+        client.aanalyze_hcc_relevance = AsyncMock(return_value=[{"id": "cond-1"}])
+        batcher = RequestBatcher(max_batch_size=8, max_wait_seconds=10)
+
+        async def run():
+            return await asyncio.wait_for(batcher.analyze(client, [{"id": "cond-1"}], []), 0.5)
+
+        self.assertEqual(asyncio.run(run()), [{"id": "cond-1"}])
+
+    def test_batches_split_to_fit_output_limit(self):
+        """Test that requests beyond the condition budget go in separate calls."""
+        client = MagicMock()
+        client.aanalyze_hcc_relevance = AsyncMock(side_effect=lambda conditions, hcc_codes: conditions)
+        client.aanalyze_hcc_relevance_batch = AsyncMock(side_effect=lambda documents, hcc_codes: {
+            doc_id: conditions for doc_id, conditions in documents
+        })
+        batcher = RequestBatcher(max_batch_size=8, max_wait_seconds=0.01, max_batch_conditions=4)
+
+        async def run():
+            return await asyncio.gather(*(
+                batcher.analyze(client, [{"id": f"cond-{i}-{j}"} for j in range(2)], []) for i in range(3)
+            ))
+
+        results = asyncio.run(run())
+
+        client.aanalyze_hcc_relevance_batch.assert_awaited_once()
+        client.aanalyze_hcc_relevance.assert_awaited_once()
+        self.assertEqual([r[0]["id"] for r in results], ["cond-0-0", "cond-1-0", "cond-2-0"])
+
+    def test_failed_call_raises_for_every_request(self):
+        """Test that a failed batched call is raised to all waiting requests."""
+        client = MagicMock()
+        client.aanalyze_hcc_relevance_batch = AsyncMock(side_effect=RuntimeError("quota"))
+        batcher = RequestBatcher(max_batch_size=2, max_wait_seconds=1)
+
+        async def run():
+            return await asyncio.gather(
+                batcher.analyze(client, [{"id": "cond-1"}], []),
+                batcher.analyze(client, [{"id": "cond-2"}], []),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(run())
+
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+
+class TestDecorators(unittest.TestCase):
+    """Unit tests for the LLM client decorators."""
+
+    def test_cache_evicts_least_recently_used_entry(self):
+        """Test that the cache holds at most maxsize results."""
+        calls = []
+
+        @cache(maxsize=2)
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        square(1)
+        square(2)
+        square(1)
+        square(3)  # Evicts 2, the least recently used
+        square(1)
+        square(2)
+
+        self.assertEqual(calls, [1, 2, 3, 2])
+
+    def test_cache_expires_entries_after_ttl(self):
+        """Test that cached results are recomputed once their TTL has passed."""
+        calls = []
+
+        @cache(ttl_seconds=60)
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        with patch("analyzer.llm.decorators.time.monotonic", side_effect=[0.0, 59.0, 61.0]):
+            self.assertEqual(compute(), 1)
+            self.assertEqual(compute(), 1)
+            self.assertEqual(compute(), 2)
+
+    def test_cache_keys_on_arguments(self):
+        """Test that positional and keyword arguments are kept apart in cache keys."""
+        calls = []
+
+        @cache()
+        def describe(*args, **kwargs):
+            calls.append((args, kwargs))
+            return len(calls)
+
+        self.assertEqual(describe("a", n=1), describe("a", n=1))
+        self.assertNotEqual(describe("a", n=1), describe("a", ("n", 1)))
+        self.assertEqual(describe(["unhashable"]), describe(["unhashable"]))
+        self.assertEqual(describe({"a": 1, "b": [2]}), describe({"b": [2], "a": 1}))
+        self.assertNotEqual(describe({"a": 1}), describe({"a": 1.0}))
+        describe(object)
+        describe([object])
+        describe([object])
+
+        self.assertEqual(len(calls), 9)
+
+    def test_cache_typed_keeps_equal_values_of_different_types_apart(self):
+        """Test that typed caches key on argument types as well as values."""
+        untyped_calls = []
+        typed_calls = []
+
+        @cache()
+        def untyped(value):
+            untyped_calls.append(value)
+            return value
+
+        @cache(typed=True)
+        def typed(value):
+            typed_calls.append(value)
+            return value
+
+        for value in (1, 1.0, True):
+            untyped(value)
+            typed(value)
+        typed(1)
+
+        self.assertEqual(untyped_calls, [1])
+        self.assertEqual(typed_calls, [1, 1.0, True])
+
+    @patch("analyzer.llm.decorators.time.sleep")
+    def test_retry_backs_off_then_raises(self, mock_sleep):
+        """Test that retry sleeps between attempts and raises the last error."""
+        failing = MagicMock(side_effect=RuntimeError("quota"), __name__="failing")
+
+        with self.assertRaises(RuntimeError):
+            retry(max_attempts=3, base_delay=1.0, backoff_factor=2.0)(failing)()
+
+        self.assertEqual(failing.call_count, 3)
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(0.8 <= delays[0] <= 1.2)
+        self.assertTrue(1.6 <= delays[1] <= 2.4)
+
+    @patch("analyzer.llm.decorators.time.sleep")
+    def test_retry_raises_non_retryable_errors_at_once(self, mock_sleep):
+        """Test that errors retrying can't fix are raised without backing off."""
+        failing = MagicMock(side_effect=ValueError("malformed"), __name__="failing")
+
+        with self.assertRaises(ValueError):
+            retry(max_attempts=3)(failing)()
+
+        failing.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch("analyzer.llm.decorators.time.sleep")
+    def test_retry_retries_explicitly_listed_errors(self, mock_sleep):
+        """Test that errors named in exceptions are retried even if non-retryable by default."""
+        flaky = MagicMock(side_effect=[ValueError("transient"), "ok"], __name__="flaky")
+        failing = MagicMock(side_effect=KeyError("missing"), __name__="failing")
+        decorate = retry(max_attempts=3, exceptions=(ValueError, Exception))
+
+        self.assertEqual(decorate(flaky)(), "ok")
+        with self.assertRaises(KeyError):
+            decorate(failing)()
+
+        self.assertEqual(flaky.call_count, 2)
+        failing.assert_called_once()
+        mock_sleep.assert_called_once()
+
+    @patch("analyzer.llm.decorators.asyncio.sleep", new_callable=AsyncMock)
+    def test_aretry_recovers_without_blocking(self, mock_sleep):
+        """Test that aretry awaits between attempts and returns once a call succeeds."""
+        flaky = AsyncMock(side_effect=[RuntimeError("quota"), "ok"], __name__="flaky")
+
+        result = asyncio.run(aretry(max_attempts=3)(flaky)())
+
+        self.assertEqual(result, "ok")
+        self.assertEqual(flaky.await_count, 2)
+        mock_sleep.assert_awaited_once()
+
+    def test_timeout_bounds_slow_calls(self):
+        """Test that slow calls raise TimeoutError and fast ones return normally."""
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        @timeout(0.05)
+        def call(slow):
+            if slow:
+                release.wait(5)
+            return "ok"
+
+        @timeout(0.05)
+        async def acall():
+            await asyncio.sleep(5)
+
+        self.assertEqual(call(False), "ok")
+        with self.assertRaises(TimeoutError):
+            call(True)
+        with self.assertRaises(TimeoutError):
+            asyncio.run(acall())
+
+    def test_timeout_refuses_calls_while_too_many_hang(self):
+        """Test that hung calls are capped and don't delay later calls' timeouts."""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        finished = threading.Event()
+
+        @timeout(0.05, max_abandoned=2)
+        def call(slow):
+            if slow:
+                release.wait(5)
+                finished.set()
+            return "ok"
+
+        for _ in range(2):
+            with self.assertRaises(TimeoutError):
+                call(True)
+
+        # Refused at once rather than queued behind the hung calls
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            call(False)
+        self.assertLess(time.monotonic() - start, 0.05)
+
+        # Accepted again once the hung calls have returned
+        release.set()
+        self.assertTrue(finished.wait(5))
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                self.assertEqual(call(False), "ok")
+                break
+            except TimeoutError:
+                time.sleep(0.01)
+        else:
+            self.fail("calls still refused after the hung calls returned")
+
+    @patch("analyzer.llm.decorators.time.sleep")
+    @patch("analyzer.llm.decorators.time.monotonic", return_value=100.0)
+    def test_rate_limit_waits_once_burst_is_spent(self, mock_monotonic, mock_sleep):
+        """Test that calls beyond the burst capacity wait for the bucket to refill."""
+        limited = rate_limit(capacity=2, refill_per_sec=4.0)(lambda: "ok")
+
+        results = [limited() for _ in range(4)]
+
+        self.assertEqual(results, ["ok"] * 4)
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [0.25, 0.5])
+
+    @patch("analyzer.llm.decorators.time.monotonic", return_value=100.0)
+    def test_token_bucket_async_acquire(self, mock_monotonic):
+        """Test that the async acquire waits without blocking once the bucket is empty."""
+        bucket = TokenBucket(capacity=1, refill_per_sec=2.0)
+
+        async def run():
+            with patch("analyzer.llm.decorators.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+                await bucket.aacquire()
+                await bucket.aacquire()
+            return mock_sleep
+
+        mock_sleep = asyncio.run(run())
+
+        mock_sleep.assert_awaited_once_with(0.5)
+
 
 class TestGraphNodes(unittest.TestCase):
     """Unit tests for the individual graph nodes."""
 
     def setUp(self):
         """Set up the test environment."""
+        # Each test gets its own (possibly mocked) shared LLM client
+        _reset_llm_clients()
+        self.addCleanup(_reset_llm_clients)
+
         # Create test conditions
         self.test_conditions = [
             Condition(
@@ -267,6 +894,59 @@ class TestGraphNodes(unittest.TestCase):
             analyzed_cond_1 = next(c for c in analyzed_conditions if c.id == "cond-1")
             self.assertTrue(analyzed_cond_1.metadata.get("is_hcc_relevant", False))
 
+    def test_determine_hcc_relevance_matches_without_dots(self):
+        """Test that dot-less ICD codes match and unknown codes do not."""
+        state: GraphState = {
+            **self.initial_state,
+            "conditions": [
+                Condition(id="cond-3", name="Diabetes", icd_code="E119"),
+                Condition(id="cond-4", name="Headache", icd_code="R51.9"),
+            ],
+        }
+
+        result_state = determine_hcc_relevance(state)
+
+        cond_3, cond_4 = result_state["conditions"]
+        self.assertTrue(cond_3.metadata["is_hcc_relevant"])
+        self.assertFalse(cond_4.metadata["is_hcc_relevant"])
+        self.assertEqual(cond_4.metadata["icd_code_no_dot"], "R519")
+
+    def test_determine_hcc_relevance_uses_prebuilt_index(self):
+        """Test that the index carried in the state is used instead of the raw codes."""
+        state: GraphState = {
+            **self.initial_state,
+            "conditions": [Condition(id="cond-3", name="Diabetes", icd_code="E11.9")],
+            "hcc_codes": [],
+            "hcc_code_index": build_hcc_index(self.test_hcc_codes),
+        }
+
+        result_state = determine_hcc_relevance(state)
+
+        self.assertTrue(result_state["conditions"][0].metadata["is_hcc_relevant"])
+
+    def test_determine_hcc_relevance_resolves_exact_matches(self):
+        """Test that reference set hits are resolved without the LLM."""
+        state: GraphState = {
+            **self.initial_state,
+            "conditions": [
+                Condition(id="cond-3", name="Diabetes", icd_code="e11.9"),
+                Condition(id="cond-4", name="Headache", icd_code="R51.9"),
+            ],
+        }
+
+        result_state = determine_hcc_relevance(state)
+
+        cond_3, cond_4 = result_state["conditions"]
+        self.assertTrue(cond_3.hcc_relevant)
+        self.assertEqual(cond_3.hcc_code, "HCC19")
+        self.assertEqual(cond_3.confidence, 1.0)
+        self.assertFalse(cond_4.hcc_relevant)
+        self.assertEqual(cond_4.confidence, 0.0)
+
+        # Only the unresolved condition is sent to the LLM
+        sends = shard_conditions(result_state)
+        self.assertEqual(sends[0].arg["conditions"], [cond_4])
+
     @patch('analyzer.graph.nodes.GeminiClient')
     def test_enrichment_with_llm(self, mock_client_class):
         """Test the enrichment_with_llm node."""
@@ -321,6 +1001,86 @@ class TestGraphNodes(unittest.TestCase):
         if result_state["analyzed_conditions"]:
             self.assertEqual(len(result_state["analyzed_conditions"]), 2)
 
+    @patch('analyzer.graph.nodes.GeminiClient')
+    def test_enrichment_with_llm_sends_only_uncertain_conditions(self, mock_client_class):
+        """Test that conditions that are already confident are not sent to the LLM."""
+        mock_client = mock_client_class.return_value
+        mock_client.analyze_hcc_relevance.return_value = [
+            {"id": "cond-2", "hcc_relevant": True, "hcc_code": "HCC85", "confidence": 0.95}
+        ]
+        self.test_conditions[1].confidence = 0.5
+
+        result_state = enrichment_with_llm(self.initial_state)
+
+        conditions_sent = mock_client.analyze_hcc_relevance.call_args[0][0]
+        self.assertEqual([c["id"] for c in conditions_sent], ["cond-2"])
+
+        cond_2 = next(c for c in result_state["conditions"] if c.id == "cond-2")
+        self.assertEqual(cond_2.hcc_code, "HCC85")
+        self.assertEqual(cond_2.confidence, 0.95)
+        self.assertEqual(cond_2.metadata["analysis_source"], "llm")
+
+    @patch('analyzer.graph.nodes.GeminiClient')
+    def test_enrichment_with_llm_reuses_client(self, mock_client_class):
+        """Test that the LLM client is created once and only when needed."""
+        enrichment_with_llm(self.initial_state)
+        mock_client_class.assert_not_called()
+
+        self.test_conditions[1].confidence = 0.5
+        mock_client_class.return_value.analyze_hcc_relevance.return_value = []
+        enrichment_with_llm(self.initial_state)
+        enrichment_with_llm(self.initial_state)
+
+        # The client builds its prompt preamble from the state's HCC codes once
+        mock_client_class.assert_called_once_with(hcc_codes=self.test_hcc_codes)
+        self.assertEqual(mock_client_class.return_value.analyze_hcc_relevance.call_count, 2)
+
+    @patch('analyzer.graph.nodes.GeminiClient')
+    def test_llm_client_shared_per_event_loop(self, mock_client_class):
+        """Test that each event loop gets its own client, reused within the loop."""
+        mock_client_class.side_effect = lambda **kwargs: MagicMock()
+
+        async def get_twice():
+            return _get_llm_client(), _get_llm_client()
+
+        first, first_again = asyncio.run(get_twice())
+        second, _ = asyncio.run(get_twice())
+
+        self.assertIs(first, first_again)
+        self.assertIsNot(first, second)
+        self.assertIs(_get_llm_client(), _get_llm_client())
+
+    def test_build_hcc_prompt_sample_spans_categories(self):
+        """Test that the prompt sample takes codes from each category in turn."""
+        hcc_codes = [
+            {"ICD-10-CM Codes": code, "Tags": tags}
+            for code, tags in [("A1", "HCC1"), ("A2", "HCC1"), ("A3", "HCC1"), ("B1", "HCC2"), ("C1", "HCC3")]
+        ]
+
+        sample = build_hcc_prompt_sample(hcc_codes, size=4)
+
+        self.assertEqual([code["ICD-10-CM Codes"] for code in sample], ["A1", "B1", "C1", "A2"])
+        self.assertIs(build_hcc_prompt_sample(hcc_codes, size=5), hcc_codes)
+
+    def test_shard_conditions(self):
+        """Test that uncertain conditions are fanned out to enrichment in shards."""
+        # All conditions are confident, so enrichment is skipped
+        self.assertEqual(shard_conditions(self.initial_state), "finalize_analysis")
+
+        uncertain_conditions = [
+            Condition(id=f"cond-u{i}", name="Unclear finding", icd_code="R69", confidence=0.5)
+            for i in range(LLM_SHARD_SIZE + 5)
+        ]
+        state = {**self.initial_state, "conditions": self.test_conditions + uncertain_conditions}
+
+        sends = shard_conditions(state)
+
+        self.assertEqual([send.node for send in sends], ["enrichment_with_llm"] * 2)
+        self.assertEqual(sends[0].arg["conditions"], uncertain_conditions[:LLM_SHARD_SIZE])
+        self.assertEqual(sends[1].arg["conditions"], uncertain_conditions[LLM_SHARD_SIZE:])
+        self.assertIs(sends[0].arg["hcc_codes"], self.test_hcc_codes)
+        self.assertEqual([send.arg["shard_count"] for send in sends], [2, 2])
+
     def test_finalize_analysis(self):
         """Test the finalize_analysis node."""
         # First run determine_hcc_relevance to set is_hcc_relevant
@@ -376,6 +1136,28 @@ class TestGraphNodes(unittest.TestCase):
         # Fix: Compare with the original confidence value that was set in setUp
         self.assertEqual(analyzed_cond_2.confidence, 0.9)
 
+    def test_finalize_analysis_replaces_nan(self):
+        """Test that NaN values in condition metadata are replaced with None."""
+        self.test_conditions[0].metadata["score"] = float("nan")
+
+        result_state = finalize_analysis(self.initial_state)
+
+        analyzed_cond_1 = next(c for c in result_state["analyzed_conditions"] if c.id == "cond-1")
+        self.assertIsNone(analyzed_cond_1.metadata["score"])
+        self.assertEqual(analyzed_cond_1.metadata["status"], "Stable")
+        self.assertEqual(result_state["errors"], [])
+
+    def test_finalize_analysis_reports_invalid_nan(self):
+        """Test that a NaN in a required field is reported instead of being replaced with None."""
+        self.test_conditions[1].confidence = float("nan")
+
+        result_state = finalize_analysis(self.initial_state)
+
+        analyzed_cond_2 = next(c for c in result_state["analyzed_conditions"] if c.id == "cond-2")
+        self.assertIsInstance(analyzed_cond_2.confidence, float)
+        self.assertEqual(len(result_state["errors"]), 1)
+        self.assertIn("Error fixing NaN values in condition cond-2", result_state["errors"][0])
+
 
 class TestAnalysisPipeline(unittest.TestCase):
     """Unit tests for the AnalysisPipeline class."""
@@ -425,13 +1207,16 @@ class TestAnalysisPipeline(unittest.TestCase):
         self.mock_aiplatform = self.patches[1].start()
         self.mock_generative_model = self.patches[2].start()
 
+        # Build the graph from the StateGraph mock rather than the shared cache
+        _compiled_graph.cache_clear()
+
         # Configure StateGraph mock
         self.mock_graph = MagicMock()
         self.mock_state_graph.return_value = self.mock_graph
         self.mock_graph.compile.return_value = self.mock_graph
 
         # Configure the graph's invoke method to simulate actual processing
-        def simulate_processing(state):
+        def simulate_processing(state, config=None):
             # Simulated pipeline that updates conditions and returns a final state
             conditions = state["conditions"]
             for condition in conditions:
@@ -472,6 +1257,9 @@ class TestAnalysisPipeline(unittest.TestCase):
         for patch in self.patches:
             patch.stop()
 
+        # Don't leak the mock graph into other tests
+        _compiled_graph.cache_clear()
+
         # Remove temporary CSV file
         if os.path.exists(self.test_csv_path):
             os.remove(self.test_csv_path)
@@ -481,6 +1269,11 @@ class TestAnalysisPipeline(unittest.TestCase):
         # Create pipeline
         pipeline = AnalysisPipeline(hcc_codes_path=self.test_csv_path)
 
+        # Nothing is loaded or built until first use
+        self.mock_graph.compile.assert_not_called()
+        self.assertNotIn("hcc_codes", vars(pipeline))
+        pipeline.graph
+
         # Verify the graph was built
         self.mock_state_graph.assert_called()
         self.mock_graph.add_node.assert_called()
@@ -491,6 +1284,66 @@ class TestAnalysisPipeline(unittest.TestCase):
         # Verify HCC codes were loaded
         self.assertGreater(len(pipeline.hcc_codes), 0)
 
+    def test_graph_compiled_once(self):
+        """Test that pipelines share a single compiled graph."""
+        first = AnalysisPipeline(hcc_codes_path=self.test_csv_path)
+        second = AnalysisPipeline(hcc_codes_path=self.test_csv_path)
+
+        self.assertIs(first.graph, second.graph)
+        self.mock_graph.compile.assert_called_once()
+
+    def test_pipeline_shared_per_hcc_codes_file(self):
+        """Test that batch mode and the consumer get the same warmed-up pipeline."""
+        get_pipeline.cache_clear()
+        self.addCleanup(get_pipeline.cache_clear)
+
+        pipeline = get_pipeline(self.test_csv_path)
+        pipeline.warm_up()
+
+        self.assertIs(get_pipeline(self.test_csv_path), pipeline)
+        self.assertIn("hcc_codes", vars(pipeline))
+        self.assertIn("hcc_code_index", vars(pipeline))
+        self.assertIn("hcc_prompt_sample", vars(pipeline))
+
+    def test_load_hcc_codes_reads_only_used_columns(self):
+        """Test that HCC codes are loaded as strings with missing and NaN cells blanked."""
+        with open(self.test_csv_path, "w") as f:
+            f.write("ICD-10-CM Codes,Description,Tags,Unused\n")
+            f.write("E11.9,,HCC19,1\n")
+            f.write("C34.90,Malignant neoplasm of lung,NaN,2\n")
+
+        pipeline = AnalysisPipeline(hcc_codes_path=self.test_csv_path)
+
+        self.assertEqual(
+            pipeline.hcc_codes,
+            [
+                {"ICD-10-CM Codes": "E11.9", "Description": "", "Tags": "HCC19"},
+                {"ICD-10-CM Codes": "C34.90", "Description": "Malignant neoplasm of lung", "Tags": ""},
+            ],
+        )
+
+    def test_load_hcc_codes_without_optional_columns(self):
+        """Test that columns missing from the CSV are loaded as blanks."""
+        with open(self.test_csv_path, "w") as f:
+            f.write("ICD-10-CM Codes\n")
+            f.write("E11.9\n")
+
+        pipeline = AnalysisPipeline(hcc_codes_path=self.test_csv_path)
+
+        self.assertEqual(pipeline.hcc_codes, [{"ICD-10-CM Codes": "E11.9", "Description": "", "Tags": ""}])
+
+    def test_load_hcc_codes_in_batches(self):
+        """Test that HCC codes spanning several record batches are all loaded in order."""
+        with open(self.test_csv_path, "w") as f:
+            f.write("ICD-10-CM Codes,Description,Tags\n")
+            for i in range(500):
+                f.write(f"E11.{i},Description {i},HCC{i}\n")
+
+        with patch('analyzer.graph.pipeline.HCC_CODES_BLOCK_SIZE', 1024):
+            hcc_codes = AnalysisPipeline(hcc_codes_path=self.test_csv_path).hcc_codes
+
+        self.assertEqual([code["ICD-10-CM Codes"] for code in hcc_codes], [f"E11.{i}" for i in range(500)])
+
     def test_process_conditions(self):
         """Test processing conditions through the pipeline."""
         # Create pipeline
@@ -529,6 +1382,19 @@ class TestAnalysisPipeline(unittest.TestCase):
         self.assertEqual(result.metadata["hcc_relevant_count"], 2)
         self.assertEqual(result.metadata["high_confidence_count"], 2)
 
+    def test_aprocess_conditions(self):
+        """Test processing conditions through the pipeline asynchronously."""
+        pipeline = AnalysisPipeline(hcc_codes_path=self.test_csv_path)
+        self.mock_graph.ainvoke = AsyncMock(side_effect=self.mock_graph.invoke.side_effect)
+
+        result = asyncio.run(pipeline.aprocess("test-doc-001", self.test_conditions))
+
+        self.mock_graph.ainvoke.assert_awaited_once()
+        self.mock_graph.invoke.assert_not_called()
+        self.assertIsInstance(result, AnalysisResult)
+        self.assertEqual(len(result.conditions), 2)
+        self.assertEqual(result.metadata["hcc_relevant_count"], 2)
+
     def test_handle_empty_conditions(self):
         """Test handling of empty conditions list."""
         # Create pipeline
@@ -565,6 +1431,190 @@ class TestAnalysisPipeline(unittest.TestCase):
         self.assertIn("Pipeline execution failed", result.metadata.get("error", ""))
 
 
+class TestPipelineShards(unittest.TestCase):
+    """Unit tests for LLM enrichment fan-out through the compiled graph."""
+
+    def setUp(self):
+        """Set up the test environment."""
+        self.test_csv_path = "temp_hcc_codes_shards.csv"
+        with open(self.test_csv_path, "w") as f:
+            f.write("ICD-10-CM Codes,Description,Tags\n")
+            f.write("E11.9,Type 2 diabetes mellitus without complications,HCC19\n")
+
+        _compiled_graph.cache_clear()
+        _reset_llm_clients()
+
+    def tearDown(self):
+        """Clean up after tests."""
+        _compiled_graph.cache_clear()
+        _reset_llm_clients()
+        if os.path.exists(self.test_csv_path):
+            os.remove(self.test_csv_path)
+
+    @patch('analyzer.graph.nodes.GeminiClient')
+    def test_errors_from_parallel_shards_are_merged(self, mock_client_class):
+        """Test that every shard's LLM error reaches the result."""
+        mock_client_class.return_value.analyze_hcc_relevance.side_effect = RuntimeError("quota")
+        conditions = [
+            Condition(id=f"cond-{i}", name="Headache", icd_code="R51.9")
+            for i in range(LLM_SHARD_SIZE + 1)
+        ]
+
+        result = AnalysisPipeline(hcc_codes_path=self.test_csv_path).process("test-doc-001", conditions)
+
+        self.assertEqual(result.errors, ["LLM enrichment failed: quota"] * 2)
+
+    @patch('analyzer.graph.nodes.GeminiClient')
+    def test_process_batch_shares_one_model_call(self, mock_client_class):
+        """Test that documents processed together are enriched in one batched call."""
+        mock_client = mock_client_class.return_value
+        mock_client.aanalyze_hcc_relevance_batch = AsyncMock(side_effect=lambda documents, hcc_codes: {
+            doc_id: [{"id": conditions[0]["id"], "hcc_relevant": False, "confidence": 0.8}]
+            for doc_id, conditions in documents
+        })
+        documents = [
+            (f"doc-{i}", [Condition(id=f"cond-{i}", name="Headache", icd_code="R51.9")])
+            for i in range(3)
+        ]
+
+        results = AnalysisPipeline(hcc_codes_path=self.test_csv_path).process_batch(documents)
+
+        mock_client.aanalyze_hcc_relevance_batch.assert_awaited_once()
+        self.assertEqual([r.document_id for r in results], ["doc-0", "doc-1", "doc-2"])
+        self.assertTrue(all(r.conditions[0].confidence == 0.8 for r in results))
+
+    @patch('analyzer.graph.nodes.GeminiClient')
+    def test_shards_of_one_document_are_not_batched_together(self, mock_client_class):
+        """Test that a document's shards are sent as concurrent calls, not one batched call."""
+        mock_client = mock_client_class.return_value
+        mock_client.aanalyze_hcc_relevance = AsyncMock(side_effect=lambda conditions, hcc_codes: [
+            {"id": condition["id"], "hcc_relevant": False, "confidence": 0.8} for condition in conditions
+        ])
+        mock_client.aanalyze_hcc_relevance_batch = AsyncMock()
+        conditions = [
+            Condition(id=f"cond-{i}", name="Headache", icd_code="R51.9")
+            for i in range(LLM_SHARD_SIZE + 1)
+        ]
+
+        result = asyncio.run(
+            AnalysisPipeline(hcc_codes_path=self.test_csv_path).aprocess("test-doc-001", conditions)
+        )
+
+        self.assertEqual(mock_client.aanalyze_hcc_relevance.await_count, 2)
+        mock_client.aanalyze_hcc_relevance_batch.assert_not_called()
+        self.assertTrue(all(c.confidence == 0.8 for c in result.conditions))
+
+    @patch('analyzer.graph.nodes.GeminiClient')
+    def test_process_batch_can_be_called_repeatedly(self, mock_client_class):
+        """Test that each process_batch call, on its own event loop, gets LLM results."""
+        mock_client_class.side_effect = lambda **kwargs: MagicMock(
+            aanalyze_hcc_relevance=AsyncMock(side_effect=lambda conditions, hcc_codes: [
+                {"id": conditions[0]["id"], "hcc_relevant": False, "confidence": 0.8}
+            ]),
+            aanalyze_hcc_relevance_batch=AsyncMock(side_effect=lambda documents, hcc_codes: {
+                doc_id: [{"id": conditions[0]["id"], "hcc_relevant": False, "confidence": 0.8}]
+                for doc_id, conditions in documents
+            }),
+        )
+        pipeline = AnalysisPipeline(hcc_codes_path=self.test_csv_path)
+
+        for _ in range(2):
+            documents = [
+                (f"doc-{i}", [Condition(id=f"cond-{i}", name="Headache", icd_code="R51.9")])
+                for i in range(2)
+            ]
+            results = pipeline.process_batch(documents)
+
+            self.assertTrue(all(not r.errors for r in results))
+            self.assertTrue(all(r.conditions[0].confidence == 0.8 for r in results))
+
+        # One client per event loop
+        self.assertEqual(mock_client_class.call_count, 2)
+
+
+class TestAnalysisService(unittest.TestCase):
+    """Unit tests for batch processing of local extraction results."""
+
+    def setUp(self):
+        """Set up a directory of extraction results."""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.data_dir = temp_dir.name
+        for i in range(4):
+            conditions = [{"id": f"cond-{i}", "name": "Diabetes"}] if i else []
+            with open(os.path.join(self.data_dir, f"doc{i}_extracted.json"), "w") as f:
+                json.dump({"document_id": f"doc{i}", "conditions": conditions}, f)
+
+        pipeline_patcher = patch("main.get_pipeline")
+        self.mock_pipeline = pipeline_patcher.start().return_value
+        self.addCleanup(pipeline_patcher.stop)
+
+    def test_files_are_processed_concurrently(self):
+        """Test that files are analyzed in parallel and each gets a status."""
+        barrier = threading.Barrier(3, timeout=5)
+
+        def process(document_id, conditions):
+            barrier.wait()  # Only passes if all three documents are in flight
+            return AnalysisResult(document_id=document_id, conditions=conditions)
+
+        self.mock_pipeline.process.side_effect = process
+        service = AnalysisService(self.data_dir, self.data_dir, "codes.csv", concurrency=3)
+
+        results = service.process_extractions()
+
+        statuses = {r.document_id: r.status for r in results}
+        self.assertEqual(
+            statuses, {"doc0": "warning", "doc1": "success", "doc2": "success", "doc3": "success"}
+        )
+        with open(os.path.join(self.data_dir, "doc1_analyzed.json")) as f:
+            saved = json.load(f)
+        self.assertEqual(saved["document_id"], "doc1")
+        self.assertEqual(saved["conditions"][0]["id"], "cond-1")
+
+    def test_directories_created_once_per_process(self):
+        """Test that services sharing directories create them only once."""
+        _make_directory.cache_clear()
+        self.addCleanup(_make_directory.cache_clear)
+        output_dir = os.path.join(self.data_dir, "output")
+
+        with patch("analyzer.storage.local.os.makedirs") as mock_makedirs:
+            AnalysisService(self.data_dir, output_dir, "codes.csv")
+            AnalysisService(self.data_dir, output_dir, "codes.csv")
+
+        self.assertEqual(mock_makedirs.call_count, 2)
+
+
+class TestMessageConsumer(unittest.TestCase):
+    """Unit tests for the MessageConsumer class."""
+
+    def test_extraction_file_with_nan_is_read(self):
+        """Test that extraction files written with NaN literals by json.dump are still read."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "doc-1_extracted.json")
+            with open(path, "w") as f:
+                json.dump({"conditions": [{"id": "cond-1", "confidence": float("nan")}]}, f)
+
+            data = MessageConsumer._read_extraction_file(path)
+
+        self.assertEqual(data["conditions"][0]["id"], "cond-1")
+
+
+class TestLocalStorageManager(unittest.TestCase):
+    """Unit tests for the LocalStorageManager class."""
+
+    def test_json_file_with_nan_is_read(self):
+        """Test that JSON files with NaN literals are read as the stdlib parser reads them."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = LocalStorageManager(temp_dir, temp_dir)
+            path = storage.output_dir / "doc-1_extracted.json"
+            path.write_text('{"score": NaN, "status": "Stable"}')
+
+            data = storage.read_json_file(path)
+
+        self.assertNotEqual(data["score"], data["score"])
+        self.assertEqual(data["status"], "Stable")
+
+
 class TestDatabaseIntegration(unittest.TestCase):
     """Unit tests for the database integration."""
 
@@ -572,21 +1622,20 @@ class TestDatabaseIntegration(unittest.TestCase):
         """Set up the test environment."""
         # Create patches but don't start them yet
         self.create_engine_patcher = patch('analyzer.db.database_integration.create_engine')
-        self.sessionmaker_patcher = patch('analyzer.db.database_integration.sessionmaker')
         self.uuid_patcher = patch('analyzer.db.database_integration.uuid')
 
         # Start patches
         self.mock_create_engine = self.create_engine_patcher.start()
-        self.mock_sessionmaker = self.sessionmaker_patcher.start()
         self.mock_uuid = self.uuid_patcher.start()
 
         # Configure UUID mock - important to mock the entire uuid module
         test_uuid = uuid.UUID('12345678-1234-5678-1234-567812345678')
         self.mock_uuid.UUID.return_value = test_uuid
 
-        # Configure session mock
-        self.mock_session = MagicMock()
-        self.mock_sessionmaker.return_value.return_value = self.mock_session
+        # Configure connection mock returned by engine.begin()
+        self.mock_engine = self.mock_create_engine.return_value
+        self.mock_conn = MagicMock()
+        self.mock_engine.begin.return_value.__enter__.return_value = self.mock_conn
 
         # Import db_updater here to use patched dependencies
         from analyzer.db.database_integration import DatabaseUpdater
@@ -596,7 +1645,6 @@ class TestDatabaseIntegration(unittest.TestCase):
         """Clean up after tests."""
         # Stop all patches
         self.create_engine_patcher.stop()
-        self.sessionmaker_patcher.stop()
         self.uuid_patcher.stop()
 
     def test_update_document_analysis_status(self):
@@ -610,14 +1658,65 @@ class TestDatabaseIntegration(unittest.TestCase):
             status="ANALYZING"
         )
 
-        # Verify session methods were called
-        self.mock_session.execute.assert_called_once()
-        self.mock_session.commit.assert_called_once()
+        # Verify the update ran inside a single transaction
+        self.mock_engine.begin.assert_called_once()
+        self.mock_conn.execute.assert_called_once()
+
+    def test_successful_flush_leaves_no_timer(self):
+        """Test that no flush timer is left running once the queue is written."""
+        self.db_updater.update_document_analysis_status(document_id="test-doc-001", status="ANALYZING")
+
+        self.mock_conn.execute.assert_called_once()
+        self.assertIsNone(self.db_updater._flush_timer)
+        self.assertFalse(self.db_updater._pending)
+
+    def test_update_statement_is_reused(self):
+        """Test that updates setting the same columns share one statement."""
+        for _ in range(2):
+            self.db_updater.update_document_analysis_status(
+                document_id="test-doc-001",
+                status="ANALYZING"
+            )
+
+        first_call, second_call = self.mock_conn.execute.call_args_list
+        self.assertIs(first_call[0][0], second_call[0][0])
+        self.assertIn("doc_id", first_call[0][1][0])
+
+    def test_batched_updates(self):
+        """Test that queued updates are flushed together in one transaction."""
+        from analyzer.db.database_integration import DatabaseUpdater
+        db_updater = DatabaseUpdater(batch_size=10)
+
+        db_updater.update_document_analysis_status(document_id="doc-1", status="ANALYZING")
+        db_updater.update_document_analysis_status(document_id="doc-2", status="ANALYZING")
+        db_updater.update_document_analysis_status(document_id="doc-1", status="FAILED")
+        self.mock_conn.execute.assert_not_called()
+
+        db_updater.flush()
+
+        # One transaction, a single executemany for the three same-shape updates
+        self.mock_engine.begin.assert_called_once()
+        self.mock_conn.execute.assert_called_once()
+        params = self.mock_conn.execute.call_args[0][1]
+        self.assertEqual(len(params), 3)
+        self.assertEqual(params[-1]["status"].name, "FAILED")
+
+    def test_partial_batch_flushed_after_interval(self):
+        """Test that a partial batch is written once the flush interval passes."""
+        from analyzer.db.database_integration import DatabaseUpdater
+        db_updater = DatabaseUpdater(batch_size=10, flush_interval=0.01)
+        flushed = threading.Event()
+        self.mock_engine.begin.return_value.__exit__.side_effect = lambda *args: flushed.set()
+
+        db_updater.update_document_analysis_status(document_id="doc-1", status="ANALYZING")
+
+        self.assertTrue(flushed.wait(5))
+        self.mock_conn.execute.assert_called_once()
 
     def test_error_handling(self):
         """Test error handling in database operations."""
-        # Configure session to raise an exception
-        self.mock_session.execute.side_effect = Exception("Test database error")
+        # Configure connection to raise an exception
+        self.mock_conn.execute.side_effect = Exception("Test database error")
 
         # Call the update method (should handle the error gracefully)
         self.db_updater.update_document_analysis_status(
@@ -625,9 +1724,67 @@ class TestDatabaseIntegration(unittest.TestCase):
             status="ANALYZING"
         )
 
-        # Verify session methods were called
-        self.mock_session.execute.assert_called_once()
-        self.mock_session.rollback.assert_called_once()
+        # Verify the statement was attempted and the update kept for a retry
+        self.mock_conn.execute.assert_called_once()
+        self.assertEqual(len(self.db_updater._pending), 1)
+        self.db_updater._flush_timer.cancel()
+
+    def test_failed_batch_is_retried_then_dropped(self):
+        """Test that a failed flush requeues its updates, up to the attempt limit."""
+        from analyzer.db.database_integration import DatabaseUpdater
+        db_updater = DatabaseUpdater(batch_size=10, flush_interval=60)
+        self.mock_conn.execute.side_effect = [Exception("Test database error"), None]
+
+        db_updater.update_document_analysis_status(document_id="doc-1", status="ANALYZING")
+        db_updater.flush()
+        db_updater.update_document_analysis_status(document_id="doc-1", status="COMPLETED")
+        db_updater.flush()
+
+        # The retried update goes out first, in the same executemany
+        params = self.mock_conn.execute.call_args[0][1]
+        self.assertEqual([p["status"].name for p in params], ["ANALYZING", "COMPLETED"])
+        self.assertFalse(db_updater._pending)
+
+        self.mock_conn.execute.side_effect = Exception("Test database error")
+        db_updater.update_document_analysis_status(document_id="doc-1", status="FAILED")
+        for _ in range(DatabaseUpdater.MAX_FLUSH_ATTEMPTS):
+            db_updater.flush()
+
+        self.assertFalse(db_updater._pending)
+        self.assertIsNone(db_updater._flush_timer)
+
+    def test_concurrent_flushes_commit_in_order(self):
+        """Test that a flush waits for a running flush to commit first."""
+        from analyzer.db.database_integration import DatabaseUpdater
+        db_updater = DatabaseUpdater(batch_size=10, flush_interval=60)
+        first_started = threading.Event()
+        release_first = threading.Event()
+        committed = []
+
+        def execute(stmt, params):
+            if not first_started.is_set():
+                first_started.set()
+                release_first.wait(5)
+            committed.extend(p["status"].name for p in params)
+
+        self.mock_conn.execute.side_effect = execute
+
+        db_updater.update_document_analysis_status(document_id="doc-1", status="ANALYZING")
+        first = threading.Thread(target=db_updater.flush)
+        first.start()
+        self.assertTrue(first_started.wait(5))
+
+        db_updater.update_document_analysis_status(document_id="doc-1", status="COMPLETED")
+        second = threading.Thread(target=db_updater.flush)
+        second.start()
+        second.join(0.05)
+        # The second flush is blocked until the first one has committed
+        self.assertEqual(committed, [])
+
+        release_first.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(committed, ["ANALYZING", "COMPLETED"])
 
 
 if __name__ == "__main__":
@@ -13,11 +13,16 @@ from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from gateway.core.config import settings
-from gateway.core.security import create_access_token
+from gateway.core.security import get_access_token
 from gateway.db.models.user import User
 from gateway.db.session import get_db
 from gateway.schemas.token import Token
 from gateway.schemas.user import UserCreate, UserRead
+from gateway.utils.password import (
+    DUMMY_PASSWORD_HASH,
+    verify_and_update_password,
+    verify_password,
+)
 
 logger = structlog.get_logger(__name__)
 
@@ -47,55 +52,54 @@ async def login(
     Raises:
         HTTPException: If authentication fails
     """
-    user = await User.get_by_email(db, email=form_data.username)
+    log = logger.bind(email=form_data.username)
 
-    if not user:
-        logger.warning(
-            "Login attempt with invalid email",
-            email=form_data.username,
-        )
+    credentials = await User.auth_fetch(db, email=form_data.username)
+
+    if credentials is None:
+        # Verify against a dummy hash so unknown emails take as long as
+        # wrong passwords
+        verify_password(form_data.password, DUMMY_PASSWORD_HASH)
+        log.warning("Login attempt with invalid email")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    if not user.verify_password(form_data.password):
-        logger.warning(
-            "Login attempt with invalid password",
-            email=form_data.username,
-        )
+    user_id, hashed_password, is_active = credentials
+
+    password_ok, new_hash = verify_and_update_password(
+        form_data.password, hashed_password
+    )
+
+    if not password_ok:
+        log.warning("Login attempt with invalid password")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    if not user.is_active:
-        logger.warning(
-            "Login attempt for inactive user",
-            email=form_data.username,
-        )
+    if not is_active:
+        log.warning("Login attempt for inactive user")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Inactive user",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Update last login
-    await user.update_last_login(db)
+    # Update last login (and upgrade a legacy password hash); committed with
+    # the request's session
+    await User.touch_last_login(db, id=user_id, hashed_password=new_hash)
 
     # Create access token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        subject=str(user.id), expires_delta=access_token_expires
+    access_token = get_access_token(
+        subject=str(user_id), expires_delta=access_token_expires
     )
 
-    logger.info(
-        "User logged in successfully",
-        user_id=str(user.id),
-        email=user.email,
-    )
+    log.info("User logged in successfully", user_id=str(user_id))
 
     return {
         "access_token": access_token,
@@ -127,14 +131,13 @@ async def register(
     Raises:
         HTTPException: If registration fails
     """
+    log = logger.bind(email=user_in.email)
+
     # Check if user already exists
     existing_user = await User.get_by_email(db, email=user_in.email)
 
     if existing_user:
-        logger.warning(
-            "Registration attempt with existing email",
-            email=user_in.email,
-        )
+        log.warning("Registration attempt with existing email")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered",
@@ -148,10 +151,6 @@ async def register(
         full_name=user_in.full_name,
     )
 
-    logger.info(
-        "User registered successfully",
-        user_id=str(user.id),
-        email=user.email,
-    )
+    log.info("User registered successfully", user_id=str(user.id))
 
     return user
\ No newline at end of file
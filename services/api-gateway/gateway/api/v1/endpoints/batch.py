@@ -4,9 +4,10 @@ Batch processing endpoints for the API Gateway.
 This module defines endpoints for batch document processing operations.
 """
 
+import asyncio
 import uuid
 from datetime import datetime, timezone
-from typing import Any, List
+from typing import Any, Dict, List, Union
 
 import structlog
 from fastapi import (
@@ -16,7 +17,7 @@ from fastapi import (
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from gateway.core.dependencies import get_current_user, require_admin_role
-from gateway.db.models.document import ProcessingStatus, StorageType
+from gateway.db.models.document import Document, ProcessingStatus, StorageType
 from gateway.db.models.user import User
 from gateway.db.session import get_db
 from gateway.schemas.document import DocumentList, DocumentCreate
@@ -28,6 +29,9 @@ logger = structlog.get_logger(__name__)
 
 router = APIRouter()
 
+# Maximum number of files of one batch upload handled at the same time
+MAX_CONCURRENT_UPLOADS = 8
+
 
 @router.post(
     "/upload",
@@ -89,69 +93,83 @@ async def batch_upload(
             detail=f"Maximum batch size is {max_batch_size} files",
         )
 
-    # Track created documents
-    created_documents = []
-    errors = []
+    # Files are read, stored and published concurrently, capped so a batch
+    # cannot flood the storage backend. The request's database session does
+    # not support concurrent statements, so inserts are serialized.
+    upload_slots = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+    db_lock = asyncio.Lock()
 
-    # Process each file
-    for file in files:
-        try:
-            # Validate file type
-            if not document_service.is_valid_document_type(file.content_type):
-                errors.append({
-                    "filename": file.filename,
-                    "error": "Invalid document type"
-                })
-                continue
+    async def process_file(file: UploadFile) -> Union[Document, Dict[str, str]]:
+        """
+        Store, record and publish a single uploaded file.
 
-            # Read file content
-            content = await file.read()
+        Args:
+            file: Uploaded document file
 
-            # Store the document
-            storage_info = await storage_service.store_document(
-                content=content,
-                filename=file.filename,
-                content_type=file.content_type,
-            )
+        Returns:
+            The created document, or an error entry for the file
+        """
+        async with upload_slots:
+            try:
+                # Validate file type
+                if not document_service.is_valid_document_type(file.content_type):
+                    return {
+                        "filename": file.filename,
+                        "error": "Invalid document type"
+                    }
+
+                # Stream the document to storage without reading it whole
+                storage_info, file_size = await storage_service.store_document_stream(
+                    file,
+                    filename=file.filename,
+                    content_type=file.content_type,
+                )
 
-            # Create document in database
-            document_in = DocumentCreate(
-                filename=file.filename,
-                file_size=len(content),
-                content_type=file.content_type,
-                storage_type=StorageType[storage_info["storage_type"].upper()].value.upper(),
-                storage_path=storage_info["storage_path"],
-                description=None,
-                priority=priority,
-                user_id=current_user.id,
-                status=ProcessingStatus.PENDING,
-                is_processed=False,
-                processing_started_at=datetime.now(timezone.utc),
-                processing_completed_at=None,
-            )
+                # Create document in database
+                document_in = DocumentCreate(
+                    filename=file.filename,
+                    file_size=file_size,
+                    content_type=file.content_type,
+                    storage_type=StorageType[storage_info["storage_type"].upper()].value.upper(),
+                    storage_path=storage_info["storage_path"],
+                    description=None,
+                    priority=priority,
+                    user_id=current_user.id,
+                    status=ProcessingStatus.PENDING,
+                    is_processed=False,
+                    processing_started_at=datetime.now(timezone.utc),
+                    processing_completed_at=None,
+                )
 
-            document = await document_service.create_document(db, document_in)
-            created_documents.append(document)
+                async with db_lock:
+                    document = await document_service.create_document(db, document_in)
 
-            await message_broker.publish_document_uploaded(
-                document_id=str(document.id),
-                storage_path=document.storage_path,
-                storage_type=document.storage_type.value,
-                content_type=document.content_type,
-                priority=priority,
-                document_content=content
-            )
+                await message_broker.publish_document_uploaded(
+                    document_id=str(document.id),
+                    storage_path=document.storage_path,
+                    storage_type=document.storage_type.value,
+                    content_type=document.content_type,
+                    priority=priority,
+                )
 
-        except Exception as e:
-            logger.exception(
-                "Error processing file in batch upload",
-                filename=file.filename,
-                error=str(e),
-            )
-            errors.append({
-                "filename": file.filename,
-                "error": str(e)
-            })
+                return document
+
+            except Exception as e:
+                logger.exception(
+                    "Error processing file in batch upload",
+                    filename=file.filename,
+                    error=str(e),
+                )
+                return {
+                    "filename": file.filename,
+                    "error": str(e)
+                }
+
+    # Process all files, keeping the order they were uploaded in
+    results = await asyncio.gather(*(process_file(file) for file in files))
+
+    created_documents = [r for r in results if isinstance(r, Document)]
+    errors = [r for r in results if not isinstance(r, Document)]
 
     # Log summary
     logger.info(
@@ -233,12 +251,15 @@ async def batch_process(
     # Track successful and failed operations
     successful = []
     failed = []
+    pending_messages = []
+
+    # Fetch all requested documents with a single query
+    documents = await document_service.get_documents_by_ids(db, document_ids)
 
     # Process each document
     for doc_id in document_ids:
         try:
-            # Get document
-            document = await document_service.get_document(db, doc_id)
+            document = documents.get(doc_id)
 
             if not document:
                 failed.append({
@@ -266,14 +287,14 @@ async def batch_process(
                 ProcessingStatus.PENDING,
             )
 
-            # Publish message to processing queue
-            await message_broker.publish_document_uploaded(
+            # Queue the message; the batch is published after the loop
+            pending_messages.append(message_broker.document_uploaded_message(
                 document_id=str(document.id),
                 storage_path=document.storage_path,
                 storage_type=document.storage_type.value,
                 content_type=document.content_type,
                 priority=True,  # Prioritize reprocessing
-            )
+            ))
 
             successful.append(str(doc_id))
 
@@ -288,6 +309,9 @@ async def batch_process(
                 "error": str(e)
             })
 
+    # Publish all reprocessing messages with a single wait for confirms
+    await message_broker.publish_many(pending_messages)
+
     # Log summary
     logger.info(
         "Batch processing completed",
@@ -360,11 +384,13 @@ async def batch_delete(
     successful = []
     failed = []
 
+    # Fetch all requested documents with a single query
+    documents = await document_service.get_documents_by_ids(db, document_ids)
+
     # Process each document
     for doc_id in document_ids:
         try:
-            # Get document
-            document = await document_service.get_document(db, doc_id)
+            document = documents.get(doc_id)
 
             if not document:
                 failed.append({
@@ -62,6 +62,9 @@ class Settings(BaseSettings):
     SECRET_KEY: str = Field(default_factory=lambda: secrets.token_urlsafe(32))
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
     ALGORITHM: str = "HS256"
+    # Window during which repeated logins of a user reuse one signed token.
+    # Off by default: reused tokens can't be told apart or revoked per session
+    ACCESS_TOKEN_REUSE_SECONDS: int = 0
 
     # CORS settings
     CORS_ORIGINS: List[Union[AnyHttpUrl, str]] = ["*"]
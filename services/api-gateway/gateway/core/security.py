@@ -5,8 +5,9 @@ This module provides functions and utilities for authentication,
 authorization, and security operations.
 """
 
+import time
 from datetime import datetime, timedelta
-from typing import Any, Optional, Union
+from typing import Any, Dict, Optional, Tuple, Union
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -23,6 +24,10 @@ oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_PREFIX}/auth/login"
 )
 
+# Signed tokens for the current reuse window: {(subject, expires_delta): token}
+_issued_tokens: Dict[Tuple[str, Optional[timedelta]], str] = {}
+_issued_tokens_window: Optional[int] = None
+
 
 def create_access_token(
         subject: Union[str, Any], expires_delta: Optional[timedelta] = None
@@ -52,6 +57,45 @@ def create_access_token(
     return encoded_jwt
 
 
+def get_access_token(
+        subject: Union[str, Any], expires_delta: Optional[timedelta] = None
+) -> str:
+    """
+    Get a JWT access token, reusing one signed earlier in the same time window.
+
+    When ``ACCESS_TOKEN_REUSE_SECONDS`` is set, repeated logins of the same
+    subject within one window receive the same token instead of re-signing a
+    new one, so they expire up to a window early and can't be told apart.
+    Tokens are kept in memory for the current window only. With the default
+    of 0 every call signs a new token.
+
+    Args:
+        subject: The subject of the token (typically user ID)
+        expires_delta: Optional expiration time delta
+
+    Returns:
+        JWT token as a string
+    """
+    global _issued_tokens_window
+
+    reuse_seconds = settings.ACCESS_TOKEN_REUSE_SECONDS
+    if reuse_seconds <= 0:
+        return create_access_token(subject, expires_delta)
+
+    window = int(time.time() // reuse_seconds)
+    if window != _issued_tokens_window:
+        _issued_tokens.clear()
+        _issued_tokens_window = window
+
+    key = (str(subject), expires_delta)
+    token = _issued_tokens.get(key)
+    if token is None:
+        token = create_access_token(subject, expires_delta)
+        _issued_tokens[key] = token
+
+    return token
+
+
 async def get_current_user(
         token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
 ):
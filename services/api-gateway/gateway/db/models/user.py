@@ -4,10 +4,11 @@ User model for the API Gateway.
 This module defines the User model for authentication and authorization.
 """
 
+import uuid
 from datetime import datetime
-from typing import Optional, Type, TypeVar
+from typing import Optional, Tuple, Type, TypeVar
 
-from sqlalchemy import Boolean, DateTime, String, select
+from sqlalchemy import Boolean, DateTime, String, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -58,6 +59,53 @@ class User(Base):
         result = await db.execute(stmt)
         return result.scalars().first()
 
+    @classmethod
+    async def auth_fetch(
+            cls, db: AsyncSession, email: str
+    ) -> Optional[Tuple[uuid.UUID, str, bool]]:
+        """
+        Fetch only the columns needed to authenticate a user.
+
+        Args:
+            db: Database session
+            email: User email
+
+        Returns:
+            A ``(id, hashed_password, is_active)`` tuple if found, None otherwise
+        """
+        stmt = select(cls.id, cls.hashed_password, cls.is_active).where(
+            cls.email == email
+        )
+        result = await db.execute(stmt)
+        row = result.first()
+        return tuple(row) if row is not None else None
+
+    @classmethod
+    async def touch_last_login(
+            cls,
+            db: AsyncSession,
+            id: uuid.UUID,
+            hashed_password: Optional[str] = None,
+    ) -> None:
+        """
+        Set the last login timestamp without loading the user.
+
+        The update joins the request's transaction and is committed together
+        with it by the session dependency.
+
+        Args:
+            db: Database session
+            id: User ID
+            hashed_password: Replacement password hash, e.g. when upgrading a
+                legacy bcrypt hash
+        """
+        values = {"last_login": func.now()}
+        if hashed_password is not None:
+            values["hashed_password"] = hashed_password
+
+        stmt = update(cls).where(cls.id == id).values(**values)
+        await db.execute(stmt)
+
     @classmethod
     async def create_user(
             cls: Type[T],
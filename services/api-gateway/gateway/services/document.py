@@ -6,7 +6,7 @@ This module provides business logic for document operations.
 
 import time
 import uuid
-from typing import List, Optional, Tuple, Any
+from typing import Dict, Iterable, List, Optional, Tuple, Any
 
 import structlog
 from fastapi import Depends
@@ -118,6 +118,34 @@ class DocumentService:
 
         return document
 
+    async def get_documents_by_ids(
+            self, db: AsyncSession, document_ids: Iterable[uuid.UUID]
+    ) -> Dict[uuid.UUID, Document]:
+        """
+        Get several documents by ID with a single query.
+
+        Args:
+            db: Database session
+            document_ids: Document IDs
+
+        Returns:
+            Found documents keyed by ID; missing IDs are absent
+        """
+        start_time = time.time()
+
+        ids = list(set(document_ids))
+        if not ids:
+            return {}
+
+        result = await db.execute(select(Document).where(Document.id.in_(ids)))
+        documents = {document.id: document for document in result.scalars()}
+
+        # Record query time
+        query_time = time.time() - start_time
+        DB_QUERY_TIME.labels(query_type="select", table="documents").observe(query_time)
+
+        return documents
+
     async def get_documents(
             self,
             db: AsyncSession,
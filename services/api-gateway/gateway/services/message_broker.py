@@ -5,11 +5,12 @@ This module provides functionality for publishing messages to RabbitMQ
 for communication with other services.
 """
 
+import asyncio
 import json
 import logging
 import time
 import uuid
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import structlog
 from aio_pika import Message, DeliveryMode, ExchangeType
@@ -154,13 +155,74 @@ class MessageBrokerService:
             )
             # Don't raise the exception further
 
+    async def publish_many(self, messages: List[Dict[str, Any]]) -> None:
+        """
+        Publish several messages, waiting for their confirms together.
+
+        All messages are put on the channel before any publisher confirm is
+        awaited, so the batch costs about one broker round trip instead of
+        one per message. Failures are handled per message as in
+        ``publish_message``.
+
+        Args:
+            messages: Keyword arguments for ``publish_message``, one dict per
+                message
+        """
+        if not messages:
+            return
+
+        # Initialize once up front rather than racing in every publish
+        if getattr(self, "exchange", None) is None or getattr(self, "queue", None) is None:
+            try:
+                await self._initialize()
+            except Exception as e:
+                logger.error(f"Failed to initialize RabbitMQ: {str(e)}")
+                return
+
+        await asyncio.gather(
+            *(self.publish_message(**message) for message in messages)
+        )
+
+    @staticmethod
+    def document_uploaded_message(
+            document_id: str,
+            storage_path: str,
+            storage_type: str,
+            content_type: str,
+            priority: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Build the publish arguments of a document.uploaded message.
+
+        Args:
+            document_id: Document ID
+            storage_path: Path to the document in storage
+            storage_type: Storage type (local, s3, gcs)
+            content_type: MIME type of the document
+            priority: Whether to prioritize processing
+
+        Returns:
+            Keyword arguments for ``publish_message``
+        """
+        return {
+            "routing_key": "document.uploaded",
+            "message": {
+                "document_id": document_id,
+                "storage_path": storage_path,
+                "storage_type": storage_type,
+                "content_type": content_type,
+            },
+            "message_type": "document.uploaded",
+            "priority": 5 if priority else None,
+        }
+
     async def publish_document_uploaded(
             self,
             document_id: str,
             storage_path: str,
             storage_type: str,
             content_type: str,
-            document_content: str,
+            document_content: Optional[str] = None,
             priority: bool = False,
     ) -> None:
         """
@@ -177,20 +239,16 @@ class MessageBrokerService:
         Raises:
             Exception: If the message cannot be published
         """
-        message = {
-            "document_id": document_id,
-            "storage_path": storage_path,
-            "storage_type": storage_type,
-            "content_type": content_type,
-            # "document_content": document_content,
-        }
-
+        # "document_content" is deliberately not sent; consumers read the
+        # document from storage
         await self.publish_message(
-            routing_key="document.uploaded",
-            message=message,
-            message_type="document.uploaded",
-            # priority=5 if priority else None,
-            priority=None,
+            **self.document_uploaded_message(
+                document_id=document_id,
+                storage_path=storage_path,
+                storage_type=storage_type,
+                content_type=content_type,
+                priority=priority,
+            )
         )
 
     async def publish_extraction_completed(
@@ -8,11 +8,12 @@ from various storage backends (local, S3, GCS).
 import os
 import time
 import uuid
-from typing import Dict, Tuple
+from typing import BinaryIO, Dict, Tuple
 
 import aiofiles
 import boto3
 import structlog
+from fastapi import UploadFile
 from google.cloud import storage
 
 from gateway.core.config import settings
@@ -20,6 +21,9 @@ from gateway.utils.metrics import STORAGE_OPERATIONS, STORAGE_OPERATION_TIME
 
 logger = structlog.get_logger(__name__)
 
+# Size of the chunks uploaded files are copied to storage in
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class StorageService:
     """Service for document storage operations."""
@@ -95,6 +99,62 @@ class StorageService:
             "storage_path": storage_path,
         }
 
+    async def store_document_stream(
+            self,
+            file: UploadFile,
+            filename: str,
+            content_type: str,
+    ) -> Tuple[Dict[str, str], int]:
+        """
+        Store an uploaded document without loading it into memory at once.
+
+        The upload is copied to the configured storage backend in chunks of
+        ``STREAM_CHUNK_SIZE`` bytes (or handed to the backend's streaming
+        uploader), so memory use does not grow with the document size.
+
+        Args:
+            file: Uploaded document file
+            filename: Document filename
+            content_type: Document MIME type
+
+        Returns:
+            Tuple of (storage information, document size in bytes)
+        """
+        start_time = time.time()
+
+        # Generate a unique path
+        unique_id = str(uuid.uuid4())
+        storage_path = f"{unique_id}/{filename}"
+
+        # Store in the appropriate backend
+        size = 0
+        if self.storage_type == "local":
+            size = await self._store_local_stream(file, storage_path)
+
+        elif self.storage_type == "s3":
+            size = await self._store_s3_stream(file.file, storage_path, content_type)
+
+        elif self.storage_type == "gcs":
+            size = await self._store_gcs_stream(file.file, storage_path, content_type)
+
+        # Record metrics
+        duration = time.time() - start_time
+        STORAGE_OPERATIONS.labels(operation="store", storage_type=self.storage_type).inc()
+        STORAGE_OPERATION_TIME.labels(operation="store", storage_type=self.storage_type).observe(duration)
+
+        logger.info(
+            "Document stored",
+            storage_type=self.storage_type,
+            storage_path=storage_path,
+            content_type=content_type,
+            size=size,
+        )
+
+        return {
+            "storage_type": self.storage_type,
+            "storage_path": storage_path,
+        }, size
+
     async def get_document(
             self, storage_type: str, storage_path: str
     ) -> Tuple[bytes, str, str]:
@@ -203,6 +263,46 @@ class StorageService:
         async with aiofiles.open(full_path, "wb") as f:
             await f.write(content)
 
+    async def _store_local_stream(self, file: UploadFile, storage_path: str) -> int:
+        """
+        Copy an uploaded document to local storage chunk by chunk.
+
+        Args:
+            file: Uploaded document file
+            storage_path: Path to store the document
+
+        Returns:
+            Number of bytes written
+        """
+        # Create directory if it doesn't exist
+        full_path = self.local_storage_path / storage_path
+        os.makedirs(full_path.parent, exist_ok=True)
+
+        # Write file
+        size = 0
+        async with aiofiles.open(full_path, "wb") as f:
+            while chunk := await file.read(STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                await f.write(chunk)
+
+        return size
+
+    @staticmethod
+    def _remaining_size(file_obj: BinaryIO) -> int:
+        """
+        Get the number of bytes left to read in a seekable file.
+
+        Args:
+            file_obj: Seekable file object
+
+        Returns:
+            Bytes between the current position and the end of the file
+        """
+        position = file_obj.tell()
+        end = file_obj.seek(0, os.SEEK_END)
+        file_obj.seek(position)
+        return end - position
+
     async def _get_local(self, storage_path: str) -> Tuple[bytes, str]:
         """
         Get a document from local storage.
@@ -272,6 +372,35 @@ class StorageService:
                 ContentType=content_type,
             )
 
+    async def _store_s3_stream(
+            self, file_obj: BinaryIO, storage_path: str, content_type: str
+    ) -> int:
+        """
+        Stream a document to S3 using a (multipart) file upload.
+
+        Args:
+            file_obj: Seekable file object with the document content
+            storage_path: Path to store the document
+            content_type: Document MIME type
+
+        Returns:
+            Number of bytes uploaded
+        """
+        import aioboto3
+
+        size = self._remaining_size(file_obj)
+
+        session = aioboto3.Session()
+        async with session.client("s3", region_name=settings.S3_REGION) as s3:
+            await s3.upload_fileobj(
+                file_obj,
+                self.s3_bucket,
+                storage_path,
+                ExtraArgs={"ContentType": content_type},
+            )
+
+        return size
+
     async def _get_s3(self, storage_path: str) -> Tuple[bytes, str]:
         """
         Get a document from S3.
@@ -360,6 +489,36 @@ class StorageService:
             lambda: blob.upload_from_string(content, content_type=content_type)
         )
 
+    async def _store_gcs_stream(
+            self, file_obj: BinaryIO, storage_path: str, content_type: str
+    ) -> int:
+        """
+        Stream a document to GCS from a file object.
+
+        Args:
+            file_obj: Seekable file object with the document content
+            storage_path: Path to store the document
+            content_type: Document MIME type
+
+        Returns:
+            Number of bytes uploaded
+        """
+        import asyncio
+
+        size = self._remaining_size(file_obj)
+        blob = self.gcs_bucket.blob(storage_path)
+
+        # Run in a thread to avoid blocking
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(
+            None,
+            lambda: blob.upload_from_file(
+                file_obj, size=size, content_type=content_type
+            )
+        )
+
+        return size
+
     async def _get_gcs(self, storage_path: str) -> Tuple[bytes, str]:
         """
         Get a document from GCS.
@@ -4,10 +4,24 @@ Password hashing utilities.
 This module provides functions for password hashing and verification.
 """
 
+from typing import Optional, Tuple
+
 from passlib.context import CryptContext
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context. New hashes use argon2id; bcrypt is kept only to
+# verify legacy hashes, which are upgraded on the next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=2,
+    argon2__memory_cost=65536,
+    argon2__parallelism=1,
+)
+
+# Hash verified against when no user matches, so unknown emails cost as much
+# as wrong passwords and response timing does not reveal which accounts exist
+DUMMY_PASSWORD_HASH = pwd_context.hash("dummy-password-for-timing")
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -24,6 +38,23 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(
+        plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and rehash it if its hash uses a deprecated scheme.
+
+    Args:
+        plain_password: The plain-text password
+        hashed_password: The hashed password
+
+    Returns:
+        Tuple of (matches, new_hash), where new_hash is None unless the
+        password matched a hash that should be replaced
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password: str) -> str:
     """
     Hash a password.
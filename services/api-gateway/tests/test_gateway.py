@@ -0,0 +1,180 @@
+"""
+Unit tests for the HCC API Gateway.
+
+This module contains tests for the gateway components, including access token
+issuing, password hashing, and the login endpoint.
+"""
+
+import itertools
+import unittest
+import uuid
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from passlib.hash import bcrypt
+
+from gateway.api.v1.endpoints import auth
+from gateway.core import security
+from gateway.core.config import settings
+from gateway.services.message_broker import MessageBrokerService
+from gateway.utils.password import (
+    DUMMY_PASSWORD_HASH,
+    get_password_hash,
+    verify_and_update_password,
+)
+
+
+class TestAccessTokens(unittest.TestCase):
+    """Unit tests for issuing access tokens."""
+
+    def setUp(self):
+        """Start each test without previously issued tokens."""
+        security._issued_tokens.clear()
+        security._issued_tokens_window = None
+        self.addCleanup(security._issued_tokens.clear)
+
+        # Every signed token is distinct
+        counter = itertools.count()
+        patcher = patch.object(
+            security, "create_access_token",
+            side_effect=lambda subject, expires_delta: f"token-{next(counter)}",
+        )
+        self.mock_create = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tokens_not_reused_by_default(self):
+        """Test that every login gets a freshly signed token unless reuse is enabled."""
+        with patch.object(settings, "ACCESS_TOKEN_REUSE_SECONDS", 0):
+            first = security.get_access_token("user-1", timedelta(minutes=5))
+            second = security.get_access_token("user-1", timedelta(minutes=5))
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.mock_create.call_count, 2)
+        self.assertFalse(security._issued_tokens)
+        self.assertEqual(settings.model_fields["ACCESS_TOKEN_REUSE_SECONDS"].default, 0)
+
+    @patch("gateway.core.security.time.time")
+    def test_tokens_reused_within_window_only(self, mock_time):
+        """Test that tokens are reused within a window and re-signed once it rolls over."""
+        expires = timedelta(minutes=5)
+        with patch.object(settings, "ACCESS_TOKEN_REUSE_SECONDS", 60):
+            mock_time.return_value = 120.0
+            first = security.get_access_token("user-1", expires)
+            mock_time.return_value = 179.0
+            same_window = security.get_access_token("user-1", expires)
+            other_user = security.get_access_token("user-2", expires)
+            mock_time.return_value = 180.0
+            next_window = security.get_access_token("user-1", expires)
+
+        self.assertEqual(first, same_window)
+        self.assertNotEqual(first, other_user)
+        self.assertNotEqual(first, next_window)
+        self.assertEqual(self.mock_create.call_count, 3)
+        # Only the current window's tokens are kept
+        self.assertEqual(list(security._issued_tokens), [("user-1", expires)])
+
+
+class TestPasswords(unittest.TestCase):
+    """Unit tests for password hashing."""
+
+    def test_legacy_bcrypt_hash_verified_and_rehashed(self):
+        """Test that a legacy bcrypt hash still verifies and is upgraded to argon2."""
+        legacy_hash = bcrypt.hash("secret")
+        self.assertTrue(legacy_hash.startswith("$2b$"))
+
+        password_ok, new_hash = verify_and_update_password("secret", legacy_hash)
+
+        self.assertTrue(password_ok)
+        self.assertTrue(new_hash.startswith("$argon2id$"))
+        self.assertEqual(verify_and_update_password("secret", new_hash), (True, None))
+
+    def test_legacy_bcrypt_hash_not_rehashed_on_wrong_password(self):
+        """Test that a wrong password against a legacy hash is rejected without a new hash."""
+        legacy_hash = bcrypt.hash("secret")
+
+        self.assertEqual(verify_and_update_password("wrong", legacy_hash), (False, None))
+
+    def test_argon2_hash_not_rehashed(self):
+        """Test that a current argon2 hash verifies without being replaced."""
+        hashed_password = get_password_hash("secret")
+
+        self.assertTrue(hashed_password.startswith("$argon2id$"))
+        self.assertEqual(verify_and_update_password("secret", hashed_password), (True, None))
+
+
+class TestLogin(unittest.IsolatedAsyncioTestCase):
+    """Unit tests for the login endpoint."""
+
+    def setUp(self):
+        """Patch the user lookups and token issuing used by the endpoint."""
+        self.db = MagicMock()
+        self.user_id = uuid.uuid4()
+
+        patcher = patch.object(auth.User, "auth_fetch", new_callable=AsyncMock)
+        self.mock_auth_fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch.object(auth.User, "touch_last_login", new_callable=AsyncMock)
+        self.mock_touch_last_login = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch.object(auth, "get_access_token", return_value="token")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def form(password):
+        """Build login form data for the test user."""
+        return MagicMock(username="user@example.com", password=password)
+
+    async def test_unknown_email_verified_against_dummy_hash(self):
+        """Test that an unknown email costs a password verification like a wrong password."""
+        self.mock_auth_fetch.return_value = None
+
+        with patch.object(auth, "verify_password", return_value=False) as mock_verify:
+            with self.assertRaises(HTTPException) as context:
+                await auth.login(db=self.db, form_data=self.form("secret"))
+
+        self.assertEqual(context.exception.status_code, 401)
+        mock_verify.assert_called_once_with("secret", DUMMY_PASSWORD_HASH)
+        self.mock_touch_last_login.assert_not_called()
+
+    async def test_legacy_hash_upgraded_on_login(self):
+        """Test that logging in with a legacy bcrypt hash stores an argon2 hash."""
+        self.mock_auth_fetch.return_value = (self.user_id, bcrypt.hash("secret"), True)
+
+        response = await auth.login(db=self.db, form_data=self.form("secret"))
+
+        self.assertEqual(response["access_token"], "token")
+        new_hash = self.mock_touch_last_login.call_args.kwargs["hashed_password"]
+        self.assertTrue(new_hash.startswith("$argon2id$"))
+
+    async def test_argon2_hash_kept_on_login(self):
+        """Test that logging in with a current hash does not store a new one."""
+        self.mock_auth_fetch.return_value = (self.user_id, get_password_hash("secret"), True)
+
+        await auth.login(db=self.db, form_data=self.form("secret"))
+
+        self.mock_touch_last_login.assert_awaited_once_with(
+            self.db, id=self.user_id, hashed_password=None
+        )
+
+
+class TestMessageBroker(unittest.TestCase):
+    """Unit tests for building broker messages."""
+
+    def test_document_uploaded_message_priority(self):
+        """Test that prioritized documents are published with a message priority."""
+        arguments = dict(
+            document_id="doc-1", storage_path="documents/doc-1.txt", storage_type="local", content_type="text/plain"
+        )
+
+        self.assertIsNone(MessageBrokerService.document_uploaded_message(**arguments)["priority"])
+        self.assertEqual(
+            MessageBrokerService.document_uploaded_message(**arguments, priority=True)["priority"], 5
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()